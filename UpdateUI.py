@@ -1,74 +1,34 @@
-import random
-import pygame
-import time, json
-import threading
-from pathlib import Path
-from mutagen.easyid3 import EasyID3
-from mutagen.flac import FLAC
-from mutagen.mp4 import MP4
+import json
+import sys
+import time
+# 其他模块导入之前的时间点，--profile-startup 的各阶段从这里算起
+STARTED = time.perf_counter()
 import tkinter as tk
-from tkinter import font
-import os
 from io import BytesIO
 import base64
-from PIL import ImageTk, Image, ImageDraw
-import ctypes
-from fontTools.ttLib import TTFont
-
-# 手动定义HWND_BROADCAST常量（0xFFFF，解决低版本ctypes未定义的问题）
-HWND_BROADCAST = 0xFFFF
-
-
-def get_font_real_family(font_path):
-    # 解析TTF字体真实族名（nameID=1）
-    ttfont = TTFont(font_path)
-    family_names = [name.string for name in ttfont['name'].names if name.nameID == 1]
-    for name in family_names:
-        if isinstance(name, bytes):
-            name = name.decode('utf-8', errors='ignore')
-        if name.strip():
-            return name
-    return os.path.splitext(os.path.basename(font_path))[0]  # 备选：用文件名
-
-
-def register_font_to_system(font_path):
-    # 注册字体到系统
-    font_path_unicode = os.path.abspath(font_path).replace('/', '\\')
-    added = ctypes.windll.gdi32.AddFontResourceW(font_path_unicode)
-    if added == 0:
-        raise ValueError(f"字体注册失败，文件无效: {font_path}")
-
-    # 发送字体更新广播（用手动定义的HWND_BROADCAST）
-    ctypes.windll.user32.SendMessageTimeoutW(
-        HWND_BROADCAST,  # 替换原wintypes.HWND_BROADCAST
-        0x001D,  # WM_FONTCHANGE
-        0, 0,
-        0x0002,  # SMTO_ABORTIFHUNG
-        1000,
-        None
-    )
-    return True
-
-
-def get_font(font_path, size=10, weight='normal', slant='roman', underline=0, overstrike=0):
-    # 1. 注册字体到系统
-    register_font_to_system(font_path)
-
-    # 2. 获取真实族名
-    family_name = get_font_real_family(font_path)
-
-    # 3. 等待系统刷新
-    time.sleep(0.5)
-
-    # 4. 创建字体对象
-    return font.Font(
-        family=family_name,
-        size=size,
-        weight=weight,
-        slant=slant,
-        underline=underline,
-        overstrike=overstrike
-    )
+from PIL import ImageTk, Image
+from font_registry import FontRegistry
+from metrics import METRICS
+from sprites import OFF_COLORS, SpritePipeline, enlarge, load_atlas
+from view_model import ViewModel
+# pygame（连带numpy、pkg_resources）、mutagen和曲库在首帧画出之后才导入，见build_core；numpy只在没有图集时才用到
+
+
+# 界面刷新间隔（毫秒）：播放中 / 暂停时
+TICK_PLAYING = 150
+TICK_PAUSED = 1000
+# 拖动窗口时最多每帧移动一次（毫秒），以及贴边吸附的距离（像素）
+DRAG_FRAME = 16
+SNAP_DISTANCE = 16
+# 进度条在原始像素图里的位置和大小，按键快进/快退的秒数
+BAR_X, BAR_Y, BAR_WIDTH, BAR_HEIGHT = 105, 33, 183, 6
+SEEK_STEP = 5
+# --profile-startup 时检查第一首是否已开始播放的间隔（毫秒），出声后再连续刷新几次计时
+PROFILE_POLL = 10
+PROFILE_TICKS = 50
+# 搜索框的宽度（字符），以及上下键能翻到的结果数
+SEARCH_WIDTH = 24
+SEARCH_LIMIT = 200
 
 
 def to_pil(base64_string):
@@ -77,165 +37,216 @@ def to_pil(base64_string):
     img = Image.open(BytesIO(img_data))
     return img
 
-def enlarge(image, scale_factor, bg=None):
-    image = image.convert('RGBA')
-    width, height = image.size
-    new_width = width * scale_factor
-    new_height = height * scale_factor
-    new_image = Image.new('RGBA', (new_width, new_height), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(new_image)
-    for y in range(height):
-        for x in range(width):
-            r, g, b, a = image.getpixel((x, y))
-            if a == 0 and bg is not None:
-                r, g, b = tuple(int(bg[i:i + 2], 16) for i in (1, 3, 5))
-                a = 255
-            start_x = x * scale_factor
-            start_y = y * scale_factor
-            end_x = start_x + scale_factor
-            end_y = start_y + scale_factor
-            draw.rectangle([start_x, start_y, end_x, end_y], fill=(r, g, b, a))
-    return new_image
-
-
-def replace_colors(image, color_pairs):
-    img = image.convert("RGBA")
-    pixels = img.load()
-    width, height = img.size
-
-    for x in range(width):
-        for y in range(height):
-            current_color = pixels[x, y]
-            # 检查当前像素是否在替换列表中
-            for old_color, new_color in color_pairs:
-                if current_color == old_color:
-                    pixels[x, y] = new_color
-                    break  # 找到匹配后跳出内层循环
-
-    return img
-
 class MusicPlayer:
-    def __init__(self, music_path='music'):
+    def __init__(self, music_path='music', snap_edges=False, control_socket=None, profile=None):
+        # profile为StartupProfile时记录启动各阶段的耗时
+        self.profile = profile
+        self.mark('imports')
         self.root = tk.Tk()
+        self.fonts = FontRegistry(self.root)
         self.a_col = '#00ff00'
         self.bg_col = '#303047'
         self.fg_col = '#8064ff'
-        self.while_num0 = 0
+        # 拖动状态：按下时鼠标在窗口内的偏移，待应用的目标位置
+        self.snap_edges = snap_edges
+        self.drag_offset = (0, 0)
+        self.drag_target = None
+        self.drag_job = None
+        # 拖动进度条时预览的秒数
+        self.seek_preview = None
+        # 点击标题打开的搜索框，打开时下方列表显示搜索结果，中间一行是选中的
+        self.search_entry = None
+        self.search_results = []
+        self.search_selected = 0
         self.root.wm_attributes('-transparentcolor', self.a_col)
-        self.pause_test = True
         self.win_hid = False
-        self.total_time = 0.0
+        # 只推送真正变化的控件选项
+        self.view = ViewModel()
+        self.tick_job = None
+        # 下一次刷新预定的时间，用来统计刷新被推迟了多久
+        self.tick_due = None
         self.progress = 0.0
-        self.play_num = 0
         self.power = 2
-        self.order_mode = 0
-
-        self.files, self.folders = self.list_files_and_folders(music_path)
-
-        # 从JSON文件读取字典（可选）
-        with open("resources.json", "r", encoding="utf-8") as f:
-            resources_data = json.load(f)
-
-        self.win_img = enlarge(to_pil(resources_data['win']), self.power, bg=self.a_col)
-        self.sequential_on = to_pil(resources_data['sequential'])
-        self.cycle_on = to_pil(resources_data['cyclic'])
-        self.rand_on = to_pil(resources_data['rand'])
-        self.continue_on = to_pil(resources_data['continue'])
-        self.last_on = to_pil(resources_data['last'])
-        self.pause_on = to_pil(resources_data['pause'])
-        self.next_on = to_pil(resources_data['next'])
-        self.hid_on = to_pil(resources_data['hid'])
-        self.del_on = to_pil(resources_data['del'])
+        # 播放核心在首帧之后由build_core创建
+        self.music_path = music_path
+        self.control_socket = control_socket
+        self.core = None
+        self.daemon = None
+        self.shown_paused = True
+        self.mark('tk')
+
+        # 优先用run.py预编译的图集，没有对应倍数时再解码resources.json
+        self.sprites = load_atlas()
+        if self.sprites is None or self.power not in self.sprites.scales or self.sprites.bg != self.a_col:
+            # 从JSON文件读取字典（可选）
+            with open("resources.json", "r", encoding="utf-8") as f:
+                resources_data = json.load(f)
+
+            self.sprites = SpritePipeline({name: to_pil(data) for name, data in resources_data.items()})
+        self.win_img = self.sprites.get('win', self.power, bg=self.a_col)
 
         self.root.attributes('-topmost', True)
         self.root.overrideredirect(True)
 
         self.bg_photo = ImageTk.PhotoImage(self.win_img)
         self.bg_label = tk.Label(self.root, image=self.bg_photo, bd=0)
+        self.bg_label.pack()
+        self.mark('skin')
+
+        # 先把窗口皮肤画出来，其余部分每次事件循环空闲时搭一步
+        self.root.update()
+        self.mark('first_paint')
+        if self.profile is not None:
+            self.profile.milestone('first_frame')
+        self.build_steps = [self.build_core, self.build_buttons, self.build_labels, self.build_window_buttons]
+        self.root.after_idle(self.build_next)
+
+        self.root.mainloop()
+        if self.daemon is not None:
+            self.daemon.close()
+        if self.core is not None:
+            self.core.close()
+            # 混音器由build_core初始化，也在这里释放
+            import pygame
+            pygame.mixer.quit()
+
+    def mark(self, name):
+        if self.profile is not None:
+            self.profile.mark(name)
+
+    def build_next(self):
+        step = self.build_steps.pop(0)
+        step()
+        self.mark(step.__name__)
+        if self.build_steps:
+            self.root.after_idle(self.build_next)
+            return
+        self.cycle_row()
+        self.sequential_music()
+        if self.profile is not None:
+            self.profile.milestone('ui_built')
+            self.root.after(PROFILE_POLL, self.profile_first_audio)
+
+    def build_core(self):
+        import pygame
+        from player_core import PlayerCore
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        # 曲库、播放顺序、播放线程都在PlayerCore里，窗口只是它的一个客户端
+        self.core = PlayerCore(self.music_path)
+        self.library = self.core.library
+        self.metadata_cache = self.core.metadata_cache
+        self.files = self.core.files
+        self.order = self.core.order
+        self.engine = self.core.engine
+        self.worker = self.core.worker
+        # 暂停按钮当前画的状态，其他客户端暂停/继续时据此重画
+        self.shown_paused = self.core.paused
+        # 同时开放控制套接字时，其他客户端和窗口操作的是同一个播放器
+        if self.control_socket is not None:
+            from player_daemon import PlayerDaemon
+            self.daemon = PlayerDaemon(self.core, self.control_socket)
+            self.daemon.start()
+        # 拖动窗口和点击进度条都要用到播放状态，有了core才绑定
         self.bg_label.bind("<ButtonPress-1>", self.on_button_press0)
+        self.bg_label.bind("<B1-Motion>", self.on_drag0)
         self.bg_label.bind("<ButtonRelease-1>", self.on_button_release0)
-        self.bg_label.pack()
 
-        self.last_photo = ImageTk.PhotoImage(enlarge(self.last_on, self.power))
-        self.last_photo_off = ImageTk.PhotoImage(enlarge(replace_colors(self.last_on, [((128, 100, 255, 255), (27, 27, 42, 255))]), self.power))
+    def build_buttons(self):
+        self.last_photo = ImageTk.PhotoImage(self.sprites.get('last', self.power))
+        self.last_photo_off = ImageTk.PhotoImage(self.sprites.get('last', self.power, OFF_COLORS))
         self.last_b = tk.Label(self.root, text='上一首', image=self.last_photo, bd=0, bg=self.bg_col)
         self.last_b.bind("<Button-1>", self.last_music)
         self.last_b.bind("<Enter>", lambda e: self.last_b.configure(image=self.last_photo_off))
         self.last_b.bind("<Leave>", lambda e: self.last_b.configure(image=self.last_photo))
         self.last_b.place(x=107*self.power, y=45*self.power)
 
-        self.pause_photo = ImageTk.PhotoImage(enlarge(self.pause_on, self.power))
-        self.pause_photo_off = ImageTk.PhotoImage(enlarge(replace_colors(self.pause_on, [((128, 100, 255, 255), (27, 27, 42, 255))]), self.power))
-        self.continue_photo = ImageTk.PhotoImage(enlarge(self.continue_on, self.power))
-        self.continue_photo_off = ImageTk.PhotoImage(enlarge(replace_colors(self.continue_on, [((128, 100, 255, 255), (27, 27, 42, 255))]), self.power))
+        self.pause_photo = ImageTk.PhotoImage(self.sprites.get('pause', self.power))
+        self.pause_photo_off = ImageTk.PhotoImage(self.sprites.get('pause', self.power, OFF_COLORS))
+        self.continue_photo = ImageTk.PhotoImage(self.sprites.get('continue', self.power))
+        self.continue_photo_off = ImageTk.PhotoImage(self.sprites.get('continue', self.power, OFF_COLORS))
         self.pause_b = tk.Label(self.root, text='暂停', bd=0, bg=self.bg_col, image=self.continue_photo)
         self.pause_b.bind("<Button-1>", self.pause_unpause)
         self.pause_b.bind("<Enter>", lambda e: self.pause_b.configure(image=self.pause_photo_off))
         self.pause_b.bind("<Leave>", lambda e: self.pause_b.configure(image=self.pause_photo))
         self.pause_b.place(x=121*self.power, y=45*self.power)
 
-        self.next_photo = ImageTk.PhotoImage(enlarge(self.next_on, self.power))
-        self.next_photo_off = ImageTk.PhotoImage(enlarge(replace_colors(self.next_on, [((128, 100, 255, 255), (27, 27, 42, 255))]), self.power))
+        self.next_photo = ImageTk.PhotoImage(self.sprites.get('next', self.power))
+        self.next_photo_off = ImageTk.PhotoImage(self.sprites.get('next', self.power, OFF_COLORS))
         self.next_b = tk.Label(self.root, text='下一首', bd=0, bg=self.bg_col, image=self.next_photo)
         self.next_b.bind("<Button-1>", self.next_music)
         self.next_b.bind("<Enter>", lambda e: self.next_b.configure(image=self.next_photo_off))
         self.next_b.bind("<Leave>", lambda e: self.next_b.configure(image=self.next_photo))
         self.next_b.place(x=135*self.power, y=45*self.power)
 
-        self.sequential_photo = ImageTk.PhotoImage(enlarge(self.sequential_on, self.power))
-        self.sequential_photo_off = ImageTk.PhotoImage(enlarge(replace_colors(self.sequential_on, [((128, 100, 255, 255), (27, 27, 42, 255))]), self.power))
+        self.sequential_photo = ImageTk.PhotoImage(self.sprites.get('sequential', self.power))
+        self.sequential_photo_off = ImageTk.PhotoImage(self.sprites.get('sequential', self.power, OFF_COLORS))
         self.sequential_b = tk.Label(self.root, text='顺序播放', bd=0, bg=self.bg_col, image=self.sequential_photo)
         self.sequential_b.bind("<Button-1>", self.sequential_music)
         self.sequential_b.bind("<Enter>", lambda e: self.sequential_b.configure(image=self.sequential_photo_off))
         self.sequential_b.bind("<Leave>", lambda e: self.sequential_b.configure(image=self.sequential_photo))
         self.sequential_b.place(x=149 * self.power, y=45 * self.power)
 
-        self.cycle_photo = ImageTk.PhotoImage(enlarge(self.cycle_on, self.power))
-        self.cycle_photo_off = ImageTk.PhotoImage(enlarge(replace_colors(self.cycle_on, [((128, 100, 255, 255), (27, 27, 42, 255))]), self.power))
+        self.cycle_photo = ImageTk.PhotoImage(self.sprites.get('cyclic', self.power))
+        self.cycle_photo_off = ImageTk.PhotoImage(self.sprites.get('cyclic', self.power, OFF_COLORS))
         self.cycle_b = tk.Label(self.root, text='循环播放', bd=0, bg=self.bg_col, image=self.cycle_photo_off)
         self.cycle_b.bind("<Button-1>", self.cycle_music)
         self.cycle_b.bind("<Enter>", lambda e: self.cycle_b.configure(image=self.cycle_photo_off))
         self.cycle_b.bind("<Leave>", lambda e: self.cycle_b.configure(image=self.cycle_photo))
         self.cycle_b.place(x=161 * self.power, y=45 * self.power)
 
-        self.rand_photo = ImageTk.PhotoImage(enlarge(self.rand_on, self.power))
-        self.rand_photo_off = ImageTk.PhotoImage(enlarge(replace_colors(self.rand_on, [((128, 100, 255, 255), (27, 27, 42, 255))]), self.power))
+        self.rand_photo = ImageTk.PhotoImage(self.sprites.get('rand', self.power))
+        self.rand_photo_off = ImageTk.PhotoImage(self.sprites.get('rand', self.power, OFF_COLORS))
         self.rand_b = tk.Label(self.root, text='随机播放', bd=0, bg=self.bg_col, image=self.rand_photo_off)
         self.rand_b.bind("<Button-1>", self.rand_music)
         self.rand_b.bind("<Enter>", lambda e: self.rand_b.configure(image=self.rand_photo_off))
         self.rand_b.bind("<Leave>", lambda e: self.rand_b.configure(image=self.rand_photo))
         self.rand_b.place(x=173 * self.power, y=45 * self.power)
 
-        self.title_label = tk.Label(self.root, bd=0, bg=self.bg_col, fg=self.fg_col, font=get_font('VonwaonBitmap-12px.ttf', size=10*self.power))
+    def build_labels(self):
+        self.title_label = tk.Label(self.root, bd=0, bg=self.bg_col, fg=self.fg_col, font=self.fonts.get('VonwaonBitmap-12px.ttf', size=10*self.power))
         self.title_label.bind("<ButtonPress-1>", lambda e: self.title_label.configure(fg='#1b1b2a'))
-        self.title_label.bind("<ButtonRelease-1>", lambda e: self.title_label.configure(fg=self.fg_col))
+        self.title_label.bind("<ButtonRelease-1>", self.toggle_search)
         self.title_label.place(x=100*self.power, y=14*self.power)
 
-        self.time_label = tk.Label(self.root, bd=0, bg=self.bg_col, fg=self.fg_col, font=get_font('VonwaonBitmap-12px.ttf', size=9 * self.power))
+        self.time_label = tk.Label(self.root, bd=0, bg=self.bg_col, fg=self.fg_col, font=self.fonts.get('VonwaonBitmap-12px.ttf', size=9 * self.power))
         self.time_label.place(x=292 * self.power, y=30 * self.power)
 
-        self.loading_label = tk.Frame(self.root, bg='#8064ff', height=6*self.power, width=183*self.power)
-        self.loading_label.place(x=105*self.power, y=33*self.power)
-
-        music_list_label_0 = tk.Label(self.root, bd=0, bg='#1b1b2a', fg=self.fg_col, font=get_font('VonwaonBitmap-12px.ttf', size=6 * self.power))
-        music_list_label_0.bind("<Button-1>", self.last_music)
+        self.loading_label = tk.Frame(self.root, bg='#8064ff', height=BAR_HEIGHT*self.power, width=BAR_WIDTH*self.power)
+        # 进度条已播放部分也能点击/拖动（未播放部分在背景图上，由bg_label的事件处理）
+        self.loading_label.bind("<ButtonPress-1>", self.on_button_press0)
+        self.loading_label.bind("<B1-Motion>", self.on_drag0)
+        self.loading_label.bind("<ButtonRelease-1>", self.on_button_release0)
+        self.loading_label.place(x=BAR_X*self.power, y=BAR_Y*self.power)
+        # 波形图整张放在进度条Frame里，Frame变宽时露出已播放的部分；每首只画一次
+        self.wave_label = tk.Label(self.loading_label, bd=0, bg='#8064ff')
+        self.wave_photo = None
+        self.wave_track = None
+        self.root.bind("<Left>", lambda e: self.seek_key(e, -SEEK_STEP))
+        self.root.bind("<Right>", lambda e: self.seek_key(e, SEEK_STEP))
+        self.root.bind("<F12>", self.toggle_metrics)
+
+        music_list_label_0 = tk.Label(self.root, bd=0, bg='#1b1b2a', fg=self.fg_col, font=self.fonts.get('VonwaonBitmap-12px.ttf', size=6 * self.power))
+        music_list_label_0.bind("<Button-1>", lambda e: self.list_clicked(-1))
         music_list_label_0.bind("<Enter>", lambda e: music_list_label_0.configure(bg='#8064ff'))
         music_list_label_0.bind("<Leave>", lambda e: music_list_label_0.configure(bg='#1b1b2a'))
         music_list_label_0.place(x=103*self.power, y=58*self.power)
 
-        music_list_label_1 = tk.Label(self.root, bd=0, bg='#1b1b2a', fg=self.fg_col, font=get_font('VonwaonBitmap-12px.ttf', size=6 * self.power))
+        music_list_label_1 = tk.Label(self.root, bd=0, bg='#1b1b2a', fg=self.fg_col, font=self.fonts.get('VonwaonBitmap-12px.ttf', size=6 * self.power))
+        music_list_label_1.bind("<Button-1>", lambda e: self.list_clicked(0))
         music_list_label_1.place(x=100*self.power, y=69*self.power)
 
-        music_list_label_2 = tk.Label(self.root, bd=0, bg='#1b1b2a', fg=self.fg_col, font=get_font('VonwaonBitmap-12px.ttf', size=6 * self.power))
-        music_list_label_2.bind("<Button-1>", self.next_music)
+        music_list_label_2 = tk.Label(self.root, bd=0, bg='#1b1b2a', fg=self.fg_col, font=self.fonts.get('VonwaonBitmap-12px.ttf', size=6 * self.power))
+        music_list_label_2.bind("<Button-1>", lambda e: self.list_clicked(1))
         music_list_label_2.bind("<Enter>", lambda e: music_list_label_2.configure(bg='#8064ff'))
         music_list_label_2.bind("<Leave>", lambda e: music_list_label_2.configure(bg='#1b1b2a'))
         music_list_label_2.place(x=94*self.power, y=80*self.power)
 
         self.music_labels = [music_list_label_0, music_list_label_1, music_list_label_2]
 
-        self.hid_photo = ImageTk.PhotoImage(enlarge(self.hid_on, self.power))
-        self.hid_photo_off = ImageTk.PhotoImage(enlarge(replace_colors(self.hid_on, [((128, 100, 255, 255), (27, 27, 42, 255))]), self.power))
+    def build_window_buttons(self):
+        self.hid_photo = ImageTk.PhotoImage(self.sprites.get('hid', self.power))
+        self.hid_photo_off = ImageTk.PhotoImage(self.sprites.get('hid', self.power, OFF_COLORS))
         self.hid_b = tk.Label(self.root, text='隐藏窗口', bd=0, bg=self.bg_col, image=self.hid_photo_off)
         self.hid_b.bind("<Button-1>", lambda e: self.root.withdraw())
         self.hid_b.bind("<Enter>", lambda e: self.hid_b.configure(image=self.hid_photo))
@@ -248,53 +259,157 @@ class MusicPlayer:
         self.hid_root.bind("<Map>", self.unhid_win)
         self.hid_root.iconify()
 
-        self.del_photo = ImageTk.PhotoImage(enlarge(self.del_on, self.power))
-        self.del_photo_off = ImageTk.PhotoImage(enlarge(replace_colors(self.del_on, [((128, 100, 255, 255), (27, 27, 42, 255))]), self.power))
+        self.del_photo = ImageTk.PhotoImage(self.sprites.get('del', self.power))
+        self.del_photo_off = ImageTk.PhotoImage(self.sprites.get('del', self.power, OFF_COLORS))
         self.del_b = tk.Label(self.root, text='关闭窗口', bd=0, bg=self.bg_col, image=self.del_photo_off)
         self.del_b.bind("<Button-1>", lambda e: self.root.destroy())
         self.del_b.bind("<Enter>", lambda e: self.del_b.configure(image=self.del_photo))
         self.del_b.bind("<Leave>", lambda e: self.del_b.configure(image=self.del_photo_off))
         self.del_b.place(x=332 * self.power, y=3 * self.power)
 
-        self.cycle_row()
-        self.sequential_music()
-
-        self.root.mainloop()
+    def profile_first_audio(self):
+        # 只在 --profile-startup 下运行：扫描出第一首就播放，播放线程报告切歌后退出
+        self.handle_worker_events()
+        if self.core.metadata is not None:
+            self.profile.milestone('first_audio')
+            # 此时列表三行都有内容，单次刷新的耗时就是播放时每个tick的开销
+            for _ in range(PROFILE_TICKS):
+                started = time.perf_counter()
+                self.cycle_row()
+                self.profile.sample('cycle_row', time.perf_counter() - started)
+            self.root.destroy()
+            return
+        if self.files and self.pause_test:
+            self.play_music(0)
+        elif not self.files and self.core.scanned.is_set():
+            print('曲库为空，没有测到首次出声的时间')
+            self.root.destroy()
+            return
+        self.root.after(PROFILE_POLL, self.profile_first_audio)
+
+    @property
+    def pause_test(self):
+        return self.core.paused
+
+    @property
+    def play_num(self):
+        return self.core.play_num
+
+    @property
+    def total_time(self):
+        return self.core.total_time
+
+    @property
+    def folders(self):
+        return self.core.folders
 
     def unhid_win(self, e=None):
         if self.win_hid:
             self.win_hid = False
             self.root.deiconify()
+            self.schedule_tick(0)
 
         self.hid_root.withdraw()
         self.hid_root.iconify()
 
 
     def hid_win(self, e=None):
+        # 绑在root上的事件子控件也会收到（如波形图place_forget时的<Unmap>），只认主窗口自己的
+        if e is not None and e.widget is not self.root:
+            return
         if not self.win_hid:
             self.win_hid = True
             self.root.withdraw()
 
     def on_button_press0(self, event):
-        self.while_num0 = 0
-        while True:
-            if self.while_num0 == 0:
-                x, y = self.root.winfo_pointerxy()
-                x0, y0 = event.x, event.y
-                # 更改窗口的位置
-                self.root.geometry("+{}+{}".format(x - x0, y - y0))
-                self.root.update()
-            else:
-                break
+        self.root.focus_set()
+        if self.total_time > 0 and self.on_bar(event):
+            self.seek_preview = self.bar_seconds(event)
+            self.show_position(self.seek_preview)
+            return
+        # event.x/y是相对于被点的控件的（进度条Frame不在窗口左上角），换成相对于窗口的
+        self.drag_offset = (event.x_root - self.root.winfo_rootx(), event.y_root - self.root.winfo_rooty())
+
+    def on_drag0(self, event):
+        if self.seek_preview is not None:
+            self.seek_preview = self.bar_seconds(event)
+            self.show_position(self.seek_preview)
+            return
+        x0, y0 = self.drag_offset
+        self.drag_target = (event.x_root - x0, event.y_root - y0)
+        # 同一帧内的多次移动只应用最后一次
+        if self.drag_job is None:
+            self.drag_job = self.root.after(DRAG_FRAME, self.apply_drag)
+
+    def apply_drag(self):
+        self.drag_job = None
+        if self.drag_target is None:
+            return
+        x, y = self.drag_target
+        self.drag_target = None
+        if self.snap_edges:
+            x, y = self.snap_to_screen(x, y)
+        # 更改窗口的位置
+        self.root.geometry("+{}+{}".format(x, y))
+
+    def snap_to_screen(self, x, y):
+        width = self.root.winfo_width()
+        height = self.root.winfo_height()
+        right = self.root.winfo_screenwidth() - width
+        bottom = self.root.winfo_screenheight() - height
+        if abs(x) < SNAP_DISTANCE:
+            x = 0
+        elif abs(x - right) < SNAP_DISTANCE:
+            x = right
+        if abs(y) < SNAP_DISTANCE:
+            y = 0
+        elif abs(y - bottom) < SNAP_DISTANCE:
+            y = bottom
+        return x, y
 
     def on_button_release0(self, event):
-        if self.while_num0 == 2:
-            pass
-        else:
-            self.while_num0 = 1
+        if self.seek_preview is not None:
+            # 拖动过程中只预览，松开时才真正跳转
+            self.seek_to(self.bar_seconds(event))
+            self.seek_preview = None
+            return
+        # 松开时立即落到最终位置
+        if self.drag_job is not None:
+            self.root.after_cancel(self.drag_job)
+        self.apply_drag()
+
+    def on_bar(self, event):
+        x = event.x_root - self.root.winfo_rootx()
+        y = event.y_root - self.root.winfo_rooty()
+        # 进度条只有几个像素高，上下各放宽一点
+        return (BAR_X * self.power <= x <= (BAR_X + BAR_WIDTH) * self.power
+                and (BAR_Y - 2) * self.power <= y <= (BAR_Y + BAR_HEIGHT + 2) * self.power)
+
+    def bar_seconds(self, event):
+        x = event.x_root - self.root.winfo_rootx() - BAR_X * self.power
+        fraction = min(max(x / (BAR_WIDTH * self.power), 0.0), 1.0)
+        return fraction * self.total_time
+
+    def seek_key(self, e, delta):
+        # 搜索框里的左右键只移动光标
+        if e.widget is not self.search_entry:
+            self.seek_by(delta)
+
+    def seek_to(self, seconds):
+        if self.core.seek(seconds):
+            self.show_position(self.core.position())
+
+    def seek_by(self, delta):
+        if self.core.seek_by(delta):
+            self.show_position(self.core.position())
+
+    def show_position(self, current_time):
+        self.progress = current_time / self.total_time if self.total_time > 0 else 0.0
+        self.view.set(self.time_label, text=f"{'0'*(2 - len(str(int(current_time//60))))}{int(current_time//60)}:{'0'*(2 - len(str(int(current_time%60))))}{int(current_time%60)}")
+        self.view.set(self.loading_label, width=int(BAR_WIDTH * self.power * self.progress))
 
     def sequential_music(self, e=None):
-        self.order_mode = 0
+        self.core.set_mode(0)
         self.sequential_b.configure(image=self.sequential_photo)
         self.cycle_b.configure(image=self.cycle_photo_off)
         self.rand_b.configure(image=self.rand_photo_off)
@@ -306,7 +421,7 @@ class MusicPlayer:
         self.rand_b.bind("<Leave>", lambda e: self.rand_b.configure(image=self.rand_photo_off))
 
     def cycle_music(self, e=None):
-        self.order_mode = 1
+        self.core.set_mode(1)
         self.sequential_b.configure(image=self.sequential_photo_off)
         self.cycle_b.configure(image=self.cycle_photo)
         self.rand_b.configure(image=self.rand_photo_off)
@@ -318,7 +433,7 @@ class MusicPlayer:
         self.rand_b.bind("<Leave>", lambda e: self.rand_b.configure(image=self.rand_photo_off))
 
     def rand_music(self, e=None):
-        self.order_mode = 2
+        self.core.set_mode(2)
         self.sequential_b.configure(image=self.sequential_photo_off)
         self.cycle_b.configure(image=self.cycle_photo_off)
         self.rand_b.configure(image=self.rand_photo)
@@ -331,148 +446,232 @@ class MusicPlayer:
 
     # 显示进度
     def cycle_row(self):
-        if not self.pause_test:
-            if self.total_time > 0:
-                current_time = pygame.mixer.music.get_pos() / 1000  # 毫秒转秒
-                self.progress = current_time / self.total_time
-                self.time_label.configure(text=f"{'0'*(2 - len(str(int(current_time//60))))}{int(current_time//60)}:{'0'*(2 - len(str(int(current_time%60))))}{int(current_time%60)}")
-
-                self.loading_label.configure(width=183 * self.power * self.progress)
-                if self.total_time - current_time < 0.16:
-                    self.next_music()
-        for i in range(-1, 2):
-            music_data = self.get_metadata(self.files[(self.play_num+i)%len(self.files)])
-            # print(f"{music_data['title']}-{music_data['artist']}")
-            if i == 0:
-                self.music_labels[i + 1].configure(text=f"{music_data['title']}-{music_data['artist']}", fg='#8064ff')
+        self.tick_job = None
+        started = METRICS.clock()
+        if started is not None and self.tick_due is not None:
+            # 界面线程被卡住时，这里比刷新本身的耗时先变大
+            METRICS.observe('ui.tick_late', max(started - self.tick_due, 0.0))
+        # 窗口隐藏时停止刷新，重新显示时再启动
+        if self.win_hid:
+            return
+        try:
+            # 切歌由播放线程完成，这里只同步状态
+            self.handle_worker_events()
+            self.update_waveform()
+            # 拖动进度条时不覆盖预览；跳转还没生效时core.position()就是目标位置
+            if not self.pause_test and self.seek_preview is None:
+                if self.total_time > 0:
+                    self.show_position(self.core.position())
+            if self.search_entry is None:
+                for i, text in enumerate(self.core.list_rows()):
+                    self.view.set(self.music_labels[i], text=text, fg='#8064ff' if i == 1 else self.bg_col)
+        finally:
+            # 这一次出错（例如列表在别的线程里又变短了）也要排下一次，否则界面停止刷新
+            METRICS.record('ui.tick', started)
+            self.schedule_tick(TICK_PAUSED if self.pause_test else TICK_PLAYING)
+
+    def toggle_search(self, e=None):
+        self.title_label.configure(fg=self.fg_col)
+        if self.search_entry is not None:
+            self.close_search()
+            return
+        self.search_var = tk.StringVar()
+        self.search_entry = tk.Entry(self.root, textvariable=self.search_var, bd=0, width=SEARCH_WIDTH,
+                                     bg='#1b1b2a', fg=self.fg_col, insertbackground=self.fg_col,
+                                     font=self.fonts.get('VonwaonBitmap-12px.ttf', size=10*self.power))
+        self.search_entry.bind("<Up>", lambda e: self.move_selection(-1))
+        self.search_entry.bind("<Down>", lambda e: self.move_selection(1))
+        self.search_entry.bind("<Return>", lambda e: self.play_selection())
+        self.search_entry.bind("<Escape>", lambda e: self.close_search())
+        # 每输入一个字都重新过滤：继续输入时索引只在上一次的结果里找
+        self.search_var.trace_add('write', lambda *args: self.update_search())
+        self.search_entry.place(x=100*self.power, y=14*self.power)
+        self.search_entry.focus_force()
+        self.update_search()
+
+    def update_search(self):
+        query = self.search_var.get()
+        self.search_results = self.core.search(query, SEARCH_LIMIT)
+        self.search_selected = 0
+        self.show_search(query)
+
+    def show_search(self, query=None):
+        results = self.search_results
+        if query is None:
+            query = self.search_var.get()
+        for i, label in enumerate(self.music_labels):
+            n = self.search_selected + i - 1
+            if 0 <= n < len(results):
+                music_data = self.get_metadata(results[n])
+                text = f"{music_data['title']}-{music_data['artist']}"
+            elif i == 1:
+                text = '没有匹配的曲目' if query.strip() else '输入标题/歌手/专辑'
             else:
-                self.music_labels[i + 1].configure(text=f"{music_data['title']}-{music_data['artist']}", fg=self.bg_col)
-
-        self.root.after(150, self.cycle_row)
+                text = ''
+            self.view.set(label, text=text, fg='#8064ff' if i == 1 else self.bg_col)
+
+    def move_selection(self, step):
+        if 0 <= self.search_selected + step < len(self.search_results):
+            self.search_selected += step
+            self.show_search()
+
+    def play_selection(self):
+        if not self.search_results:
+            return
+        path = self.search_results[self.search_selected]
+        self.close_search()
+        if self.core.play_path(path):
+            self.schedule_tick(TICK_PLAYING)
+
+    def close_search(self):
+        if self.search_entry is None:
+            return
+        self.search_entry.destroy()
+        self.search_entry = None
+        self.search_results = []
+        self.root.focus_set()
+        # 列表马上换回播放顺序
+        self.schedule_tick(0)
+
+    def list_clicked(self, step):
+        # 搜索时上下两行切换结果、中间一行播放；平时上方是上一曲，下方是下一曲
+        if self.search_entry is not None:
+            if step:
+                self.move_selection(step)
+            else:
+                self.play_selection()
+        elif step < 0:
+            self.last_music()
+        elif step > 0:
+            self.next_music()
+
+    def update_waveform(self):
+        metadata = self.core.metadata
+        if metadata is None or metadata is self.wave_track or self.play_num >= len(self.files):
+            return
+        from waveform import render_waveform
+        # 摘要在后台算好之前，进度条保持纯色
+        data = self.core.waveforms.peek(self.files[self.play_num])
+        if data is None:
+            self.wave_label.place_forget()
+            return
+        image = render_waveform(data, BAR_HEIGHT, fill='#8064ff', peak=self.bg_col, body='#1b1b2a')
+        self.wave_photo = ImageTk.PhotoImage(enlarge(image, self.power))
+        self.wave_label.configure(image=self.wave_photo)
+        self.wave_label.place(x=0, y=0)
+        self.wave_track = metadata
+
+    def schedule_tick(self, delay):
+        if self.tick_job is not None:
+            self.root.after_cancel(self.tick_job)
+        self.tick_job = self.root.after(delay, self.cycle_row)
+        self.tick_due = time.perf_counter() + delay / 1000
+
+    def toggle_metrics(self, e=None):
+        # F12：打开/关闭统计，关闭时打印这段时间的结果
+        if METRICS.enabled:
+            METRICS.disable()
+            print(json.dumps(METRICS.snapshot(), ensure_ascii=False, indent=4))
+        else:
+            METRICS.reset()
+            METRICS.enable()
+            print('统计已打开，再按F12查看结果')
 
     def print_music_list(self):
+        if self.play_num >= len(self.files):
+            return
         music_data = self.get_metadata(self.files[self.play_num])
         print(music_data)
         print(f'当前: {music_data["title"]} - {music_data["artist"]} ({music_data["album"]}), 列表: {self.files}')
+        print(f'元数据缓存: {self.metadata_cache.stats()}')
+        print(f'界面刷新: {self.view.stats()}')
 
-    # 获取媒体文件元数据
+    # 获取媒体文件元数据（走缓存，只有文件变化时才重新解析标签）
     def get_metadata(self, file_path):
-        file_path = Path(file_path)
-        ext = file_path.suffix.lower()
-
-        try:
-            if ext == '.mp3':
-                audio = EasyID3(file_path)
-                return {
-                    'artist': audio.get('artist', ['未知艺术家'])[0],
-                    'title': audio.get('title', [file_path.stem])[0],
-                    'album': audio.get('album', ['未知专辑'])[0]
-                }
-            elif ext == '.flac':
-                audio = FLAC(file_path)
-                return {
-                    'artist': audio.get('artist', ['未知艺术家'])[0],
-                    'title': audio.get('title', [file_path.stem])[0],
-                    'album': audio.get('album', ['未知专辑'])[0]
-                }
-            elif ext == '.m4a':
-                audio = MP4(file_path)
-                return {
-                    'artist': audio.get('\xa9ART', ['未知艺术家'])[0],
-                    'title': audio.get('\xa9nam', [file_path.stem])[0],
-                    'album': audio.get('\xa9alb', ['未知专辑'])[0]
-                }
-            else:
-                return {
-                    'artist': '未知艺术家',
-                    'title': file_path.stem,
-                    'album': '未知专辑'
-                }
-        except Exception as e:
-            print(f"读取元数据失败: {e}")
-            return {
-                'artist': '未知艺术家',
-                'title': file_path.stem,
-                'album': '未知专辑'
-            }
-
+        return self.core.get_metadata(file_path)
 
     # 获取音频时长的函数（支持FLAC）
     def get_audio_duration(self, file_path):
-        return pygame.mixer.Sound(file_path).get_length()
-
-    # 播放音乐并显示进度
-    def play_music(self, file_path):
-        # 获取元数据
-        metadata = self.get_metadata(file_path)
-
-        # 加载音乐
-        pygame.mixer.music.load(file_path)
-
-        # 获取总时长
-        self.total_time = self.get_audio_duration(file_path)
-        self.title_label.configure(text=f"{metadata['title']}-{metadata['artist']}")
-
-        # 开始播放
-        pygame.mixer.music.play()
-
+        return self.core.get_audio_duration(file_path)
+
+    # 播放指定序号的曲目
+    def play_music(self, index):
+        self.core.play_music(index)
+        self.schedule_tick(TICK_PLAYING)
+
+    def handle_worker_events(self):
+        # 控制套接字的线程也可能先取走事件，所以按core里的状态渲染，不依赖事件本身
+        self.core.handle_events()
+        metadata = self.core.metadata
+        if metadata is not None:
+            self.view.set(self.title_label, text=f"{metadata['title']}-{metadata['artist']}")
+        if self.core.paused != self.shown_paused:
+            self.render_pause_button()
+
+    # 0 顺序播放，1 单曲循环，2 随机播放
+    @property
+    def order_mode(self):
+        return self.core.order_mode
+
+    @order_mode.setter
+    def order_mode(self, mode):
+        self.core.order_mode = mode
 
     def pause_unpause(self, e=None):
-        if self.pause_test:
-            self.pause_test = False
-            pygame.mixer.music.unpause()
+        self.core.pause_unpause()
+        self.render_pause_button()
+
+    def render_pause_button(self):
+        self.shown_paused = self.pause_test
+        if not self.pause_test:
+            self.schedule_tick(TICK_PLAYING)
             self.pause_b.configure(text='暂停', image=self.pause_photo)
             self.pause_b.bind("<Enter>", lambda e: self.pause_b.configure(image=self.pause_photo_off))
             self.pause_b.bind("<Leave>", lambda e: self.pause_b.configure(image=self.pause_photo))
         else:
-            self.pause_test = True
-            pygame.mixer.music.pause()
             self.pause_b.configure(text='继续', image=self.continue_photo)
             self.pause_b.bind("<Enter>", lambda e: self.pause_b.configure(image=self.continue_photo_off))
             self.pause_b.bind("<Leave>", lambda e: self.pause_b.configure(image=self.continue_photo))
 
     def next_music(self, e=None):
-        pygame.mixer.music.stop()
-        if self.order_mode == 0:
-            if self.play_num < len(self.files) - 1:
-                self.play_num += 1
-            else:
-                self.play_num = 0
-        elif self.order_mode == 1:
-            pass
-        else:
-            self.play_num = random.randint(0, len(self.files)-1)
-
-        threading.Thread(target=self.play_music, args=(self.files[self.play_num],)).start()
-        self.pause_test = False
+        # 连按多次只会加载最后一首
+        if self.core.next_music():
+            self.schedule_tick(TICK_PLAYING)
 
     def last_music(self, e=None):
-        pygame.mixer.music.stop()
-        if self.play_num > 0:
-            self.play_num -= 1
-        else:
-            self.play_num = len(self.files)-1
-        threading.Thread(target=self.play_music, args=(self.files[self.play_num],)).start()
-        self.pause_test = False
+        if self.core.last_music():
+            self.schedule_tick(TICK_PLAYING)
 
     def list_files_and_folders(self, path):
-        files = []
-        folders = []
-
-        # 遍历目录内容
-        for item in os.listdir(path):
-            item_path = os.path.join(path, item)
-            if os.path.isfile(item_path):
-                files.append(item_path)
-            elif os.path.isdir(item_path):
-                folders.append(item_path)
-
-        return files, folders
-
-# 初始化pygame混音器
-pygame.mixer.init()
-
-a = MusicPlayer()
-
-# 释放资源
-pygame.mixer.quit()
\ No newline at end of file
+        return self.core.list_files_and_folders(path)
+
+# 用法: python UpdateUI.py [--snap-edges] [--control-socket [路径]] [--metrics]
+#       python UpdateUI.py --profile-startup
+#       --snap-edges 拖动窗口时吸附到屏幕边缘
+#       --control-socket 同时开放控制套接字（默认 cache/player.sock），可以用 player_daemon.py --send 控制
+#       --metrics 打开统计，每10秒写一次 cache/metrics.json
+#       --profile-startup 在子进程里用 -X importtime 启动一次，播放出第一首后退出，报告各阶段和各模块的耗时
+if __name__ == '__main__':
+    if '--profile-startup' in sys.argv:
+        from startup_profile import print_report, profile_startup, save_report
+        report = profile_startup(__file__)
+        print_report(report)
+        save_report(report)
+    elif '--profile-child' in sys.argv:
+        from startup_profile import StartupProfile
+        profile = StartupProfile(STARTED)
+        # 混音器由MusicPlayer在首帧之后初始化和释放
+        MusicPlayer(profile=profile)
+        with open(sys.argv[sys.argv.index('--profile-child') + 1], 'w', encoding='utf-8') as f:
+            json.dump(profile.to_dict(), f)
+    else:
+        control_socket = None
+        if '--control-socket' in sys.argv:
+            from player_daemon import SOCKET_PATH
+            i = sys.argv.index('--control-socket')
+            following = sys.argv[i + 1:i + 2]
+            control_socket = following[0] if following and not following[0].startswith('--') else SOCKET_PATH
+        if '--metrics' in sys.argv:
+            METRICS.start_dumping()
+        a = MusicPlayer(snap_edges='--snap-edges' in sys.argv, control_socket=control_socket)
+        METRICS.stop_dumping()
\ No newline at end of file
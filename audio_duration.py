@@ -0,0 +1,237 @@
+import os
+import struct
+
+# 只读容器头部获取时长，不解码音频数据
+
+MP3_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = {
+    1: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    25: (11025, 12000, 8000),
+}
+# 没有Xing/VBRI头时先看这么多帧，码率都一样就按CBR估算
+CBR_PROBE_FRAMES = 32
+
+
+def skip_id3v2(f):
+    """跳过文件开头的ID3v2标签，返回音频数据起始偏移"""
+    f.seek(0)
+    header = f.read(10)
+    if len(header) == 10 and header[:3] == b'ID3':
+        size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        offset = 10 + size
+        if header[5] & 0x10:
+            offset += 10
+        return offset
+    return 0
+
+
+def parse_mp3_header(b):
+    """解析4字节MPEG音频帧头，返回 (帧长, 每帧采样数, 采样率, 码率, 信息) 或None"""
+    if len(b) < 4 or b[0] != 0xFF or (b[1] & 0xE0) != 0xE0:
+        return None
+    version_bits = (b[1] >> 3) & 3
+    layer_bits = (b[1] >> 1) & 3
+    bitrate_index = b[2] >> 4
+    sr_index = (b[2] >> 2) & 3
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sr_index == 3:
+        return None
+    version = {3: 1, 2: 2, 0: 25}[version_bits]
+    layer = 4 - layer_bits
+    bitrate = MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][sr_index]
+    padding = (b[2] >> 1) & 1
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 576 if (layer == 3 and version != 1) else 1152
+        length = samples // 8 * bitrate // sample_rate + padding
+    mono = (b[3] >> 6) == 3
+    return length, samples, sample_rate, bitrate, (version, layer, mono)
+
+
+def find_first_frame(f, start, limit=65536):
+    f.seek(start)
+    buf = f.read(limit)
+    i = buf.find(b'\xff')
+    while 0 <= i < len(buf) - 4:
+        header = parse_mp3_header(buf[i:i + 4])
+        if header is not None:
+            # 用下一帧帧头确认，避免把标签里的0xFF当成同步字
+            f.seek(start + i + header[0])
+            if parse_mp3_header(f.read(4)) is not None:
+                return start + i, header
+        i = buf.find(b'\xff', i + 1)
+    return None, None
+
+
+def mp3_duration(f):
+    start = skip_id3v2(f)
+    offset, header = find_first_frame(f, start)
+    if header is None:
+        return None
+    length, samples, sample_rate, bitrate, (version, layer, mono) = header
+    f.seek(offset)
+    frame = f.read(length)
+
+    # Xing/Info 头（LAME等编码器写在第一帧里）
+    if version == 1:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    xing = frame[4 + side_info:]
+    if xing[:4] in (b'Xing', b'Info') and len(xing) >= 12:
+        flags = struct.unpack('>I', xing[4:8])[0]
+        if flags & 1:
+            frames = struct.unpack('>I', xing[8:12])[0]
+            total = frames * samples
+            # LAME扩展头里的编码延迟和补零
+            pos = 8 + (4 if flags & 1 else 0) + (4 if flags & 2 else 0) + (100 if flags & 4 else 0) + (4 if flags & 8 else 0)
+            lame = xing[pos:pos + 24]
+            if len(lame) == 24 and lame[:4] in (b'LAME', b'Lavf', b'Lavc'):
+                delay = (lame[21] << 4) | (lame[22] >> 4)
+                padding = ((lame[22] & 0x0F) << 8) | lame[23]
+                if delay + padding < total:
+                    total -= delay + padding
+            return total / sample_rate
+
+    # VBRI 头（Fraunhofer编码器），固定在帧头后32字节
+    vbri = frame[36:]
+    if vbri[:4] == b'VBRI' and len(vbri) >= 18:
+        frames = struct.unpack('>I', vbri[14:18])[0]
+        return frames * samples / sample_rate
+
+    # 没有头信息：逐帧读帧头（只读4字节，不解码）
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    if end >= 128:
+        f.seek(end - 128)
+        if f.read(3) == b'TAG':
+            end -= 128
+
+    pos = offset
+    frames = 0
+    total = 0
+    bitrates = set()
+    while pos + 4 <= end:
+        f.seek(pos)
+        header = parse_mp3_header(f.read(4))
+        if header is None:
+            break
+        frames += 1
+        total += header[1]
+        bitrates.add(header[3])
+        pos += header[0]
+        if frames == CBR_PROBE_FRAMES and len(bitrates) == 1:
+            # 恒定码率，按剩余字节数估算
+            return total / sample_rate + (end - pos) * 8 / bitrate
+    if frames == 0:
+        return None
+    return total / sample_rate
+
+
+def flac_duration(f):
+    start = skip_id3v2(f)
+    f.seek(start)
+    if f.read(4) != b'fLaC':
+        return None
+    while True:
+        block = f.read(4)
+        if len(block) < 4:
+            return None
+        block_type = block[0] & 0x7F
+        size = (block[1] << 16) | (block[2] << 8) | block[3]
+        if block_type == 0:
+            info = f.read(size)
+            if len(info) < 18:
+                return None
+            sample_rate = (info[10] << 12) | (info[11] << 4) | (info[12] >> 4)
+            total = ((info[13] & 0x0F) << 32) | struct.unpack('>I', info[14:18])[0]
+            if sample_rate == 0 or total == 0:
+                return None
+            return total / sample_rate
+        if block[0] & 0x80:
+            return None
+        f.seek(size, os.SEEK_CUR)
+
+
+def iter_atoms(f, start, end):
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def read_mvhd(f, body_start):
+    # mvhd/mdhd 布局一致：version(1) flags(3) 创建/修改时间 timescale duration
+    f.seek(body_start)
+    version = f.read(4)[0]
+    if version == 1:
+        f.seek(16, os.SEEK_CUR)
+        timescale, duration = struct.unpack('>IQ', f.read(12))
+    else:
+        f.seek(8, os.SEEK_CUR)
+        timescale, duration = struct.unpack('>II', f.read(8))
+    if timescale == 0 or duration == 0:
+        return None
+    return duration / timescale
+
+
+def mp4_duration(f):
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    for kind, body, atom_end in iter_atoms(f, 0, end):
+        if kind != b'moov':
+            continue
+        fallback = None
+        for sub, sub_body, sub_end in iter_atoms(f, body, atom_end):
+            if sub == b'mvhd':
+                duration = read_mvhd(f, sub_body)
+                if duration:
+                    return duration
+            elif sub == b'trak' and fallback is None:
+                for t, t_body, t_end in iter_atoms(f, sub_body, sub_end):
+                    if t == b'mdia':
+                        for m, m_body, m_end in iter_atoms(f, t_body, t_end):
+                            if m == b'mdhd':
+                                fallback = read_mvhd(f, m_body)
+        return fallback
+    return None
+
+
+PROBES = {
+    '.mp3': mp3_duration,
+    '.flac': flac_duration,
+    '.m4a': mp4_duration,
+}
+
+
+def probe_duration(file_path):
+    """从头部读取时长（秒），读不到时返回None，由调用方决定是否解码"""
+    probe = PROBES.get(os.path.splitext(str(file_path))[1].lower())
+    if probe is None:
+        return None
+    try:
+        with open(file_path, 'rb') as f:
+            return probe(f)
+    except (OSError, struct.error, IndexError, KeyError) as e:
+        print(f"读取时长失败: {e}")
+        return None
@@ -0,0 +1,1795 @@
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import wave
+# 默认用SDL的空驱动：没有声卡和显示器的机器上也能跑，结果也不受音频设备影响
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame
+from PIL import Image, ImageDraw
+from library_scanner import LibraryScanner
+from library_watcher import LibraryDelta, LibraryWatcher
+from metadata_cache import UNKNOWN_ARTIST
+from metrics import METRICS, Histogram, Metrics, SamplingProfiler
+from loudness import LoudnessAnalyzer, analyze_file, init_worker, measure_loudness
+from play_order import RANDOM, PlayOrder, ShuffleOrder
+from player_core import PlayerCore
+from player_daemon import PlayerDaemon, send_command
+from playback import PlaybackEngine, PlaybackWorker
+from search_index import SearchIndex, normalize
+from seek_index import SeekIndexCache, crc8, parse_flac_frame_header
+from sprites import ATLAS_PATH, OFF_COLORS, SpritePipeline, enlarge, load_atlas, replace_colors
+from track_library import TrackLibrary, TrackList
+from waveform import WAVEFORM_BUCKETS, WaveformSummarizer, render_waveform, summarize_file, unpack_summary
+from startup_profile import parse_importtime, profile_startup
+from UpdateUI import to_pil
+
+
+# 旧版逐像素实现，只用来做对照
+def legacy_enlarge(image, scale_factor, bg=None):
+    image = image.convert('RGBA')
+    width, height = image.size
+    new_image = Image.new('RGBA', (width * scale_factor, height * scale_factor), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(new_image)
+    for y in range(height):
+        for x in range(width):
+            r, g, b, a = image.getpixel((x, y))
+            if a == 0 and bg is not None:
+                r, g, b = tuple(int(bg[i:i + 2], 16) for i in (1, 3, 5))
+                a = 255
+            start_x = x * scale_factor
+            start_y = y * scale_factor
+            draw.rectangle([start_x, start_y, start_x + scale_factor, start_y + scale_factor], fill=(r, g, b, a))
+    return new_image
+
+
+def legacy_replace_colors(image, color_pairs):
+    img = image.convert("RGBA")
+    pixels = img.load()
+    width, height = img.size
+    for x in range(width):
+        for y in range(height):
+            current_color = pixels[x, y]
+            for old_color, new_color in color_pairs:
+                if current_color == old_color:
+                    pixels[x, y] = new_color
+                    break
+    return img
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_sprites(powers=(1, 2, 4, 8)):
+    """对比旧版和新版精灵处理：逐像素一致性 + 耗时"""
+    with open("resources.json", "r", encoding="utf-8") as f:
+        sources = {name: to_pil(data) for name, data in json.load(f).items()}
+
+    results = []
+    for power in powers:
+        legacy_time = 0.0
+        new_time = 0.0
+        pipeline = SpritePipeline(sources)
+        for name, image in sources.items():
+            bg = '#00ff00' if name == 'win' else None
+            for palette in ((), OFF_COLORS):
+                old = image
+                if palette:
+                    old, t = timed(legacy_replace_colors, old, palette)
+                    legacy_time += t
+                old, t = timed(legacy_enlarge, old, power, bg=bg)
+                legacy_time += t
+
+                new, t = timed(pipeline.get, name, power, palette, bg=bg)
+                new_time += t
+                assert old.tobytes() == new.tobytes(), f'{name} x{power} 输出不一致'
+        _, cached_time = timed(lambda: [pipeline.get(n, power, bg='#00ff00' if n == 'win' else None) for n in sources])
+        results.append({
+            'power': power,
+            'legacy_s': round(legacy_time, 4),
+            'pipeline_s': round(new_time, 4),
+            'cached_s': round(cached_time, 6),
+        })
+    return results
+
+
+def bench_atlas():
+    """冷启动取全部精灵：resources.json解码+处理 对比 mmap图集切片"""
+    def from_resources():
+        with open("resources.json", "r", encoding="utf-8") as f:
+            pipeline = SpritePipeline({name: to_pil(data) for name, data in json.load(f).items()})
+        return load_all(pipeline)
+
+    def from_atlas():
+        return load_all(load_atlas())
+
+    def load_all(sprites):
+        images = {}
+        for name in ('sequential', 'cyclic', 'rand', 'continue', 'last', 'pause', 'next', 'hid', 'del'):
+            images[name] = sprites.get(name, 2)
+            images[name + '_off'] = sprites.get(name, 2, OFF_COLORS)
+        images['win'] = sprites.get('win', 2, bg='#00ff00')
+        return images
+
+    if load_atlas() is None:
+        return {'error': '没有图集，先执行 python run.py'}
+    expected, resources_time = timed(from_resources)
+    actual, atlas_time = timed(from_atlas)
+    for key, image in expected.items():
+        assert image.tobytes() == actual[key].tobytes(), f'{key} 图集输出不一致'
+    return {'resources_s': round(resources_time, 4), 'atlas_s': round(atlas_time, 4)}
+
+
+def make_tree(root, tracks, per_album=12, albums_per_artist=5):
+    """生成 歌手/专辑/曲目 结构的空文件目录树，夹杂少量非音频文件"""
+    exts = ('.mp3', '.flac', '.m4a')
+    for i in range(tracks):
+        album = i // per_album
+        folder = os.path.join(root, f'artist{album // albums_per_artist:05d}', f'album{album:06d}')
+        if i % per_album == 0:
+            os.makedirs(folder, exist_ok=True)
+            open(os.path.join(folder, 'cover.jpg'), 'wb').close()
+        open(os.path.join(folder, f'{i % per_album:02d} track{i}{exts[i % 3]}'), 'wb').close()
+
+
+def bench_scan(tracks=10000):
+    """扫描吞吐量：完整扫描、首批延迟、无变化增量扫描、改动一张专辑后的增量扫描"""
+    root = tempfile.mkdtemp(prefix='pixel_scan_')
+    try:
+        make_tree(root, tracks)
+        scanner = LibraryScanner(root)
+        start = time.perf_counter()
+        first_batch = None
+        count = 0
+        for batch in scanner.scan():
+            if first_batch is None:
+                first_batch = time.perf_counter() - start
+            count += len(batch)
+        full = time.perf_counter() - start
+        assert count == tracks, f'扫描到 {count} 个文件，应为 {tracks}'
+
+        _, idle = timed(scanner.rescan)
+        album = os.path.join(root, 'artist00000', 'album000000')
+        time.sleep(0.01)
+        open(os.path.join(album, 'new.mp3'), 'wb').close()
+        (added, removed), touched = timed(scanner.rescan)
+        assert len(added) == 1 and not removed
+        return {
+            'tracks': tracks,
+            'files_per_s': round(count / full),
+            'first_batch_s': round(first_batch, 6),
+            'rescan_idle_s': round(idle, 4),
+            'rescan_one_album_s': round(touched, 4),
+        }
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_library(tracks=20000):
+    """曲库：首次批量写入耗时，重启（打开数据库+取长度+取首页）耗时"""
+    root = tempfile.mkdtemp(prefix='pixel_library_')
+    try:
+        music = os.path.join(root, 'music')
+        make_tree(music, tracks)
+        db_path = os.path.join(root, 'library.db')
+
+        library = TrackLibrary(db_path)
+        start = time.perf_counter()
+        for batch in LibraryScanner(music).scan():
+            library.upsert_files(batch)
+        populate = time.perf_counter() - start
+        library.close()
+
+        def restart():
+            lib = TrackLibrary(db_path)
+            files = TrackList(lib)
+            first = (len(files), files[0], files[len(files) // 2])
+            page = lib.page(0, 50, order_by='title')
+            lib.close()
+            return first, page
+
+        (first, page), warm = timed(restart)
+        assert first[0] == tracks and len(page) == 50
+
+        # 换到另一个文件夹（名字是前一个的前缀+字符）：同一个数据库里旧文件夹的曲目不能出现
+        other = music + '2'
+        make_tree(other, 30)
+        lib = TrackLibrary(db_path)
+        for batch in LibraryScanner(other).scan():
+            lib.upsert_files(batch)
+        for folder, expected in ((other, 30), (music, tracks)):
+            files = TrackList(lib, root=folder)
+            prefix = os.path.join(os.path.abspath(folder), '')
+            assert len(files) == expected, f'{folder} 下应有 {expected} 首，列表里有 {len(files)} 首'
+            assert all(path.startswith(prefix) for path in files), f'{folder} 的列表里混进了别的文件夹的曲目'
+            assert len(lib.search_rows(folder)) == expected
+            assert len(lib.page(0, 100, root=folder)) == min(expected, 100)
+        stale = TrackList(lib, root=other)
+        try:
+            stale.index(first[1])
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('别的文件夹的曲目在列表里能找到')
+        assert stale.index(stale[5]) == 5
+        lib.close()
+        return {
+            'tracks': tracks,
+            'populate_s': round(populate, 4),
+            'warm_start_s': round(warm, 4),
+        }
+    finally:
+        shutil.rmtree(root)
+
+
+def write_wav(path, seconds, rate=44100):
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b'\0\0\0\0' * int(rate * seconds))
+
+
+def bench_gapless(tracks=4, seconds=0.6, tick=0.15, stall=0.4):
+    """无缝切歌：界面按tick刷新，中途卡顿stall秒，统计混音器空闲的采样次数"""
+    root = tempfile.mkdtemp(prefix='pixel_gapless_')
+    try:
+        files = []
+        for i in range(tracks):
+            files.append(os.path.join(root, f'{i}.wav'))
+            write_wav(files[-1], seconds)
+        pygame.mixer.init()
+        engine = PlaybackEngine(files, PlayOrder(files))
+        engine.play(0)
+        start = time.perf_counter()
+        next_tick = start
+        silent = 0
+        samples = 0
+        while time.perf_counter() - start < seconds * (tracks - 0.5):
+            now = time.perf_counter()
+            samples += 1
+            if not pygame.mixer.music.get_busy():
+                silent += 1
+            # 第一首结束前后模拟一次界面卡顿
+            if now >= next_tick and not (seconds * 0.8 < now - start < seconds * 0.8 + stall):
+                engine.poll()
+                next_tick = now + tick
+            time.sleep(0.002)
+        engine.stop()
+        results = {
+            'transitions_gapless': engine.gapless,
+            'transitions_reloaded': engine.reloads,
+            'silent_samples': silent,
+            'samples': samples,
+        }
+
+        # 每首音量不同：第一帧就要是这首的音量；切到队列里的下一首后多久换成它的音量
+        gains = {path: 0.2 + 0.2 * i for i, path in enumerate(files)}
+        engine = PlaybackEngine(files, PlayOrder(files), volume=gains.get)
+        worker = PlaybackWorker(engine, describe=lambda path: (None, seconds))
+        worker.submit('play', 0)
+        worker.wait_idle()
+        assert abs(pygame.mixer.music.get_volume() - gains[files[0]]) < 0.01
+        lags = []
+        current = 0
+        switched = None
+        last = pygame.mixer.music.get_pos()
+        deadline = time.perf_counter() + seconds * (tracks - 0.5)
+        while time.perf_counter() < deadline:
+            position = pygame.mixer.music.get_pos()
+            now = time.perf_counter()
+            if position < last:
+                # 混音器切到了下一首（get_pos从0重新算）
+                current += 1
+                switched = now
+            last = position
+            if switched is not None and abs(pygame.mixer.music.get_volume() - gains[files[current % tracks]]) < 0.01:
+                lags.append(now - switched)
+                switched = None
+            time.sleep(0.001)
+        worker.close()
+        pygame.mixer.quit()
+        assert len(lags) >= tracks - 1, f'{current} 次切歌里只有 {len(lags)} 次换了音量'
+        results['volume_lag_worst_ms'] = round(max(lags) * 1000, 1)
+        return results
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_worker(tracks=20, burst=10, clients=8, per_client=100, timeout=5.0):
+    """播放线程压力测试：连按下一首只加载最后一首；多线程乱序命令下最终状态确定、线程数不变；
+    下一首损坏时自动切歌跳过它，播放线程不退出"""
+    root = tempfile.mkdtemp(prefix='pixel_worker_')
+    try:
+        files = []
+        for i in range(tracks):
+            files.append(os.path.join(root, f'{i}.wav'))
+            write_wav(files[-1], 0.5)
+        pygame.mixer.init()
+        threads_before = threading.active_count()
+        engine = PlaybackEngine(files, PlayOrder(files))
+        worker = PlaybackWorker(engine)
+
+        # 播放线程忙着加载时连按burst次“下一首”
+        worker.submit('play', 0)
+        for _ in range(burst):
+            worker.submit('next')
+        start = time.perf_counter()
+        worker.wait_idle()
+        burst_time = time.perf_counter() - start
+        assert worker.index == burst % tracks, f'连按后停在 {worker.index}'
+        burst_loads = worker.loads
+
+        counts = [0]
+        lock = threading.Lock()
+
+        def client(seed):
+            rng = random.Random(seed)
+            delta = 0
+            for _ in range(per_client):
+                command = rng.choice(('next', 'prev', 'pause', 'resume'))
+                delta += {'next': 1, 'prev': -1}.get(command, 0)
+                worker.submit(command)
+            with lock:
+                counts[0] += delta
+
+        threads = [threading.Thread(target=client, args=(seed,)) for seed in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        worker.wait_idle()
+        expected = (burst + counts[0]) % tracks
+        assert worker.index == expected, f'最终停在 {worker.index}，应为 {expected}'
+        player_threads = threading.active_count() - threads_before
+        worker.close()
+
+        # 下一首损坏：预加载失败，当前曲目放完后重新加载也失败，要跳到再下一首
+        broken = [files[0], os.path.join(root, 'broken.mp3'), files[2]]
+        with open(broken[1], 'wb') as f:
+            f.write(b'not an mp3 ' * 100)
+        worker = PlaybackWorker(PlaybackEngine(broken, PlayOrder(broken)))
+        worker.submit('play', 0)
+        deadline = time.perf_counter() + timeout
+        while worker.index != 2 and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        assert worker.index == 2, f'损坏的下一首之后停在 {worker.index}'
+        assert worker._thread.is_alive(), '播放线程退出了'
+        # 之后的命令照常执行
+        worker.submit('next')
+        worker.wait_idle()
+        skipped_broken = worker.engine.reloads
+        worker.close()
+        pygame.mixer.quit()
+        return {
+            'burst_loads': burst_loads,
+            'burst_s': round(burst_time, 4),
+            'stress_commands': clients * per_client,
+            'stress_loads': worker.loads - burst_loads,
+            'coalesced': worker.coalesced,
+            'player_threads': player_threads,
+            'broken_next_reloads': skipped_broken,
+        }
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_shuffle(size=1000000, history=256):
+    """随机播放：百万曲目走完一整轮，每首只出现一次；单步耗时和内存与曲库大小无关"""
+    shuffle = ShuffleOrder(size, seed=42, history=history)
+    seen = bytearray(size)
+    current = None
+    start = time.perf_counter()
+    for _ in range(size):
+        current = shuffle.advance(current)
+        assert not seen[current], f'{current} 在一轮内重复出现'
+        seen[current] = 1
+    elapsed = time.perf_counter() - start
+
+    # 内存单独测：开着tracemalloc再走一段，峰值只取决于历史记录长度
+    tracemalloc.start()
+    for _ in range(history * 4):
+        current = shuffle.advance(current)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # 真正的“上一首”：按播放顺序回退
+    played = [shuffle.advance(shuffle.current) for _ in range(10)]
+    for expected in reversed(played[:-1]):
+        assert shuffle.back(shuffle.current) == expected
+
+    # 相同种子可以复现
+    a = ShuffleOrder(size, seed=7)
+    b = ShuffleOrder(size, seed=7)
+    assert [a.advance(None) for _ in range(100)] == [b.advance(None) for _ in range(100)]
+
+    # 播放顺序对象在随机模式下邻居稳定
+    order = PlayOrder(range(1000), mode=RANDOM, seed=1)
+    previous, following = order.neighbours(0)
+    assert order.advance(0) == following
+
+    return {
+        'size': size,
+        'full_pass_s': round(elapsed, 3),
+        'per_next_us': round(elapsed / size * 1e6, 3),
+        'peak_bytes': peak,
+        'history': history,
+    }
+
+
+# MPEG1 Layer III 44.1kHz 可用的码率（kbps）及其在帧头里的编号
+MP3_BITRATES = {96: 7, 128: 9, 160: 10, 192: 11, 256: 13, 320: 14}
+
+
+def write_vbr_mp3(path, seconds, seed=0):
+    """码率随机变化的MP3：第一帧是Xing帧，和编码器一样写了总帧数和总字节数（时长从头部读出），
+    数据全零（解码出来是静音）"""
+    rng = random.Random(seed)
+    frames = int(seconds * 44100 / 1152)
+    bitrates = [128] + [rng.choice(list(MP3_BITRATES)) for _ in range(frames)]
+    lengths = [144000 * bitrate // 44100 for bitrate in bitrates]
+    with open(path, 'wb') as f:
+        for i, (bitrate, length) in enumerate(zip(bitrates, lengths)):
+            frame = bytearray(length)
+            frame[0:4] = bytes((0xFF, 0xFB, MP3_BITRATES[bitrate] << 4, 0x00))
+            if i == 0:
+                # 标志 1|2：有总帧数（不含Xing帧本身）和总字节数
+                frame[36:52] = b'Xing' + struct.pack('>III', 3, frames, sum(lengths))
+            f.write(frame)
+
+
+def flac_frame_header(number):
+    """固定块大小(4096)、44.1kHz、双声道16位的帧头，帧号按UTF-8规则编码"""
+    if number < 0x80:
+        coded = bytes((number,))
+    elif number < 0x800:
+        coded = bytes((0xC0 | number >> 6, 0x80 | number & 0x3F))
+    else:
+        coded = bytes((0xE0 | number >> 12, 0x80 | number >> 6 & 0x3F, 0x80 | number & 0x3F))
+    header = bytes((0xFF, 0xF8, 0xC9, 0x18)) + coded
+    return header + bytes((crc8(header),))
+
+
+def write_flac_stream(path, body, frames, points=(), blocksize=4096, rate=44100):
+    streaminfo = bytearray(34)
+    streaminfo[0:4] = (blocksize.to_bytes(2, 'big') * 2)
+    packed = (rate << 44) | (1 << 41) | (15 << 36) | frames * blocksize
+    streaminfo[10:18] = packed.to_bytes(8, 'big')
+    blocks = [(0, bytes(streaminfo))]
+    if points:
+        blocks.append((3, b''.join(s.to_bytes(8, 'big') + o.to_bytes(8, 'big') + blocksize.to_bytes(2, 'big')
+                                   for s, o in points)))
+    with open(path, 'wb') as f:
+        f.write(b'fLaC')
+        for i, (kind, data) in enumerate(blocks):
+            last = 0x80 if i == len(blocks) - 1 else 0
+            f.write(bytes((last | kind,)) + len(data).to_bytes(3, 'big') + data)
+        f.write(body)
+
+
+def write_flac(path, seconds, seektable=False, seed=0, blocksize=4096, rate=44100):
+    """只有合法帧头的FLAC（帧内容是零），用来测寻址表；可选每10秒一个SEEKTABLE点"""
+    rng = random.Random(seed)
+    frames = int(seconds * rate / blocksize)
+    body = bytearray()
+    points = []
+    for number in range(frames):
+        if seektable and number * blocksize >= len(points) * 10 * rate:
+            points.append((number * blocksize, len(body)))
+        body += flac_frame_header(number) + bytes(rng.randint(2000, 8000))
+    write_flac_stream(path, body, frames, points, blocksize, rate)
+
+
+def crc16(data, crc=0):
+    # FLAC帧尾：多项式0x8005，初值0（crc可以接着前面的结果算）
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x8005) & 0xFFFF if crc & 0x8000 else (crc << 1) & 0xFFFF
+    return crc
+
+
+def write_flac_tone(path, seconds, amplitude, cycles=93, blocksize=4096, rate=44100):
+    """真正能解码的FLAC正弦：每帧正好cycles个周期（93个约1001Hz），各帧相同，两个声道都是VERBATIM子帧。
+    各帧只有帧头不同：CRC16是线性的，拆成 帧头状态经过整段零字节 + 内容本身，不必逐帧逐字节计算"""
+    import numpy as np
+    t = np.arange(blocksize)
+    tone = (amplitude * np.sin(2 * np.pi * cycles * t / blocksize) * 32767).astype('>i2').tobytes()
+    payload = (b'\x02' + tone) * 2
+    payload_crc = crc16(payload)
+    shifted = [crc16(bytes(len(payload)), 1 << bit) for bit in range(16)]
+    frames = int(seconds * rate / blocksize)
+    body = bytearray()
+    for number in range(frames):
+        header = flac_frame_header(number)
+        state = crc16(header)
+        crc = payload_crc
+        for bit in range(16):
+            if state >> bit & 1:
+                crc ^= shifted[bit]
+        body += header + payload + crc.to_bytes(2, 'big')
+    write_flac_stream(path, body, frames)
+
+
+def write_flac_levels(path, levels):
+    """真正能解码的FLAC：每帧两个声道都是CONSTANT子帧，第k帧的采样值恒为levels[k]"""
+    body = bytearray()
+    for number, level in enumerate(levels):
+        frame = flac_frame_header(number) + (b'\x00' + int(level).to_bytes(2, 'big', signed=True)) * 2
+        body += frame + crc16(frame).to_bytes(2, 'big')
+    write_flac_stream(path, body, len(levels))
+
+
+def bench_seek(seconds=3600, seeks=200):
+    """一小时的VBR MP3和FLAC：建表耗时、单次定位耗时、落点是否就在目标之前；MP3再实际加载播放"""
+    root = tempfile.mkdtemp(prefix='pixel_seek_')
+    try:
+        mp3 = os.path.join(root, 'long.mp3')
+        flac = os.path.join(root, 'long.flac')
+        flac_table = os.path.join(root, 'long_seektable.flac')
+        write_vbr_mp3(mp3, seconds)
+        write_flac(flac, seconds)
+        write_flac(flac_table, seconds, seektable=True)
+        rng = random.Random(1)
+        targets = [rng.uniform(0, seconds - 1) for _ in range(seeks)]
+        cache = SeekIndexCache()
+        results = {'seconds': seconds}
+
+        for name, path in (('mp3', mp3), ('flac', flac), ('flac_seektable', flac_table)):
+            index, build = timed(cache.get, path)
+            start = time.perf_counter()
+            located = [index.locate(t) for t in targets]
+            locate = (time.perf_counter() - start) / seeks
+            worst = 0.0
+            with open(path, 'rb') as f:
+                for t, (offset, actual) in zip(targets, located):
+                    assert actual <= t + 1e-6, f'{name} 落点 {actual} 超过目标 {t}'
+                    worst = max(worst, t - actual)
+                    f.seek(offset)
+                    head = f.read(32)
+                    if name == 'mp3':
+                        assert head[:2] == b'\xff\xfb', f'{name} 偏移 {offset} 不是帧头'
+                    else:
+                        assert parse_flac_frame_header(head, 0, 4096) == round(actual * 44100)
+            results[name] = {
+                'build_s': round(build, 4),
+                'locate_us': round(locate * 1e6, 2),
+                'worst_early_s': round(worst, 3),
+            }
+
+        # FLAC切片不能播放：open_at要直接放弃，不在播放线程里为它建表
+        fresh = SeekIndexCache()
+        target, elapsed = timed(fresh.open_at, flac, targets[0])
+        assert target is None and not fresh._cache, 'FLAC 跳转时建了用不上的寻址表'
+        results['flac_open_at_us'] = round(elapsed * 1e6, 2)
+
+        # MP3 真正经由混音器跳转：寻址表重新加载 vs set_pos
+        pygame.mixer.init()
+        engine = PlaybackEngine([mp3], PlayOrder([mp3]), seek_indexes=cache)
+        engine.play(0)
+        start = time.perf_counter()
+        for t in targets[:20]:
+            engine.seek(t)
+            assert pygame.mixer.music.get_busy()
+            assert abs(engine.position() - t) < 0.2, f'跳到 {t} 后位置为 {engine.position()}'
+        indexed = (time.perf_counter() - start) / 20
+        engine.play(0)
+        start = time.perf_counter()
+        for t in targets[:5]:
+            pygame.mixer.music.set_pos(t)
+        set_pos = (time.perf_counter() - start) / 5
+        engine.stop()
+        pygame.mixer.quit()
+        results['mp3_engine_seek_ms'] = round(indexed * 1000, 2)
+        results['mp3_set_pos_ms'] = round(set_pos * 1000, 2)
+        return results
+    finally:
+        shutil.rmtree(root)
+
+
+def write_tone(path, seconds, amplitude, rate=44100, freq=997):
+    import numpy as np
+    t = np.arange(int(rate * seconds)) / rate
+    tone = (amplitude * np.sin(2 * np.pi * freq * t) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(np.repeat(tone, 2).tobytes())
+
+
+def bench_loudness(tracks=8, seconds=20, segment_minutes=(5, 30)):
+    """响度分析：测量值与理论值的误差、不同进程数的吞吐量、播放时取音量的耗时、标签和缓存命中、
+    按段解码的结果和峰值内存"""
+    from mutagen.id3 import ID3, TXXX
+    root = tempfile.mkdtemp(prefix='pixel_loudness_')
+    try:
+        files = []
+        for i in range(tracks):
+            files.append(os.path.join(root, f'{i}.wav'))
+            # -6 ~ -27 dBFS 的 997Hz 正弦，双声道时响度(LUFS)等于其dBFS值
+            write_tone(files[-1], seconds, 10 ** (-(6 + 3 * i) / 20))
+        tagged = os.path.join(root, 'tagged.mp3')
+        write_vbr_mp3(tagged, 5)
+        tags = ID3()
+        tags.add(TXXX(encoding=3, desc='REPLAYGAIN_TRACK_GAIN', text=['-6.00 dB']))
+        tags.add(TXXX(encoding=3, desc='REPLAYGAIN_TRACK_PEAK', text=['0.988']))
+        tags.save(tagged)
+
+        results = {'tracks': tracks, 'seconds_each': seconds, 'cpus': os.cpu_count(),
+                   'default_workers': LoudnessAnalyzer(None).workers}
+        for workers in sorted({1, results['default_workers'], os.cpu_count() or 1}):
+            library = TrackLibrary(os.path.join(root, f'library_{workers}.db'))
+            analyzer = LoudnessAnalyzer(library, workers=workers)
+            # 先让进程池启动，吞吐量里不算进程启动时间
+            analyzer.pool().submit(int).result()
+            start = time.perf_counter()
+            futures = analyzer.analyze(files)
+            # 分析进行中播放线程取音量：不能等分析
+            probe, probe_time = timed(analyzer.volume, files[-1])
+            for future in futures:
+                future.result()
+            while analyzer._pending:
+                time.sleep(0.01)
+            elapsed = time.perf_counter() - start
+            results[f'workers_{workers}'] = {
+                'tracks_per_s': round(tracks / elapsed, 2),
+                'audio_x_realtime': round(tracks * seconds / elapsed, 1),
+                'volume_while_busy_ms': round(probe_time * 1000, 3),
+            }
+            analyzer.close()
+            library.close()
+
+        # 测量误差
+        library = TrackLibrary(os.path.join(root, f'library_{os.cpu_count() or 1}.db'))
+        analyzer = LoudnessAnalyzer(library)
+        from loudness import content_hash
+        worst = 0.0
+        for i, path in enumerate(files):
+            loudness = library.lookup_loudness(content_hash(path))[0]
+            worst = max(worst, abs(loudness + 6 + 3 * i))
+        results['worst_error_lu'] = round(worst, 4)
+
+        # 新进程里直接从曲库命中，不再提交分析
+        _, cached_time = timed(analyzer.volume, files[0])
+        assert not analyzer._pending and analyzer._executor is None
+        results['cached_volume_ms'] = round(cached_time * 1000, 3)
+        # ReplayGain标签：不解码
+        volume = analyzer.volume(tagged)
+        assert analyzer.from_tags == 1 and abs(volume - 10 ** (-6 / 20)) < 1e-9
+        assert analyzer._executor is None
+        analyzer.close()
+        library.close()
+
+        # 有寻址表的格式按段解码：结果与整首一次测量相同，峰值内存与曲目长度无关
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        tone = os.path.join(root, 'tone.flac')
+        write_flac_tone(tone, 60, 10 ** (-12 / 20))
+        frames_per_minute = 60 * 44100 // 4096
+        lengths = {'short': segment_minutes[0], 'long': segment_minutes[1]}
+        for name, minutes in lengths.items():
+            write_flac_levels(os.path.join(root, f'{name}.flac'),
+                              [(k % 200 - 100) * 200 for k in range(frames_per_minute * minutes)])
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(1, mp_context=context, initializer=init_worker) as pool:
+            (segmented, _), _, _ = pool.submit(analyze_with_rss, tone).result()
+            whole, _ = pool.submit(analyze_whole, tone).result()
+        assert abs(segmented - whole) < 0.01 and abs(segmented + 12) < 0.1, f'分段 {segmented}，整首 {whole}'
+        results['segmented_vs_whole_lu'] = round(abs(segmented - whole), 5)
+        for name, minutes in lengths.items():
+            # 每个文件一个新进程，峰值内存互不影响
+            with ProcessPoolExecutor(1, mp_context=context, initializer=init_worker) as pool:
+                _, elapsed, rss = pool.submit(analyze_with_rss, os.path.join(root, f'{name}.flac')).result()
+            results[f'flac_{name}'] = {
+                'minutes': minutes,
+                'analyze_s': round(elapsed, 3),
+                'peak_rss_mb': round(rss / 1024, 1),
+            }
+        growth = results['flac_long']['peak_rss_mb'] / results['flac_short']['peak_rss_mb']
+        assert growth < 1.2, f'曲目长{lengths["long"] // lengths["short"]}倍，峰值内存涨了 {growth:.2f} 倍'
+        results['rss_long_over_short'] = round(growth, 3)
+        return results
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_daemon(tracks=5, clients=32, per_client=50):
+    """无界面守护进程：通过控制套接字完成播放/暂停/切歌/跳转/状态，并测多客户端并发时的往返延迟"""
+    import socket
+    root = tempfile.mkdtemp(prefix='pixel_daemon_')
+    try:
+        music = os.path.join(root, 'music')
+        os.makedirs(music)
+        for i in range(tracks):
+            write_vbr_mp3(os.path.join(music, f'{i}.mp3'), 4, seed=i)
+        pygame.mixer.init()
+        core = PlayerCore(music, library=TrackLibrary(os.path.join(root, 'library.db')))
+        path = os.path.join(root, 'player.sock')
+        daemon = PlayerDaemon(core, path)
+        daemon.start()
+        assert core.scanned.wait(10), '扫描超时'
+
+        def wait_for(check, timeout=2.0):
+            deadline = time.perf_counter() + timeout
+            while time.perf_counter() < deadline:
+                status = send_command('status', path)['status']
+                if check(status):
+                    return status
+                time.sleep(0.01)
+            raise AssertionError(f'状态不符: {status}')
+
+        assert send_command('status', path)['status']['tracks'] == tracks
+        assert send_command('play', path, index=2)['ok']
+        wait_for(lambda s: s['index'] == 2 and not s['paused'] and s['duration'] > 3.9)
+        send_command('next', path)
+        wait_for(lambda s: s['index'] == 3)
+        send_command('prev', path)
+        wait_for(lambda s: s['index'] == 2)
+        assert send_command('seek', path, seconds=2.5)['ok']
+        status = wait_for(lambda s: s['position'] >= 2.4)
+        assert status['position'] < 3.0, status
+        send_command('pause', path)
+        wait_for(lambda s: s['paused'])
+        send_command('toggle', path)
+        wait_for(lambda s: not s['paused'])
+        send_command('mode', path, mode=1)
+        wait_for(lambda s: s['mode'] == 1)
+        # 错误请求只回错误，不影响连接上的后续请求
+        assert not send_command('play', path, index=tracks)['ok']
+        assert not send_command('bogus', path)['ok']
+        # 能解析但取值溢出/非有限的参数也只回错误，服务线程不退出，状态里不会出现NaN
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(path)
+            reader = conn.makefile('rb')
+            for line in (b'{"cmd": "mode", "mode": 1e999}', b'{"cmd": "search", "query": "a", "limit": 1e999}',
+                         b'{"cmd": "play", "index": -1e999}', b'{"cmd": "seek", "seconds": NaN}',
+                         b'{"cmd": "seek", "delta": 1e999}', b'{"cmd": "status", "id": NaN}'):
+                conn.sendall(line + b'\n')
+                assert not json.loads(reader.readline())['ok'], line
+        assert not send_command('seek', path, seconds='nan')['ok']
+        status = wait_for(lambda s: s['mode'] == 1)
+        assert all(math.isfinite(v) for v in (status['position'], status['duration'])), status
+
+        latencies = []
+        lock = threading.Lock()
+
+        def client():
+            local = []
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                conn.connect(path)
+                reader = conn.makefile('rb')
+                conn.sendall(b'not json\n')
+                assert not json.loads(reader.readline())['ok']
+                for n in range(per_client):
+                    start = time.perf_counter()
+                    conn.sendall(json.dumps({'cmd': 'status', 'id': n}).encode() + b'\n')
+                    reply = json.loads(reader.readline())
+                    local.append(time.perf_counter() - start)
+                    assert reply['ok'] and reply['id'] == n
+            with lock:
+                latencies.extend(local)
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        assert len(latencies) == clients * per_client
+        latencies.sort()
+
+        daemon.close()
+        core.close()
+        pygame.mixer.quit()
+        assert not os.path.exists(path), '关闭后套接字文件应被删除'
+        return {
+            'clients': clients,
+            'requests': len(latencies),
+            'requests_per_s': round(len(latencies) / elapsed),
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+            'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+        }
+    finally:
+        shutil.rmtree(root)
+
+
+def analyze_with_rss(path):
+    # 在全新的分析进程里运行，返回 ((响度, 峰值), 耗时, 进程峰值内存KB)
+    import resource
+    result, elapsed = timed(analyze_file, path)
+    return result, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def analyze_whole(path):
+    # 对照：整首解码后一次测量
+    sound = pygame.mixer.Sound(path)
+    return measure_loudness(pygame.sndarray.samples(sound), pygame.mixer.get_init()[0])
+
+
+def summarize_with_rss(path):
+    # 在全新的分析进程里运行，返回 (摘要, 耗时, 进程峰值内存KB)
+    import resource
+    data, elapsed = timed(summarize_file, path)
+    return data, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_waveform(short_minutes=10, long_minutes=60, mp3_minutes=5):
+    """波形摘要：桶值是否正确、摘要大小、长短曲目的峰值内存、计算/渲染耗时、播放时读取的开销"""
+    import math
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    root = tempfile.mkdtemp(prefix='pixel_waveform_')
+    try:
+        frames_per_minute = 60 * 44100 // 4096
+        # 电平按正弦包络缓慢变化，每个桶里的最大值可以直接算出来
+        def levels(minutes):
+            return [int(30000 * math.sin(math.pi * k / (frames_per_minute * minutes)))
+                    for k in range(frames_per_minute * minutes)]
+        short = os.path.join(root, 'short.flac')
+        long = os.path.join(root, 'long.flac')
+        mp3 = os.path.join(root, 'long.mp3')
+        write_flac_levels(short, levels(short_minutes))
+        write_flac_levels(long, levels(long_minutes))
+        write_vbr_mp3(mp3, mp3_minutes * 60)
+
+        results = {'bytes_per_track': WAVEFORM_BUCKETS * 3}
+        context = multiprocessing.get_context('spawn')
+        for name, path, minutes in (('flac_short', short, short_minutes), ('flac_long', long, long_minutes),
+                                    ('mp3', mp3, mp3_minutes)):
+            # 每个文件一个新进程，峰值内存互不影响
+            with ProcessPoolExecutor(1, mp_context=context, initializer=init_worker) as pool:
+                data, elapsed, rss = pool.submit(summarize_with_rss, path).result()
+            assert data is not None and len(data) == WAVEFORM_BUCKETS * 3
+            results[name] = {
+                'minutes': minutes,
+                'summarize_s': round(elapsed, 3),
+                'x_realtime': round(minutes * 60 / elapsed),
+                'peak_rss_mb': round(rss / 1024, 1),
+            }
+            if name.startswith('flac'):
+                expected = levels(minutes)
+                lows, highs, _ = unpack_summary(data)
+                per_bucket = len(expected) / WAVEFORM_BUCKETS
+                worst = 0.0
+                for b in range(WAVEFORM_BUCKETS):
+                    frames = expected[int(b * per_bucket):int((b + 1) * per_bucket) or None]
+                    worst = max(worst, abs(highs[b] - max(frames) / 32768), abs(lows[b] - min(frames) / 32768))
+                # 量化误差 1/127，再加上桶边界落在帧中间时的相邻帧
+                assert worst < 0.03, f'{name} 桶值误差 {worst}'
+                results[name]['worst_bucket_error'] = round(worst, 4)
+        growth = results['flac_long']['peak_rss_mb'] / results['flac_short']['peak_rss_mb']
+        assert growth < 1.2, f'曲目长6倍，峰值内存涨了 {growth:.2f} 倍'
+        results['rss_long_over_short'] = round(growth, 3)
+
+        # 播放时：渲染一次，之后每次刷新只查内存
+        library = TrackLibrary(os.path.join(root, 'library.db'))
+        analyzer = LoudnessAnalyzer(library, workers=1)
+        summarizer = WaveformSummarizer(library, analyzer.pool)
+        summarizer.request(short)
+        deadline = time.perf_counter() + 30
+        while summarizer.peek(short) is None and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        data = summarizer.peek(short)
+        assert data is not None
+        start = time.perf_counter()
+        for _ in range(10000):
+            summarizer.peek(short)
+        peek = (time.perf_counter() - start) / 10000
+        from sprites import enlarge
+        image, render = timed(lambda: enlarge(render_waveform(data, 6, '#8064ff', '#303047', '#1b1b2a'), 2))
+        assert image.size == (WAVEFORM_BUCKETS * 2, 12)
+        # 新实例直接从曲库读出，不再计算
+        again = WaveformSummarizer(library, analyzer.pool)
+        again.request(short)
+        assert again.peek(short) == data and not again._pending
+        analyzer.close()
+        library.close()
+        results['peek_us'] = round(peek * 1e6, 3)
+        results['render_once_ms'] = round(render * 1000, 3)
+        return results
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_metrics(calls=200000, samples=100000, tracks=4):
+    """统计：关闭/打开时每次埋点的开销、直方图百分位的误差、播放器各埋点是否都有数据、采样分析器"""
+    import numpy as np
+    metrics = Metrics()
+
+    def per_call(func):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        return (time.perf_counter() - start) / calls
+
+    def probe():
+        metrics.record('probe', metrics.clock())
+
+    empty = per_call(lambda: None)
+    off = per_call(probe) - empty
+    metrics.enable()
+    on = per_call(probe) - empty
+    # 关闭时只是两次几乎立即返回的调用
+    assert off < 1e-6, f'关闭时每次埋点 {off * 1e9:.0f}ns'
+    results = {'off_ns': round(off * 1e9), 'on_ns': round(on * 1e9)}
+
+    # 对数正态的延迟：1ms附近，长尾到几百ms
+    values = np.random.default_rng(0).lognormal(np.log(1000), 1.2, samples).astype(np.int64)
+    histogram = Histogram()
+    for value in values.tolist():
+        histogram.record(value)
+    worst = 0.0
+    for q in (50, 90, 99, 99.9):
+        exact = float(np.percentile(values, q, method='inverted_cdf'))
+        worst = max(worst, abs(histogram.percentile(q) - exact) / exact)
+    assert worst < 0.02, f'百分位误差 {worst:.3%}'
+    results['worst_percentile_error'] = round(worst, 4)
+    results['histogram_buckets'] = len(histogram.counts)
+
+    root = tempfile.mkdtemp(prefix='pixel_metrics_')
+    try:
+        music = os.path.join(root, 'music')
+        os.makedirs(music)
+        for i in range(tracks):
+            write_vbr_mp3(os.path.join(music, f'{i}.mp3'), 3, seed=i)
+        pygame.mixer.init()
+        METRICS.reset()
+        METRICS.enable()
+        core = PlayerCore(music, library=TrackLibrary(os.path.join(root, 'library.db')))
+        daemon = PlayerDaemon(core, os.path.join(root, 'player.sock'))
+        assert core.scanned.wait(10), '扫描超时'
+        profiler = METRICS.start_profiler(0.002)
+        core.play_music(0)
+        core.next_music()
+        core.next_music()
+        core.worker.wait_idle()
+        core.handle_events()
+        assert core.seek(1.5)
+        core.worker.wait_idle()
+        for _ in range(100):
+            core.get_metadata(core.files[1])
+        # 第一首放完后由队列无缝衔接
+        core.play_music(3)
+        core.worker.wait_idle()
+        deadline = time.perf_counter() + 10
+        while not METRICS.counters['playback.gapless'] and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        daemon.handle({'cmd': 'status'})
+        stats = daemon.handle({'cmd': 'stats'})['stats']
+        top = daemon.handle({'cmd': 'profile', 'action': 'stop'})['profile']
+        assert daemon.handle({'cmd': 'metrics', 'enabled': False})['enabled'] is False
+        daemon.close()
+        core.close()
+        pygame.mixer.quit()
+
+        histograms = stats['histograms']
+        for name in ('playback.load', 'playback.command_to_audio', 'playback.seek', 'playback.describe',
+                     'playback.transition', 'metadata.lookup', 'metadata.read_tags', 'scan.batch'):
+            assert histograms.get(name, {}).get('count'), f'没有 {name} 的数据'
+        assert stats['counters']['scan.files'] == tracks and stats['gauges']['scan.files_per_s'] > 0
+        assert stats['counters']['playback.gapless'] >= 1
+        # 紧接着提交的play和两次下一首至少有一部分被合并，加载次数少于4次切歌命令
+        assert 2 <= histograms['playback.load']['count'] < 4, histograms['playback.load']
+        assert profiler.samples > 0 and top
+        # 空闲的监视线程一直阻塞在select里，不能排在热点前面
+        assert not top[0][0].startswith('library-watch;'), top[:3]
+        results['player'] = {name: {key: histograms[name][key] for key in ('count', 'p50_ms', 'p99_ms')}
+                             for name in ('playback.load', 'playback.command_to_audio', 'playback.seek',
+                                          'metadata.lookup')}
+        results['scan_files_per_s'] = stats['gauges']['scan.files_per_s']
+        results['profiler_samples'] = profiler.samples
+        results['profiler_top'] = top[:3]
+    finally:
+        METRICS.disable()
+        shutil.rmtree(root, ignore_errors=True)
+
+    # 采样分析器本身的开销：同一段纯Python计算，开/关采样各跑一次
+    def work():
+        start = time.perf_counter()
+        total = 0
+        for i in range(2000000):
+            total += i * i
+        return time.perf_counter() - start
+    plain = min(work() for _ in range(3))
+    # 同时有阻塞在select/read/sleep里的线程：这些C函数里的等待只能靠线程的CPU时间认出来
+    import select
+    r, w = os.pipe()
+    waiters = [threading.Thread(target=target, name=name, daemon=True) for name, target in (
+        ('wait-select', lambda: select.select([r], [], [], 10)),
+        ('wait-read', lambda: os.read(r, 1)),
+        ('wait-sleep', lambda: time.sleep(1)),
+    )]
+    for thread in waiters:
+        thread.start()
+    profiler = SamplingProfiler(0.005)
+    profiler.start()
+    sampled = min(work() for _ in range(3))
+    profiler.stop()
+    os.write(w, b'x')
+    for thread in waiters:
+        thread.join()
+    os.close(r)
+    os.close(w)
+    top = profiler.top()
+    waiting = [name for name, _ in top if name.startswith('wait-')]
+    if profiler.idle:
+        # 支持线程CPU时间的平台上等待的线程不出现在结果里
+        assert not waiting and top[0][0].startswith('MainThread;'), top[:3]
+    results['profiler_overhead'] = round(sampled / plain - 1, 3)
+    results['profiler_top_with_waiters'] = top[:2]
+    return results
+
+
+def bench_watch(tracks=20, bulk=3000):
+    """监视曲库：增删改名（含正在播放的曲目）后序号仍指向同一首，批量复制时的批数和延迟，以及轮询退路"""
+    root = tempfile.mkdtemp(prefix='pixel_watch_')
+    try:
+        music = os.path.join(root, 'music')
+        os.makedirs(os.path.join(music, 'm'))
+        template = os.path.join(root, 'template.mp3')
+        write_vbr_mp3(template, 3)
+        for i in range(tracks):
+            shutil.copy(template, os.path.join(music, 'm', f'{i:02d}.mp3'))
+        pygame.mixer.init()
+        core = PlayerCore(music, library=TrackLibrary(os.path.join(root, 'library.db')))
+        assert core.scanned.wait(10), '扫描超时'
+        deadline = time.perf_counter() + 5
+        while core.watcher is None and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        results = {'mode': core.watcher.mode}
+        reindexed = []
+
+        def settle(check, timeout=15.0):
+            deadline = time.perf_counter() + timeout
+            while time.perf_counter() < deadline:
+                core.worker.wait_idle()
+                reindexed.extend(e for e in core.handle_events() if e[0] == 'reindexed')
+                if check():
+                    return time.perf_counter()
+                time.sleep(0.01)
+            raise AssertionError(f'等待超时: {len(core.files)} 首, 当前 {core.play_num}')
+
+        def current():
+            return core.files[core.play_num]
+
+        playing = os.path.abspath(os.path.join(music, 'm', '10.mp3'))
+        core.play_music(10)
+        settle(lambda: core.metadata is not None and current() == playing)
+        # 测试曲目只有几秒，暂停住免得中途自动切到下一首
+        core.pause()
+
+        # 在当前曲目之前批量复制几千个文件：序号整体后移，但仍然指向同一首
+        bulk_dir = os.path.join(music, 'a_bulk')
+        os.makedirs(bulk_dir)
+        batches = core.watcher.batches
+        start = time.perf_counter()
+        for i in range(bulk):
+            shutil.copy(template, os.path.join(bulk_dir, f'{i:05d}.mp3'))
+        copied = time.perf_counter()
+        done = settle(lambda: len(core.files) == tracks + bulk)
+        assert current() == playing and core.play_num == 10 + bulk, (core.play_num, current())
+        results['bulk'] = {
+            'files': bulk,
+            'copy_s': round(copied - start, 2),
+            'visible_after_copy_s': round(done - copied, 2),
+            'batches': core.watcher.batches - batches,
+            'ui_events': len(reindexed),
+        }
+        # 攒批：UI线程收到的事件数和批数一样，远少于文件数
+        assert results['bulk']['batches'] <= (copied - start) / 2 + 3, results['bulk']
+        assert len(core.order.held()) < 300
+
+        # 删掉前面的一半、改名当前曲目、整个目录改名
+        for i in range(0, bulk, 2):
+            os.remove(os.path.join(bulk_dir, f'{i:05d}.mp3'))
+        settle(lambda: len(core.files) == tracks + bulk // 2)
+        assert current() == playing
+        renamed = os.path.abspath(os.path.join(music, 'm', '10 renamed.mp3'))
+        os.rename(playing, renamed)
+        settle(lambda: core.worker.index == core.engine.current and current() == renamed)
+        moved_dir = os.path.join(music, 'z_moved')
+        os.rename(os.path.join(music, 'm'), moved_dir)
+        playing = os.path.abspath(os.path.join(moved_dir, '10 renamed.mp3'))
+        settle(lambda: current() == playing)
+        assert len(core.files) == tracks + bulk // 2
+        # 改名保留了已读的标签：元数据从曲库读，不重新解析
+        assert core.library.lookup(playing)[2] is not None
+
+        # 删掉正在播放的曲目：不崩溃，下一首还是原来的下一首
+        following = os.path.abspath(os.path.join(moved_dir, '11.mp3'))
+        os.remove(playing)
+        settle(lambda: len(core.files) == tracks + bulk // 2 - 1)
+        core.next_music()
+        settle(lambda: current() == following)
+        results['deleted_current_next_ok'] = True
+
+        # 硬链接（ln、cp -l）和符号链接只有IN_CREATE，没有CLOSE_WRITE
+        os.link(following, os.path.join(moved_dir, 'linked.mp3'))
+        os.symlink(following, os.path.join(moved_dir, 'symlinked.mp3'))
+        settle(lambda: len(core.files) == tracks + bulk // 2 + 1)
+        assert current() == following
+
+        # 删除整个目录
+        shutil.rmtree(bulk_dir)
+        settle(lambda: len(core.files) == tracks + 1)
+        assert current() == following
+        core.close()
+        pygame.mixer.quit()
+
+        # 轮询退路：只靠目录mtime做增量扫描
+        received = []
+        scanner = LibraryScanner(music)
+        scanner.files()
+        watcher = LibraryWatcher(scanner, received.append, polling=True)
+        shutil.copy(template, os.path.join(music, 'polled.mp3'))
+        os.remove(os.path.join(moved_dir, '00.mp3'))
+        start = time.perf_counter()
+        while not received and time.perf_counter() - start < 10:
+            time.sleep(0.05)
+        watcher.close()
+        assert watcher.mode == 'polling' and received, '轮询没有发现变化'
+        assert received[0].added == {os.path.abspath(os.path.join(music, 'polled.mp3'))}
+        assert received[0].removed == {os.path.abspath(os.path.join(moved_dir, '00.mp3'))}
+        results['polling_latency_s'] = round(time.perf_counter() - start, 2)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    # 同一批里的多次变化合并成最终结果
+    delta = LibraryDelta()
+    delta.add('/m/new.mp3')
+    delta.rename('/m/new.mp3', '/m/newer.mp3')
+    delta.rename('/m/a.mp3', '/m/b.mp3')
+    delta.rename('/m/b.mp3', '/m/c.mp3')
+    delta.remove('/m/x.mp3')
+    delta.rename_dir('/m', '/n')
+    assert delta.added == {'/n/newer.mp3'} and delta.renamed == {'/n/a.mp3': '/n/c.mp3'}
+    assert delta.removed == {'/n/x.mp3'} and delta.translate('/m/a.mp3') == '/n/c.mp3'
+    return results
+
+
+def make_tags(tracks, seed=0):
+    """合成的标签：英文拼音式的词和常用汉字混排，歌手和专辑重复出现"""
+    rng = random.Random(seed)
+    consonants, vowels = 'bcdfghjklmnprstvwyz', 'aeiou'
+    words = [''.join(rng.choice(consonants) + rng.choice(vowels) for _ in range(rng.randint(1, 4))).capitalize()
+             for _ in range(20000)]
+    hanzi = [chr(0x4e00 + rng.randrange(3000)) for _ in range(3000)]
+
+    def phrase(low, high):
+        if rng.random() < 0.3:
+            return ''.join(rng.choice(hanzi) for _ in range(rng.randint(low + 1, high + 2)))
+        return ' '.join(rng.choice(words) for _ in range(rng.randint(low, high)))
+
+    artists = [phrase(1, 2) for _ in range(max(tracks // 40, 1))]
+    albums = [phrase(1, 3) for _ in range(max(tracks // 10, 1))]
+    return [(f'/music/{i // 10:06d}/{i % 10:02d}.mp3', phrase(1, 5), rng.choice(artists), rng.choice(albums))
+            for i in range(tracks)]
+
+
+def bench_search(tracks=200000, typed=300):
+    """搜索：建索引耗时和每首的内存，逐字输入时每次查询的延迟，以及曲库修改后索引同步"""
+    root = tempfile.mkdtemp(prefix='pixel_search_')
+    try:
+        library = TrackLibrary(os.path.join(root, 'library.db'))
+        rows = make_tags(tracks)
+        # 直接写表，跳过按文件读标签
+        library._db.executemany('INSERT INTO tracks (path, title, artist, album) VALUES (?, ?, ?, ?)', rows)
+        library._db.commit()
+        index = SearchIndex()
+        _, build = timed(index.build, library)
+        assert len(index) == tracks
+        # 内存单独再建一次量（tracemalloc会拖慢建索引）
+        del index
+        tracemalloc.start()
+        index = SearchIndex()
+        index.build(library)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        # 逐字输入：从随机曲目的标题/歌手/专辑里截一段，一个字一个字地查
+        rng = random.Random(1)
+        by_length = {}
+        worst = 0.0
+        for _ in range(typed):
+            field = rng.choice(rng.choice(rows)[1:])
+            start = rng.randrange(max(len(field) - 6, 1))
+            target = field[start:start + rng.randint(3, 10)]
+            for n in range(1, len(target) + 1):
+                found, elapsed = timed(index.search, target[:n], 50)
+                by_length.setdefault(min(n, 6), []).append(elapsed)
+                worst = max(worst, elapsed)
+            assert found, target
+        # 不沿用上一次结果的查询（直接粘贴一个词）
+        cold = []
+        for _ in range(typed):
+            field = rng.choice(rng.choice(rows)[1:])
+            index._last = None
+            _, elapsed = timed(index.search, field[:rng.randint(3, 8)], 50)
+            cold.append(elapsed)
+
+        # 与逐条比对的结果一致，包括全角/大小写
+        texts = {path: normalize('\n'.join(row)) for path, *row in rows}
+        for query in ('ba', 'KO NA', rows[7][1][:4], rows[9][2]):
+            expected = sorted(path for path, text in texts.items() if normalize(query).strip() in text)
+            index._last = None
+            assert index.search(query) == expected, query
+        assert index.search('ＢＡ') == index.search('ba')
+
+        # 曲库的修改同步到索引（在正常大小的曲库上）
+        small = SearchIndex()
+        library.listeners.append(small.on_library_change)
+        library.remove_files([path for path, *_ in rows[1000:]])
+        small.build(library)
+        path, title = rows[0][0], rows[0][1]
+        library.rename_files([(path, '/music/renamed.mp3')])
+        assert small.search(title)[:1] == ['/music/renamed.mp3'] and path not in small.search(title)
+        library.rename_prefix('/music/000001', '/music/moved')
+        assert small.search(rows[15][1])[0].startswith('/music/moved/')
+        library.save_tags('/music/renamed.mp3', (1, 1), {'title': 'Zzqx Special', 'artist': 'A', 'album': 'B'})
+        assert small.search('zzqx') == ['/music/renamed.mp3'] and '/music/renamed.mp3' not in small.search(title)
+        # 扫描再次报告已有的文件，不会把读到的标签换回文件名
+        small.on_library_change('added', ['/music/renamed.mp3'])
+        assert small.search('zzqx') == ['/music/renamed.mp3']
+        library.remove_files(['/music/renamed.mp3'])
+        assert small.search('zzqx') == []
+        library.close()
+
+        def summary(samples):
+            samples = sorted(samples)
+            return {
+                'p50_ms': round(samples[len(samples) // 2] * 1000, 3),
+                'p99_ms': round(samples[int(len(samples) * 0.99)] * 1000, 3),
+            }
+
+        return {
+            'tracks': tracks,
+            'build_s': round(build, 2),
+            'bytes_per_track': round(memory / tracks),
+            'grams': len(index.postings),
+            'typed_ms_by_length': {f'{n}{"+" if n == 6 else ""}': summary(samples)
+                                   for n, samples in sorted(by_length.items())},
+            'typed_worst_ms': round(worst * 1000, 2),
+            'cold': summary(cold),
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def has_display():
+    return subprocess.run([sys.executable, '-c', 'import tkinter; tkinter.Tk().destroy()'],
+                          stderr=subprocess.DEVNULL).returncode == 0
+
+
+def bench_startup(runs=5):
+    """启动：首帧之前要导入的模块（取多次里最快的一次），推迟到首帧之后的模块不能提前出现；
+    有显示器时再完整跑一次 --profile-startup"""
+    def importtime(code):
+        best = None
+        for _ in range(runs):
+            child = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                   stderr=subprocess.PIPE, text=True, encoding='utf-8', check=True)
+            costs, total = parse_importtime(child.stderr.splitlines())
+            if best is None or total < best[1]:
+                best = costs, total
+        return best
+
+    baseline = importtime('pass')[0]
+    costs, total = importtime('import UpdateUI')
+    deferred = ('pygame', 'numpy', 'mutagen', 'fontTools', 'player_core', 'waveform', 'concurrent')
+    early = [name for name in deferred if name in costs]
+    assert not early, f'首帧之前就导入了 {early}'
+    _, core_total = importtime('import player_core')
+    results = {
+        'ui_imports_ms': round(total / 1000, 1),
+        'interpreter_imports_ms': round(sum(baseline.values()) / 1000, 1),
+        'deferred_core_imports_ms': round(core_total / 1000, 1),
+        'ui_top_modules_ms': {name: round(us / 1000, 1)
+                              for name, us in sorted(costs.items(), key=lambda item: -item[1])[:8]},
+    }
+
+    if has_display():
+        report = profile_startup(os.path.abspath('UpdateUI.py'))
+        results['milestones_ms'] = report['milestones_ms']
+        results['phases_ms'] = report['phases_ms']
+    else:
+        results['milestones_ms'] = '没有显示器，跳过完整启动'
+    return results
+
+
+BENCHMARKS = {
+    'sprites': bench_sprites,
+    'atlas': bench_atlas,
+    'scan': bench_scan,
+    'library': bench_library,
+    'gapless': bench_gapless,
+    'worker': bench_worker,
+    'shuffle': bench_shuffle,
+    'seek': bench_seek,
+    'loudness': bench_loudness,
+    'daemon': bench_daemon,
+    'waveform': bench_waveform,
+    'metrics': bench_metrics,
+    'watch': bench_watch,
+    'search': bench_search,
+    'startup': bench_startup,
+}
+
+
+# 基准套件：固定种子生成的素材，结果是一层的 {指标: 数值}，可以和保存的基线比较。
+# 以 _per_s 结尾的越大越好，其余（_ms、_mb）越小越好
+SUITE_RESULTS_PATH = os.path.join('cache', 'benchmark_results.json')
+SUITE_BASELINE_PATH = os.path.join('cache', 'benchmark_baseline.json')
+# 比基线差多少（相对）算退化；很小的数值再加一点绝对的余量，免得抖动也报退化
+REGRESSION_THRESHOLD = 0.25
+NOISE_FLOORS = {'_ms': 0.05, '_mb': 1.0}
+# 每项取几次的中位数
+SUITE_REPEATS = 5
+SUITE_POWERS = (1, 2, 4, 8)
+SUITE_TREES = (10000, 100000)
+
+
+class SuiteSkipped(Exception):
+    """这一项在当前环境里跑不了（例如没有显示器）"""
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def measure(func, loops=1, repeats=SUITE_REPEATS):
+    """每次连续调用loops遍，取repeats次里的中位数，返回单次的秒数；很快的操作多调几遍才不受计时抖动影响"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        times.append((time.perf_counter() - start) / loops)
+    return median(times)
+
+
+def mp4_atom(kind, *children):
+    body = b''.join(children)
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def mp4_full_atom(kind, body):
+    # version(1) + flags(3)
+    return mp4_atom(kind, bytes(4) + body)
+
+
+def write_m4a(path, seconds, title, artist, album, rate=44100):
+    """只有头部的M4A：mvhd/mdhd里的时长和ilst里的标签，没有音频数据（只用来测标签和时长）"""
+    length = int(seconds * rate)
+    mvhd = mp4_full_atom(b'mvhd', struct.pack('>IIII', 0, 0, rate, length) + bytes(80))
+    mdhd = mp4_full_atom(b'mdhd', struct.pack('>IIIIHH', 0, 0, rate, length, 0x55c4, 0))
+    hdlr = mp4_full_atom(b'hdlr', bytes(4) + b'soun' + bytes(13))
+    stbl = mp4_atom(b'stbl', mp4_full_atom(b'stsd', bytes(4)))
+    trak = mp4_atom(b'trak', mp4_atom(b'mdia', mdhd, hdlr, mp4_atom(b'minf', stbl)))
+
+    def text(kind, value):
+        # 类型1是UTF-8文本
+        return mp4_atom(kind, mp4_atom(b'data', struct.pack('>II', 1, 0) + value.encode('utf-8')))
+
+    ilst = mp4_atom(b'ilst', text(b'\xa9nam', title), text(b'\xa9ART', artist), text(b'\xa9alb', album))
+    meta = mp4_full_atom(b'meta', mp4_full_atom(b'hdlr', bytes(4) + b'mdirappl' + bytes(9)) + ilst)
+    with open(path, 'wb') as f:
+        f.write(mp4_atom(b'ftyp', b'M4A \0\0\0\0M4A mp42isom'))
+        f.write(mp4_atom(b'moov', mvhd, trak, mp4_atom(b'udta', meta)))
+        f.write(mp4_atom(b'mdat', bytes(1024)))
+
+
+def tag_file(path, title, artist, album):
+    """用mutagen写标签：MP3写ID3，FLAC写Vorbis注释"""
+    if path.endswith('.mp3'):
+        from mutagen.easyid3 import EasyID3
+        tags = EasyID3()
+        tags.update({'title': title, 'artist': artist, 'album': album})
+        tags.save(path)
+    else:
+        from mutagen.flac import FLAC
+        tags = FLAC(path)
+        tags.update({'title': title, 'artist': artist, 'album': album})
+        tags.save()
+
+
+def make_fixtures(root, per_format=100, seconds=4):
+    """MP3/FLAC/M4A 各per_format首，标签来自make_tags（固定种子）；
+    另有30分钟的MP3（读头部）和头部没写总长度、只能整段解码的5分钟FLAC。返回 {名字: 路径列表}"""
+    templates = {'mp3': os.path.join(root, 'template.mp3'), 'flac': os.path.join(root, 'template.flac')}
+    os.makedirs(root)
+    write_vbr_mp3(templates['mp3'], seconds)
+    write_flac_levels(templates['flac'], [1000] * int(seconds * 44100 / 4096))
+    fixtures = {'mp3': [], 'flac': [], 'm4a': []}
+    for ext in fixtures:
+        os.makedirs(os.path.join(root, ext))
+    for i, (_, title, artist, album) in enumerate(make_tags(per_format * 3)):
+        ext = ('mp3', 'flac', 'm4a')[i % 3]
+        path = os.path.join(root, ext, f'{i:04d}.{ext}')
+        if ext == 'm4a':
+            write_m4a(path, seconds, title, artist, album)
+        else:
+            shutil.copy(templates[ext], path)
+            tag_file(path, title, artist, album)
+        fixtures[ext].append(path)
+
+    long_mp3 = os.path.join(root, 'long.mp3')
+    write_vbr_mp3(long_mp3, 30 * 60)
+    tag_file(long_mp3, 'Long', 'Benchmark', 'Fixtures')
+    unknown = os.path.join(root, 'unknown_length.flac')
+    write_flac_levels(unknown, [1000] * (5 * 60 * 44100 // 4096))
+    with open(unknown, 'r+b') as f:
+        # STREAMINFO里的总采样数（36位）清零：头部读不出时长
+        f.seek(8 + 13)
+        head = f.read(1)[0]
+        f.seek(8 + 13)
+        f.write(bytes((head & 0xF0,)) + bytes(4))
+    fixtures['long'] = [long_mp3]
+    fixtures['unknown_length'] = [unknown]
+    return fixtures
+
+
+def open_core(root, name):
+    """音乐文件夹为空的播放核心（扫描和监视都不干扰计时），曲库放在root下"""
+    empty = os.path.join(root, 'empty')
+    os.makedirs(empty, exist_ok=True)
+    return PlayerCore(empty, library=TrackLibrary(os.path.join(root, name)))
+
+
+def suite_metadata(root, fixtures):
+    """get_metadata 每秒多少首：首次读取（mutagen解析+写曲库）、内存命中、重启后从曲库读"""
+    everything = [path for ext in ('mp3', 'flac', 'm4a') for path in fixtures[ext]]
+    cold = {ext: [] for ext in ('mp3', 'flac', 'm4a')}
+    warm, disk = [], []
+    for run in range(SUITE_REPEATS):
+        db = f'metadata{run}.db'
+        core = open_core(root, db)
+        for ext in cold:
+            _, elapsed = timed(lambda: [core.get_metadata(path) for path in fixtures[ext]])
+            cold[ext].append(elapsed / len(fixtures[ext]))
+        _, elapsed = timed(lambda: [core.get_metadata(path) for path in everything])
+        warm.append(elapsed / len(everything))
+        core.close()
+        core = open_core(root, db)
+        data, elapsed = timed(lambda: [core.get_metadata(path) for path in everything])
+        disk.append(elapsed / len(everything))
+        core.close()
+        assert all(item['artist'] != UNKNOWN_ARTIST for item in data), '有标签没读出来'
+    results = {f'metadata_cold_{ext}_per_s': round(1 / median(times)) for ext, times in cold.items()}
+    results['metadata_warm_per_s'] = round(1 / median(warm))
+    results['metadata_disk_per_s'] = round(1 / median(disk))
+    return results
+
+
+def duration_with_rss(root, path):
+    # 在全新的进程里运行，返回 (时长, 耗时, 这次调用让进程峰值内存涨了多少KB)
+    import resource
+    pygame.mixer.init()
+    core = open_core(root, f'duration_{os.getpid()}.db')
+    # 标签先读好，只计时长本身
+    core.get_metadata(path)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    duration, elapsed = timed(core.get_audio_duration, path)
+    grown = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    core.close()
+    pygame.mixer.quit()
+    return duration, elapsed, grown
+
+
+def suite_duration(root, fixtures):
+    """get_audio_duration：各格式读头部的延迟（标签已缓存），长曲目（Xing头）和只能整段解码时的延迟、峰值内存"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    latencies = {ext: [] for ext in ('mp3', 'flac', 'm4a')}
+    for run in range(SUITE_REPEATS):
+        core = open_core(root, f'duration{run}.db')
+        for ext, times in latencies.items():
+            for path in fixtures[ext]:
+                core.get_metadata(path)
+                duration, elapsed = timed(core.get_audio_duration, path)
+                assert abs(duration - 4) < 0.2, (path, duration)
+                times.append(elapsed)
+        core.close()
+    results = {f'duration_{ext}_ms': round(median(times) * 1000, 4) for ext, times in latencies.items()}
+
+    context = multiprocessing.get_context('spawn')
+    for name, expected in (('long', 30 * 60), ('unknown_length', 5 * 60)):
+        runs = []
+        for _ in range(3):
+            # 每次一个新进程，峰值内存互不影响
+            with ProcessPoolExecutor(1, mp_context=context) as pool:
+                runs.append(pool.submit(duration_with_rss, root, fixtures[name][0]).result())
+        assert all(abs(duration - expected) < 1 for duration, _, _ in runs), (name, runs)
+        results[f'duration_{name}_ms'] = round(median(elapsed for _, elapsed, _ in runs) * 1000, 3)
+        results[f'duration_{name}_peak_mb'] = round(median(grown for _, _, grown in runs) / 1024, 1)
+    return results
+
+
+def suite_sprites(root, fixtures):
+    """enlarge（各倍数）和 replace_colors：resources.json里的全部精灵处理一遍的耗时"""
+    with open('resources.json', 'r', encoding='utf-8') as f:
+        sources = {name: to_pil(data) for name, data in json.load(f).items()}
+    results = {}
+    # 第一次调用要导入numpy，不计入
+    enlarge(sources['win'], 1, bg='#00ff00')
+    replace_colors(sources['win'], OFF_COLORS)
+    for power in SUITE_POWERS:
+        elapsed = measure(lambda: [enlarge(image, power, bg='#00ff00' if name == 'win' else None)
+                                   for name, image in sources.items()], loops=20)
+        results[f'enlarge_x{power}_ms'] = round(elapsed * 1000, 3)
+    elapsed = measure(lambda: [replace_colors(image, OFF_COLORS) for image in sources.values()], loops=20)
+    results['replace_colors_ms'] = round(elapsed * 1000, 3)
+    return results
+
+
+def suite_scan(root, fixtures):
+    """list_files_and_folders：歌手/专辑结构的 1万、10万 文件目录树"""
+    core = open_core(root, 'scan.db')
+    results = {}
+    try:
+        for tracks in SUITE_TREES:
+            tree = os.path.join(root, f'tree{tracks}')
+            make_tree(tree, tracks)
+            times = []
+            for _ in range(SUITE_REPEATS):
+                (files, folders), elapsed = timed(core.list_files_and_folders, tree)
+                assert len(files) == tracks, len(files)
+                times.append(elapsed)
+            results[f'list_files_{tracks // 1000}k_ms'] = round(median(times) * 1000, 1)
+            shutil.rmtree(tree)
+    finally:
+        core.close()
+    return results
+
+
+def suite_tick(root, fixtures, ticks=200, timeout=30.0):
+    """不需要显示器的界面部分：播放核心从创建到首次出声的时间（界面的 first_audio 去掉Tk），
+    出声后每次刷新里核心的工作：同步事件、取播放位置、列表三行（cycle_row 去掉控件的configure）"""
+    music = os.path.join(root, 'tick_music')
+    shutil.copytree(os.path.dirname(fixtures['mp3'][0]), music)
+    first_audio = []
+    tick = []
+    pygame.mixer.init()
+    for run in range(SUITE_REPEATS):
+        start = time.perf_counter()
+        core = PlayerCore(music, library=TrackLibrary(os.path.join(root, f'tick{run}.db')))
+        try:
+            # 和 --profile-startup 一样：扫描出第一首就播放，播放线程报告切歌时算出声
+            while core.metadata is None:
+                assert time.perf_counter() - start < timeout, '等待首次出声超时'
+                core.handle_events()
+                if core.files and core.paused:
+                    core.play_music(0)
+                time.sleep(0.001)
+            first_audio.append(time.perf_counter() - start)
+            # 等扫描线程交完响度分析再计时，也免得关闭曲库时它还在查询
+            while any(t.name == 'library-scan' for t in threading.enumerate()):
+                assert time.perf_counter() - start < timeout, '扫描超时'
+                time.sleep(0.01)
+            assert len(core.list_rows()) == 3
+            tick.append(measure(lambda: (core.handle_events(), core.position(), core.list_rows()),
+                                loops=ticks, repeats=1))
+        finally:
+            core.close()
+    pygame.mixer.quit()
+    return {
+        'core_first_audio_ms': round(median(first_audio) * 1000, 1),
+        'tick_core_ms': round(median(tick) * 1000, 4),
+    }
+
+
+def start_xvfb():
+    """启动一个Xvfb（由它自己挑空闲的显示号），返回 (进程, DISPLAY)；没有安装或启动失败时返回None"""
+    if shutil.which('Xvfb') is None:
+        return None
+    read, write = os.pipe()
+    process = subprocess.Popen(['Xvfb', '-displayfd', str(write), '-screen', '0', '1024x768x24', '-nolisten', 'tcp'],
+                               pass_fds=(write,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.close(write)
+    with os.fdopen(read) as f:
+        number = f.readline().strip()
+    if not number:
+        process.kill()
+        process.wait()
+        return None
+    return process, f':{number}'
+
+
+def suite_ui(root, fixtures, runs=3):
+    """界面：启动到首帧、到首次出声的时间，出声后每次 cycle_row 的耗时（--profile-startup 的子进程）。
+    没有显示器时在Xvfb里跑；连Xvfb也没有时跳过，不需要Tk的部分见 tick"""
+    server = None
+    display = os.environ.get('DISPLAY')
+    if not has_display():
+        server = start_xvfb()
+        if server is None:
+            raise SuiteSkipped('没有显示器，也没有安装Xvfb')
+        os.environ['DISPLAY'] = server[1]
+    try:
+        # 在单独的目录里启动：音乐文件夹是合成的素材，曲库也不写进正在用的cache
+        sandbox = os.path.join(root, 'ui')
+        os.makedirs(os.path.join(sandbox, 'cache'))
+        for name in ('resources.json', 'VonwaonBitmap-12px.ttf', 'VonwaonBitmap-16px.ttf', 'icon.ico', ATLAS_PATH):
+            if os.path.exists(name):
+                shutil.copy(name, os.path.join(sandbox, name))
+        shutil.copytree(os.path.join(os.path.dirname(fixtures['mp3'][0])), os.path.join(sandbox, 'music'))
+        reports = [profile_startup(os.path.abspath('UpdateUI.py'), cwd=sandbox) for _ in range(runs)]
+    finally:
+        if server is not None:
+            server[0].terminate()
+            server[0].wait()
+            if display is None:
+                del os.environ['DISPLAY']
+            else:
+                os.environ['DISPLAY'] = display
+    return {
+        'first_frame_ms': median(r['milestones_ms']['first_frame'] for r in reports),
+        'first_audio_ms': median(r['milestones_ms']['first_audio'] for r in reports),
+        'cycle_row_ms': median(r['samples_ms']['cycle_row']['median'] for r in reports),
+    }
+
+
+SUITE = {
+    'metadata': suite_metadata,
+    'duration': suite_duration,
+    'sprites': suite_sprites,
+    'scan': suite_scan,
+    'tick': suite_tick,
+    'ui': suite_ui,
+}
+
+
+def run_suite(names=None):
+    """跑基准套件，返回 {'metrics': {指标: 数值}, 'items': {项: [指标]}, 'skipped': {项: 原因}, 'environment': ...}"""
+    root = tempfile.mkdtemp(prefix='pixel_suite_')
+    metrics = {}
+    items = {}
+    skipped = {}
+    try:
+        pygame.mixer.init()
+        fixtures = make_fixtures(os.path.join(root, 'fixtures'))
+        for name in names or SUITE:
+            print(f'{name} ...', file=sys.stderr)
+            try:
+                result = SUITE[name](root, fixtures)
+                metrics.update(result)
+                items[name] = sorted(result)
+            except SuiteSkipped as e:
+                skipped[name] = str(e)
+    finally:
+        pygame.mixer.quit()
+        shutil.rmtree(root, ignore_errors=True)
+    return {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'pygame': pygame.version.ver,
+            'sdl_audio': os.environ.get('SDL_AUDIODRIVER'),
+        },
+        'metrics': metrics,
+        'items': items,
+        'skipped': skipped,
+    }
+
+
+def compare(metrics, baseline, threshold=REGRESSION_THRESHOLD, required=()):
+    """返回比基线差了threshold以上的指标：[(名字, 基线, 本次, 变化比例)]。
+    required里的指标这次没有测到也算退化（本次为None），其余只在基线里有的指标不比"""
+    regressions = []
+    for name, before in sorted(baseline.items()):
+        now = metrics.get(name)
+        if now is None:
+            if name in required:
+                regressions.append((name, before, None, None))
+            continue
+        if name.endswith('_per_s'):
+            worse = now < before * (1 - threshold)
+        else:
+            floor = next((value for suffix, value in NOISE_FLOORS.items() if name.endswith(suffix)), 0.0)
+            worse = now > before * (1 + threshold) + floor
+        if worse:
+            regressions.append((name, before, now, round(now / before - 1, 3) if before else None))
+    return regressions
+
+
+def write_json(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+
+
+def main_suite(argv):
+    """--suite [项 ...] [--output 路径] [--baseline 路径] [--threshold 0.25] [--save-baseline]
+    结果写到output；有基线时逐项比较，有退化时退出码为1"""
+    options = {'--output': SUITE_RESULTS_PATH, '--baseline': SUITE_BASELINE_PATH, '--threshold': REGRESSION_THRESHOLD}
+    names = []
+    save = False
+    argv = list(argv)
+    while argv:
+        arg = argv.pop(0)
+        if arg in options:
+            options[arg] = argv.pop(0)
+        elif arg == '--save-baseline':
+            save = True
+        elif arg in SUITE:
+            names.append(arg)
+        else:
+            raise SystemExit(f'未知参数: {arg}（可选的项: {" ".join(SUITE)}）')
+    results = run_suite(names)
+    write_json(options['--output'], results)
+    baseline_path = options['--baseline']
+    baseline = {}
+    required = set()
+    if save:
+        write_json(baseline_path, results)
+    elif os.path.exists(baseline_path):
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        baseline = saved['metrics']
+        # 这次跑了的项，基线里有的指标都要有（例如基线有界面的结果，这次却因为没有显示器跳过了）
+        for name in names or SUITE:
+            required.update(saved.get('items', {}).get(name, ()))
+
+    # 表头是全角字，每个占两列
+    print(f"{'指标':<28}{'本次':>12}{'基线':>12}{'变化':>7}")
+    for name, value in results['metrics'].items():
+        before = baseline.get(name)
+        change = f'{value / before - 1:+.1%}' if before else ''
+        print(f"{name:<30}{value:>14}{before if before is not None else '':>14}{change:>9}")
+    for name, reason in results['skipped'].items():
+        print(f'跳过 {name}: {reason}')
+    print(f"结果已写入 {options['--output']}")
+    if save:
+        print(f'已保存为基线 {baseline_path}')
+        return 0
+    if not baseline:
+        print('没有基线，用 --save-baseline 保存本次结果作为基线')
+        return 0
+    regressions = compare(results['metrics'], baseline, float(options['--threshold']), required)
+    for name, before, now, change in regressions:
+        if now is None:
+            print(f'缺失: {name}（基线 {before}，这次没有测到）')
+        else:
+            print(f'退化: {name} {before} -> {now}' + (f' ({change:+.1%})' if change is not None else ''))
+    if not regressions:
+        print(f"没有超过 {float(options['--threshold']):.0%} 的退化")
+    return 1 if regressions else 0
+
+
+# 用法: python benchmark.py [名字 ...]   单项基准，打印结果
+#       python benchmark.py --suite [项 ...] [--save-baseline] [--baseline 路径] [--threshold 0.25] [--output 路径]
+#       套件：固定的合成素材，结果写成JSON并与基线比较，有退化时退出码为1
+if __name__ == '__main__':
+    usage = (f'用法: python benchmark.py [名字 ...]（可选的名字: {" ".join(BENCHMARKS)}）\n'
+             f'      python benchmark.py --suite [项 ...] [--save-baseline] [--baseline 路径] [--threshold 0.25] '
+             f'[--output 路径]（可选的项: {" ".join(SUITE)}）')
+    if '-h' in sys.argv or '--help' in sys.argv:
+        print(usage)
+        sys.exit(0)
+    if '--suite' in sys.argv:
+        sys.exit(main_suite([arg for arg in sys.argv[1:] if arg != '--suite']))
+    names = sys.argv[1:] or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise SystemExit(f'未知的基准: {" ".join(unknown)}\n{usage}')
+    for name in names:
+        print(name, json.dumps(BENCHMARKS[name](), ensure_ascii=False, indent=4))
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import time
+from tkinter import font
+
+# 手动定义HWND_BROADCAST常量（0xFFFF，解决低版本ctypes未定义的问题）
+HWND_BROADCAST = 0xFFFF
+FONT_CACHE_PATH = os.path.join('cache', 'fonts.json')
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_font_real_family(font_path):
+    # 解析TTF字体真实族名（nameID=1），fontTools只在缓存未命中时导入
+    from fontTools.ttLib import TTFont
+
+    ttfont = TTFont(font_path)
+    family_names = [name.string for name in ttfont['name'].names if name.nameID == 1]
+    for name in family_names:
+        if isinstance(name, bytes):
+            name = name.decode('utf-8', errors='ignore')
+        if name.strip():
+            return name
+    return os.path.splitext(os.path.basename(font_path))[0]  # 备选：用文件名
+
+
+def register_font_to_system(font_path):
+    # 注册字体到系统（只有Windows需要，其他平台直接返回）
+    import ctypes
+    if not hasattr(ctypes, 'windll'):
+        return False
+    font_path_unicode = os.path.abspath(font_path).replace('/', '\\')
+    added = ctypes.windll.gdi32.AddFontResourceW(font_path_unicode)
+    if added == 0:
+        raise ValueError(f"字体注册失败，文件无效: {font_path}")
+
+    # 发送字体更新广播（用手动定义的HWND_BROADCAST）
+    ctypes.windll.user32.SendMessageTimeoutW(
+        HWND_BROADCAST,  # 替换原wintypes.HWND_BROADCAST
+        0x001D,  # WM_FONTCHANGE
+        0, 0,
+        0x0002,  # SMTO_ABORTIFHUNG
+        1000,
+        None
+    )
+    return True
+
+
+class FontRegistry:
+    """每个字体文件只注册、解析一次；族名按文件哈希持久化，Font对象按参数复用"""
+
+    def __init__(self, root, cache_path=FONT_CACHE_PATH, ready_timeout=2.0):
+        self.root = root
+        self.cache_path = cache_path
+        self.ready_timeout = ready_timeout
+        self._families = {}
+        self._fonts = {}
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                self._persisted = json.load(f)
+        except (OSError, ValueError):
+            self._persisted = {}
+
+    def family(self, font_path):
+        path = os.path.abspath(font_path)
+        family = self._families.get(path)
+        if family is not None:
+            return family
+
+        digest = file_hash(path)
+        family = self._persisted.get(digest)
+        if family is None:
+            family = get_font_real_family(path)
+            self._persisted[digest] = family
+            self._save()
+
+        if register_font_to_system(path):
+            self._wait_ready(family)
+        self._families[path] = family
+        return family
+
+    def _wait_ready(self, family):
+        # 代替固定的sleep：系统字体表里出现该族名就立即返回
+        deadline = time.monotonic() + self.ready_timeout
+        while family not in font.families(self.root):
+            if time.monotonic() > deadline:
+                print(f"等待字体就绪超时: {family}")
+                return False
+            time.sleep(0.02)
+        return True
+
+    def _save(self):
+        cache_dir = os.path.dirname(self.cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        with open(self.cache_path, 'w', encoding='utf-8') as f:
+            json.dump(self._persisted, f, ensure_ascii=False, indent=4)
+
+    def get(self, font_path, size=10, weight='normal', slant='roman', underline=0, overstrike=0):
+        family = self.family(font_path)
+        key = (family, size, weight, slant, underline, overstrike)
+        tk_font = self._fonts.get(key)
+        if tk_font is None:
+            tk_font = font.Font(
+                root=self.root,
+                family=family,
+                size=size,
+                weight=weight,
+                slant=slant,
+                underline=underline,
+                overstrike=overstrike
+            )
+            self._fonts[key] = tk_font
+        return tk_font
@@ -0,0 +1,96 @@
+import os
+
+# 目前支持的音频格式
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.m4a')
+
+
+def is_audio(name):
+    return os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS
+
+
+class LibraryScanner:
+    """递归扫描音乐目录，分批产出音频文件；再次扫描时只重读mtime变化的目录"""
+
+    def __init__(self, root, batch_size=256):
+        self.root = root
+        self.batch_size = batch_size
+        # 目录 -> (mtime_ns, 该目录下的音频文件, 子目录)
+        self.dirs = {}
+
+    def _read_dir(self, path):
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file() and is_audio(entry.name):
+                            files.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"读取目录失败: {e}")
+        files.sort()
+        subdirs.sort()
+        return files, subdirs
+
+    def _walk(self, changed):
+        """按深度优先顺序遍历，产出 (目录, 文件列表)；changed收集被重读的目录"""
+        seen = set()
+        stack = [self.root]
+        while stack:
+            path = stack.pop()
+            seen.add(path)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                cached = self.dirs.pop(path, None)
+                if cached is not None:
+                    changed.append((path, cached[1], []))
+                continue
+            cached = self.dirs.get(path)
+            if cached is not None and cached[0] == mtime:
+                files, subdirs = cached[1], cached[2]
+            else:
+                files, subdirs = self._read_dir(path)
+                self.dirs[path] = (mtime, files, subdirs)
+                changed.append((path, cached[1] if cached is not None else [], files))
+            yield path, files
+            stack.extend(reversed(subdirs))
+
+        # 已经不存在的目录
+        for path in [p for p in self.dirs if p not in seen]:
+            changed.append((path, self.dirs.pop(path)[1], []))
+
+    def scan(self):
+        """完整扫描，按批产出文件路径列表，调用方可以边扫边用"""
+        batch = []
+        for path, files in self._walk([]):
+            batch.extend(files)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def rescan(self):
+        """增量扫描，返回 (新增文件, 删除文件)"""
+        changed = []
+        for _ in self._walk(changed):
+            pass
+        added = []
+        removed = []
+        for path, old_files, new_files in changed:
+            old = set(old_files)
+            new = set(new_files)
+            added.extend(f for f in new_files if f not in old)
+            removed.extend(f for f in old_files if f not in new)
+        return added, removed
+
+    def files(self):
+        return [f for _, files in self._walk([]) for f in files]
+
+    def folders(self):
+        return [path for path in self.dirs if path != self.root]
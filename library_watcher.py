@@ -0,0 +1,411 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import stat
+import struct
+import threading
+import time
+from library_scanner import is_audio
+
+# 最后一个事件之后安静多久才提交一批，以及一批最多攒多久（秒）
+DEBOUNCE = 0.5
+MAX_DELAY = 2.0
+# 没有inotify时轮询目录mtime的间隔（秒）
+POLL_INTERVAL = 2.0
+# 没有事件时多久检查一次是否要退出（秒）
+IDLE_TIMEOUT = 0.5
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 1 << 16
+
+
+def is_under(path, directory):
+    return path.startswith(os.path.join(directory, ''))
+
+
+def created_complete(path):
+    """IN_CREATE时文件是否已经完整：硬链接（ln、cp -l，链接数大于1）和符号链接之后不会再有CLOSE_WRITE；
+    新写的文件要等CLOSE_WRITE"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if stat.S_ISLNK(st.st_mode):
+        return os.path.isfile(path)
+    return stat.S_ISREG(st.st_mode) and st.st_nlink > 1
+
+
+def move_prefix(path, old, new):
+    return new + path[len(old):] if path == old or is_under(path, old) else path
+
+
+class LibraryDelta:
+    """一批文件变化（都是绝对路径）。同一路径在一批里的多次变化合并成最终结果，
+    按 目录改名 -> 文件改名 -> 删除 -> 新增 的顺序写进曲库"""
+
+    def __init__(self):
+        self.added = set()
+        self.removed = set()
+        self.renamed = {}
+        self.removed_dirs = set()
+        self.renamed_dirs = []
+        # inotify的MOVED_FROM：等同一cookie的MOVED_TO，到提交时还没等到就算删除
+        self.moves = {}
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.renamed or self.removed_dirs
+                    or self.renamed_dirs or self.moves)
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.renamed) + len(self.removed_dirs) + len(self.renamed_dirs)
+
+    def add(self, path):
+        self.removed.discard(path)
+        self.added.add(path)
+
+    def remove(self, path):
+        self.added.discard(path)
+        for old, new in list(self.renamed.items()):
+            if new == path:
+                # 本批里改名过来的文件又被删了：删的是原来的路径
+                del self.renamed[old]
+                path = old
+        self.removed.add(path)
+
+    def rename(self, old, new):
+        if old in self.added:
+            self.added.discard(old)
+            self.add(new)
+            return
+        for first, target in self.renamed.items():
+            if target == old:
+                old = first
+                break
+        self.removed.discard(new)
+        self.added.discard(new)
+        if old == new:
+            self.renamed.pop(old, None)
+        else:
+            self.renamed[old] = new
+
+    def remove_dir(self, path):
+        self.added = {p for p in self.added if not is_under(p, path)}
+        self.removed_dirs.add(path)
+
+    def rename_dir(self, old, new):
+        # 之前记下的路径都按改名后的位置重写，保证按上面的顺序应用时结果正确
+        self.added = {move_prefix(p, old, new) for p in self.added}
+        self.removed = {move_prefix(p, old, new) for p in self.removed}
+        self.renamed = {move_prefix(a, old, new): move_prefix(b, old, new) for a, b in self.renamed.items()}
+        self.removed_dirs = {move_prefix(p, old, new) for p in self.removed_dirs}
+        self.renamed_dirs.append((old, new))
+
+    def translate(self, path):
+        """变化之前的曲库路径 -> 变化之后的路径（文件没有改名时原样返回）"""
+        for old, new in self.renamed_dirs:
+            path = move_prefix(path, old, new)
+        return self.renamed.get(path, path)
+
+    def apply(self, library):
+        """写进曲库，返回被删除的路径"""
+        for old, new in self.renamed_dirs:
+            library.rename_prefix(old, new)
+        if self.renamed:
+            library.rename_files(self.renamed.items())
+        removed = set(self.removed)
+        for directory in self.removed_dirs:
+            removed.update(library.paths_under(directory))
+        if removed:
+            library.remove_files(removed)
+        if self.added:
+            library.upsert_files(sorted(self.added))
+        return removed
+
+
+def load_inotify():
+    """返回libc（带inotify函数），不支持时返回None"""
+    name = ctypes.util.find_library('c')
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError, TypeError):
+        return None
+    return libc
+
+
+class InotifyWatcher:
+    """Linux inotify：每个目录一个watch，新目录出现时补上watch并把里面已有的文件算作新增"""
+
+    def __init__(self, root, libc):
+        self.root = os.path.abspath(root)
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 失败')
+        # watch描述符 <-> 目录
+        self.dirs = {}
+        self.wds = {}
+        self.overflowed = False
+        try:
+            self.watch_tree(self.root)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            # 超过 fs.inotify.max_user_watches，交给调用方退回轮询
+            if code == errno.ENOSPC:
+                raise OSError(code, 'inotify watch数量达到系统上限')
+            return
+        self.dirs[wd] = path
+        self.wds[path] = wd
+
+    def watch_tree(self, path, delta=None):
+        """给path及其子目录加watch；delta不为空时把找到的音频文件记为新增"""
+        stack = [path]
+        while stack:
+            directory = stack.pop()
+            self._watch(directory)
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif delta is not None and entry.is_file() and is_audio(entry.name):
+                                delta.add(entry.path)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+    def _forget_tree(self, path):
+        for directory in [d for d in self.wds if d == path or is_under(d, path)]:
+            wd = self.wds.pop(directory)
+            self.dirs.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def _move_tree(self, old, new):
+        for directory in [d for d in self.wds if d == old or is_under(d, old)]:
+            wd = self.wds.pop(directory)
+            moved = move_prefix(directory, old, new)
+            self.dirs[wd] = moved
+            self.wds[moved] = wd
+
+    def read(self, timeout, delta):
+        """等最多timeout秒，把读到的事件记进delta，返回是否读到了事件"""
+        ready, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if not ready:
+            return False
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return False
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            self._handle(wd, mask, cookie, name, delta)
+        return True
+
+    def _handle(self, wd, mask, cookie, name, delta):
+        if mask & IN_Q_OVERFLOW:
+            # 事件丢了：由LibraryWatcher做一次增量扫描补上
+            self.overflowed = True
+            return
+        directory = self.dirs.get(wd)
+        if directory is None:
+            return
+        if mask & (IN_IGNORED | IN_DELETE_SELF):
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                if self.wds.get(directory) == wd:
+                    del self.wds[directory]
+            return
+        path = os.path.join(directory, name)
+        isdir = bool(mask & IN_ISDIR)
+        if mask & IN_MOVED_FROM:
+            delta.moves[cookie] = (path, isdir)
+        elif mask & IN_MOVED_TO:
+            source = delta.moves.pop(cookie, None)
+            if source is not None and source[1] == isdir:
+                if isdir:
+                    self._move_tree(source[0], path)
+                    delta.rename_dir(source[0], path)
+                elif is_audio(source[0]) and is_audio(path):
+                    delta.rename(source[0], path)
+                elif is_audio(source[0]):
+                    delta.remove(source[0])
+                elif is_audio(path):
+                    delta.add(path)
+            elif isdir:
+                # 从曲库外移进来的目录
+                self.watch_tree(path, delta)
+            elif is_audio(path):
+                delta.add(path)
+        elif isdir:
+            if mask & IN_CREATE:
+                # 新目录里可能在加watch之前就已经有文件了（批量复制）
+                self.watch_tree(path, delta)
+            elif mask & IN_DELETE:
+                delta.remove_dir(path)
+        elif is_audio(name):
+            if mask & IN_CLOSE_WRITE:
+                delta.add(path)
+            elif mask & IN_CREATE:
+                if created_complete(path):
+                    delta.add(path)
+            elif mask & IN_DELETE:
+                delta.remove(path)
+
+    def settle(self, delta):
+        """提交前调用：没等到MOVED_TO的移动都是移出了曲库"""
+        for path, isdir in delta.moves.values():
+            if isdir:
+                # watch跟着目录的inode走，移出去之后就不再关心
+                self._forget_tree(path)
+                delta.remove_dir(path)
+            elif is_audio(path):
+                delta.remove(path)
+        delta.moves.clear()
+
+    def folders(self):
+        return [path for path in self.wds if path != self.root]
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    """没有inotify时的退路：定时用LibraryScanner做增量扫描（只重读mtime变化的目录）"""
+
+    def __init__(self, scanner, stop, interval=POLL_INTERVAL):
+        self.scanner = scanner
+        self.stop = stop
+        self.interval = interval
+        self.overflowed = False
+        self._next = time.monotonic() + interval
+
+    def read(self, timeout, delta):
+        wait = self._next - time.monotonic()
+        if wait > 0:
+            self.stop.wait(min(wait, max(timeout, 0)))
+            if time.monotonic() < self._next:
+                return False
+        self._next = time.monotonic() + self.interval
+        added, removed = self.scanner.rescan()
+        for path in removed:
+            delta.remove(os.path.abspath(path))
+        for path in added:
+            delta.add(os.path.abspath(path))
+        return bool(added or removed)
+
+    def settle(self, delta):
+        pass
+
+    def folders(self):
+        return [os.path.abspath(path) for path in self.scanner.folders()]
+
+    def close(self):
+        pass
+
+
+class LibraryWatcher:
+    """监视音乐目录，把变化攒成批（安静DEBOUNCE秒或最多攒MAX_DELAY秒）交给on_delta，
+    批量复制几千个文件时也只是每隔几秒一批。优先用inotify，不可用时轮询。"""
+
+    def __init__(self, scanner, on_delta, polling=False):
+        self.scanner = scanner
+        self.on_delta = on_delta
+        self.batches = 0
+        self._stop = threading.Event()
+        self.source = None
+        libc = None if polling else load_inotify()
+        if libc is not None:
+            try:
+                self.source = InotifyWatcher(scanner.root, libc)
+            except OSError as e:
+                print(f"inotify不可用，改为轮询: {e}")
+        if self.source is None:
+            self.source = PollingWatcher(scanner, self._stop)
+        self._thread = threading.Thread(target=self._run, name='library-watch', daemon=True)
+        self._thread.start()
+
+    @property
+    def mode(self):
+        return 'inotify' if isinstance(self.source, InotifyWatcher) else 'polling'
+
+    def _catch_up(self, delta, rewatch=False):
+        # 全量扫描之后、watch加上之前的变化，以及inotify队列溢出时丢掉的事件
+        added, removed = self.scanner.rescan()
+        for path in removed:
+            delta.remove(os.path.abspath(path))
+        for path in added:
+            delta.add(os.path.abspath(path))
+        if rewatch:
+            # 溢出期间新建的目录还没有watch；已有watch的目录重复添加不会出错
+            self.source.watch_tree(self.source.root)
+
+    def _run(self):
+        delta = LibraryDelta()
+        first = last = None
+        if isinstance(self.source, InotifyWatcher):
+            self._catch_up(delta)
+            if delta:
+                first = last = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                if first is None:
+                    timeout = IDLE_TIMEOUT if isinstance(self.source, InotifyWatcher) else POLL_INTERVAL
+                else:
+                    timeout = min(last + DEBOUNCE, first + MAX_DELAY) - now
+                if self.source.read(timeout, delta):
+                    last = time.monotonic()
+                    if first is None:
+                        first = last
+                if self.source.overflowed:
+                    self.source.overflowed = False
+                    self._catch_up(delta, rewatch=True)
+                now = time.monotonic()
+                if first is not None and (now - last >= DEBOUNCE or now - first >= MAX_DELAY):
+                    self.source.settle(delta)
+                    if delta and not self._stop.is_set():
+                        self.batches += 1
+                        self.on_delta(delta)
+                    delta = LibraryDelta()
+                    first = last = None
+        finally:
+            self.source.close()
+
+    def folders(self):
+        return self.source.folders()
+
+    def close(self, timeout=1.0):
+        self._stop.set()
+        self._thread.join(timeout)
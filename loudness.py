@@ -0,0 +1,335 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from audio_duration import probe_duration
+from metadata_cache import file_signature
+from seek_index import build_seek_index, decode_segments
+
+# ReplayGain 2.0 的参考响度（LUFS）
+REFERENCE_LOUDNESS = -18.0
+# 分析时的解码采样率，100ms子块，400ms门限块（4个子块）
+ANALYSIS_RATE = 44100
+SUBBLOCKS_PER_BLOCK = 4
+# 一次做FFT的子块数（约1分钟），限制内存占用
+FFT_BATCH = 600
+HASH_SAMPLE = 1 << 16
+
+
+def content_hash(path):
+    """大小 + 头尾各64KB 的摘要：改名/移动后仍能命中，不必读完整个文件"""
+    h = hashlib.blake2b(digest_size=16)
+    size = os.path.getsize(path)
+    h.update(str(size).encode())
+    with open(path, 'rb') as f:
+        h.update(f.read(HASH_SAMPLE))
+        if size > HASH_SAMPLE * 2:
+            f.seek(-HASH_SAMPLE, os.SEEK_END)
+        h.update(f.read(HASH_SAMPLE))
+    return h.hexdigest()
+
+
+def parse_gain(value):
+    # "-6.54 dB" / b"+1.20 dB"
+    if isinstance(value, bytes):
+        value = value.decode('latin-1')
+    return float(str(value).split()[0])
+
+
+def read_replaygain(file_path):
+    """返回标签里的 (增益dB, 峰值)，没有ReplayGain标签时返回None"""
+    file_path = Path(file_path)
+    ext = file_path.suffix.lower()
+    try:
+        if ext == '.mp3':
+            from mutagen.id3 import ID3
+            values = {frame.desc.lower(): frame.text[0] for frame in ID3(file_path).getall('TXXX')}
+        elif ext == '.flac':
+            from mutagen.flac import FLAC
+            values = {key.lower(): value for key, value in (FLAC(file_path).tags or [])}
+        elif ext == '.m4a':
+            from mutagen.mp4 import MP4
+            prefix = '----:com.apple.itunes:'
+            values = {key.lower()[len(prefix):]: value[0] for key, value in (MP4(file_path).tags or {}).items()
+                      if key.lower().startswith(prefix)}
+        else:
+            return None
+        if 'replaygain_track_gain' not in values:
+            return None
+        peak = values.get('replaygain_track_peak')
+        return parse_gain(values['replaygain_track_gain']), parse_gain(peak) if peak is not None else None
+    except Exception:
+        return None
+
+
+def biquad_power(b, a, z):
+    # |H|^2，z 为 e^{-jω}
+    return abs((b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)) ** 2
+
+
+def k_weighting(rate, n):
+    """BS.1770 K计权（高架 + 高通）在长度n的rfft各频点上的功率响应"""
+    import numpy as np
+    z = np.exp(-2j * np.pi * np.fft.rfftfreq(n, 1 / rate) / rate)
+
+    # 由模拟原型按采样率做双线性变换，48kHz时与标准给出的系数一致
+    # 高架滤波器：+4dB，约1.68kHz
+    fc, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = np.tan(np.pi * fc / rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    shelf_b = (vh + vb * k / q + k * k, 2 * (k * k - vh), vh - vb * k / q + k * k)
+    shelf_a = (1 + k / q + k * k, 2 * (k * k - 1), 1 - k / q + k * k)
+
+    # 高通滤波器：约38Hz，分子按标准保持 1,-2,1
+    fc, q = 38.13547087602444, 0.5003270373238773
+    k = np.tan(np.pi * fc / rate)
+    a0 = 1 + k / q + k * k
+    high_b = (1.0, -2.0, 1.0)
+    high_a = (1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0)
+
+    return biquad_power(shelf_b, shelf_a, z) * biquad_power(high_b, high_a, z)
+
+
+class LoudnessMeter:
+    """逐段喂入采样，最后得出整体响度：每个100ms子块只留一个能量值（一小时约3.6万个），
+    不满一个子块的尾巴留到下一段，分段和整首一次测量的结果相同。
+    K计权在频域按子块近似，不需要scipy。"""
+
+    def __init__(self, rate):
+        import numpy as np
+        self.rate = rate
+        self.n = rate // 10
+        # Parseval：rfft 中间频点计两次
+        weights = k_weighting(rate, self.n) * 2
+        weights[0] /= 2
+        if self.n % 2 == 0:
+            weights[-1] /= 2
+        weights /= float(self.n) * self.n * 32768 * 32768
+        self.weights = weights
+        self.energies = []
+        self.peak = 0.0
+        self._rest = None
+
+    def feed(self, samples):
+        """samples 为 int16 的 (采样数, 声道数) 数组"""
+        import numpy as np
+        if samples.ndim == 1:
+            samples = samples[:, None]
+        if len(samples):
+            self.peak = max(self.peak, float(np.abs(samples).max()) / 32768)
+        if self._rest is not None:
+            samples = np.concatenate((self._rest, samples))
+        n = self.n
+        count = len(samples) // n
+        for start in range(0, count, FFT_BATCH):
+            stop = min(start + FFT_BATCH, count)
+            chunk = samples[start * n:stop * n].reshape(stop - start, n, -1).astype(np.float32)
+            spectrum = np.fft.rfft(chunk, axis=1)
+            # 各声道（L/R权重都是1）的计权均方之和
+            self.energies.append((np.abs(spectrum) ** 2 * self.weights[None, :, None]).sum(axis=(1, 2)))
+        self._rest = samples[count * n:].copy()
+
+    def result(self):
+        """返回 (响度LUFS, 采样峰值)；太短或全是静音时响度为None"""
+        import numpy as np
+        energy = np.concatenate(self.energies) if self.energies else np.zeros(0)
+        return gated_loudness(energy), self.peak
+
+
+def measure_loudness(samples, rate):
+    """整体响度（LUFS，带 -70 绝对门限和 -10 相对门限）和采样峰值。
+    samples 为 int16 的 (采样数, 声道数) 数组，一次测完整首"""
+    meter = LoudnessMeter(rate)
+    meter.feed(samples)
+    return meter.result()
+
+
+def gated_loudness(energy):
+    """由各100ms子块的计权能量算门限后的响度"""
+    import numpy as np
+    if len(energy) < SUBBLOCKS_PER_BLOCK:
+        return None
+    # 400ms门限块，75%重叠
+    kernel = np.ones(SUBBLOCKS_PER_BLOCK) / SUBBLOCKS_PER_BLOCK
+    blocks = np.convolve(energy, kernel, mode='valid')
+    with np.errstate(divide='ignore'):
+        levels = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[levels > -70]
+    if not len(gated):
+        return None
+    relative = -0.691 + 10 * np.log10(gated.mean()) - 10
+    gated = blocks[(levels > -70) & (levels > relative)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def init_worker():
+    # 分析进程：不占用声卡，优先级低于播放
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    if hasattr(os, 'nice'):
+        os.nice(10)
+    else:
+        import ctypes
+        if hasattr(ctypes, 'windll'):
+            BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), BELOW_NORMAL_PRIORITY_CLASS)
+    os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+    import pygame
+    pygame.mixer.init(frequency=ANALYSIS_RATE, size=-16, channels=2)
+
+
+def analyze_file(path):
+    """在分析进程里运行，返回 (响度, 峰值)。有寻址表的格式（MP3/FLAC）按段解码，
+    峰值内存与曲目长度无关；其余格式只能整首解码"""
+    import pygame
+    meter = LoudnessMeter(pygame.mixer.get_init()[0])
+    index = build_seek_index(path)
+    duration = probe_duration(path) if index is not None else None
+    if duration:
+        for _, pcm in decode_segments(path, index, duration):
+            meter.feed(pcm)
+    else:
+        sound = pygame.mixer.Sound(path)
+        meter.feed(pygame.sndarray.samples(sound))
+    return meter.result()
+
+
+def gain_to_volume(gain):
+    # set_volume 不能超过1.0：偏响的曲目压低，偏轻的只能按原音量播放
+    return min(1.0, 10 ** (gain / 20))
+
+
+class LoudnessAnalyzer:
+    """响度均衡：优先用ReplayGain标签，没有时交给进程池在后台分析；结果按文件摘要存进曲库。
+    volume() 从不等待分析，结果未出来时返回1.0。"""
+
+    def __init__(self, library, workers=None, maxsize=1024):
+        self.library = library
+        # 默认每个核一个分析进程，留一个核给播放和界面；按段解码，每个进程的内存与曲目长度无关。
+        # 需要限制总内存时传workers
+        self.workers = workers or max((os.cpu_count() or 1) - 1, 1)
+        self.maxsize = maxsize
+        self.analyzed = 0
+        self.from_tags = 0
+        self._executor = None
+        self._volumes = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(self.workers * 2)
+        self._closed = False
+
+    def pool(self):
+        # 第一次需要分析时才启动进程；用spawn，不继承界面和混音器的状态。波形摘要也用这个进程池
+        if self._executor is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+            )
+        return self._executor
+
+    def _remember(self, key, volume):
+        with self._lock:
+            self._volumes[key] = volume
+            self._volumes.move_to_end(key)
+            while len(self._volumes) > self.maxsize:
+                self._volumes.popitem(last=False)
+
+    def _known(self, path):
+        """返回 (key, 摘要, 音量)；音量为None表示需要分析"""
+        sig = file_signature(path)
+        if sig is None:
+            return None, None, 1.0
+        key = (path, sig)
+        with self._lock:
+            volume = self._volumes.get(key)
+        if volume is not None:
+            return key, None, volume
+
+        digest = content_hash(path)
+        row = self.library.lookup_loudness(digest)
+        if row is not None:
+            volume = gain_to_volume(row[2])
+        else:
+            tags = read_replaygain(path)
+            if tags is None:
+                return key, digest, None
+            gain, peak = tags
+            self.library.save_loudness(digest, None, peak, gain, 'tag')
+            self.from_tags += 1
+            volume = gain_to_volume(gain)
+        self._remember(key, volume)
+        return key, digest, volume
+
+    def volume(self, file_path):
+        """播放前调用：已知时返回对应音量，否则安排后台分析并返回1.0"""
+        path = os.path.abspath(file_path)
+        key, digest, volume = self._known(path)
+        if volume is not None:
+            return volume
+        self._submit(path, key, digest)
+        return 1.0
+
+    def _submit(self, path, key, digest, slot=False):
+        with self._lock:
+            if self._closed or digest in self._pending:
+                if slot:
+                    self._slots.release()
+                return self._pending.get(digest)
+            future = self.pool().submit(analyze_file, path)
+            self._pending[digest] = future
+        future.add_done_callback(lambda f: self._finished(key, digest, f, slot))
+        return future
+
+    def _finished(self, key, digest, future, slot):
+        try:
+            loudness, peak = future.result()
+        except Exception as e:
+            if not future.cancelled() and not self._closed:
+                print(f"响度分析失败: {e}")
+            loudness, peak = None, None
+        try:
+            if loudness is None:
+                # 无法测量（解码失败或全是静音）：本次运行内不再重试
+                self._remember(key, 1.0)
+            else:
+                gain = REFERENCE_LOUDNESS - loudness
+                with self._lock:
+                    closed = self._closed
+                if not closed:
+                    self.library.save_loudness(digest, loudness, peak, gain, 'analysis')
+                self._remember(key, gain_to_volume(gain))
+                self.analyzed += 1
+        finally:
+            with self._lock:
+                self._pending.pop(digest, None)
+            if slot:
+                self._slots.release()
+
+    def analyze(self, paths):
+        """后台线程调用：分析还没有结果的曲目，同时在途的任务数有上限"""
+        futures = []
+        for path in paths:
+            if self._closed:
+                break
+            path = os.path.abspath(path)
+            key, digest, volume = self._known(path)
+            if volume is not None:
+                continue
+            self._slots.acquire()
+            future = self._submit(path, key, digest, slot=True)
+            if future is None:
+                return futures
+            futures.append(future)
+        return futures
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            executor = self._executor
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
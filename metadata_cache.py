@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from audio_duration import probe_duration
+from metrics import METRICS
+
+UNKNOWN_ARTIST = '未知艺术家'
+UNKNOWN_ALBUM = '未知专辑'
+
+
+def default_metadata(file_path):
+    return {
+        'artist': UNKNOWN_ARTIST,
+        'title': Path(file_path).stem,
+        'album': UNKNOWN_ALBUM
+    }
+
+
+# 用mutagen解析标签（开销大，只在缓存未命中时调用；各格式的模块第一次遇到时才导入）
+def read_tags(file_path):
+    file_path = Path(file_path)
+    ext = file_path.suffix.lower()
+
+    try:
+        if ext == '.mp3':
+            from mutagen.easyid3 import EasyID3
+            audio = EasyID3(file_path)
+            return {
+                'artist': audio.get('artist', [UNKNOWN_ARTIST])[0],
+                'title': audio.get('title', [file_path.stem])[0],
+                'album': audio.get('album', [UNKNOWN_ALBUM])[0]
+            }
+        elif ext == '.flac':
+            from mutagen.flac import FLAC
+            audio = FLAC(file_path)
+            return {
+                'artist': audio.get('artist', [UNKNOWN_ARTIST])[0],
+                'title': audio.get('title', [file_path.stem])[0],
+                'album': audio.get('album', [UNKNOWN_ALBUM])[0]
+            }
+        elif ext == '.m4a':
+            from mutagen.mp4 import MP4
+            audio = MP4(file_path)
+            return {
+                'artist': audio.get('\xa9ART', [UNKNOWN_ARTIST])[0],
+                'title': audio.get('\xa9nam', [file_path.stem])[0],
+                'album': audio.get('\xa9alb', [UNKNOWN_ALBUM])[0]
+            }
+        else:
+            return default_metadata(file_path)
+    except Exception as e:
+        print(f"读取元数据失败: {e}")
+        return default_metadata(file_path)
+
+
+def file_signature(file_path):
+    """返回 (mtime_ns, size)，文件不存在时返回None"""
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class MetadataCache:
+    """元数据缓存：内存LRU + 曲库(TrackLibrary)，按 路径+mtime+大小 判断是否失效"""
+
+    def __init__(self, library, maxsize=1024, revalidate_interval=2.0):
+        self.library = library
+        self.maxsize = maxsize
+        # 同一条目在这段时间内不重复stat，网络盘上stat本身也不便宜
+        self.revalidate_interval = revalidate_interval
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, path):
+        """返回LRU中的条目（必要时从磁盘或标签重建），调用方不持锁"""
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._lru.get(path)
+            if entry is not None and now - entry['checked'] < self.revalidate_interval:
+                self._lru.move_to_end(path)
+                self.hits += 1
+                return entry
+
+        sig = file_signature(path)
+
+        with self._lock:
+            if entry is not None and entry['sig'] == sig:
+                entry['checked'] = now
+                self._lru.move_to_end(path)
+                self.hits += 1
+                return entry
+
+            entry = None
+            if sig is not None:
+                row = self.library.lookup(path)
+                if row is not None and (row[0], row[1]) == sig and row[2] is not None:
+                    entry = {
+                        'sig': sig,
+                        'checked': now,
+                        'data': {'title': row[2], 'artist': row[3], 'album': row[4]},
+                        'duration': row[5],
+                    }
+                    self.disk_hits += 1
+
+        if entry is None:
+            started = METRICS.clock()
+            data = read_tags(path)
+            METRICS.record('metadata.read_tags', started)
+            entry = {'sig': sig, 'checked': now, 'data': data, 'duration': None}
+            with self._lock:
+                self.misses += 1
+                if sig is not None:
+                    self.library.save_tags(path, sig, data)
+
+        with self._lock:
+            self._lru[path] = entry
+            self._lru.move_to_end(path)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+        return entry
+
+    def get(self, file_path):
+        started = METRICS.clock()
+        data = dict(self._entry(os.path.abspath(file_path))['data'])
+        METRICS.record('metadata.lookup', started)
+        return data
+
+    def get_duration(self, file_path, decoder=None):
+        """时长（秒）：先读缓存，再读容器头部，都失败时才交给decoder解码"""
+        path = os.path.abspath(file_path)
+        entry = self._entry(path)
+        if entry['duration'] is not None:
+            return entry['duration']
+
+        duration = probe_duration(path)
+        if duration is None and decoder is not None:
+            duration = decoder(path)
+        if duration is None:
+            return 0.0
+
+        with self._lock:
+            entry['duration'] = duration
+            if entry['sig'] is not None:
+                self.library.save_duration(path, entry['sig'], duration)
+        return duration
+
+    def invalidate(self, file_path):
+        path = os.path.abspath(file_path)
+        with self._lock:
+            self._lru.pop(path, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'size': len(self._lru),
+            }
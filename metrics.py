@@ -0,0 +1,336 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+METRICS_PATH = os.path.join('cache', 'metrics.json')
+# 定期写出统计的间隔（秒）
+DUMP_INTERVAL = 10.0
+# 直方图每个2倍区间分成多少格：相对误差不超过 1/HALF（约1.6%）
+SUB_BITS = 7
+HALF = 1 << (SUB_BITS - 1)
+# 直方图以微秒计，最大记录约 2^36 微秒（19小时），更大的值记到最后一格
+MAX_BITS = 36
+PERCENTILES = (50, 90, 99, 99.9)
+# 两次采样之间线程的CPU时间不到间隔的这个比例，就是在等待（select/sleep/read等C函数里阻塞时
+# 调用栈停在调用它的Python函数上，光看函数名分不出来），不记这次采样
+IDLE_CPU = 0.05
+# 取不到线程CPU时间的平台上，线程在这些函数里算在等待，汇总时不算热点
+IDLE_FRAMES = frozenset((
+    'threading.py:wait', 'threading.py:_wait_for_tstate_lock', 'queue.py:get',
+    'selectors.py:select', 'connection.py:wait', '__init__.py:mainloop',
+))
+
+
+def thread_cpu_time(ident):
+    """线程已用的CPU时间（秒），平台不支持时返回None"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+
+def bucket_index(value):
+    """对数-线性分桶（HDR Histogram的做法）：小于 2^SUB_BITS 的值精确记录，
+    之后每个2倍区间等分成 HALF 格"""
+    shift = value.bit_length() - SUB_BITS
+    if shift <= 0:
+        return value
+    return shift * HALF + (value >> shift)
+
+
+def bucket_value(index):
+    """桶的下界"""
+    if index < HALF * 2:
+        return index
+    shift = index // HALF - 1
+    return (index - shift * HALF) << shift
+
+
+def bucket_width(index):
+    if index < HALF * 2:
+        return 1
+    return 1 << (index // HALF - 1)
+
+
+class Histogram:
+    """延迟直方图（微秒）：格数固定，记录一次只是一次加法，百分位由格子反推"""
+
+    def __init__(self):
+        self.counts = [0] * (bucket_index((1 << MAX_BITS) - 1) + 1)
+        self.last = len(self.counts) - 1
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self._lock = threading.Lock()
+
+    def record(self, micros):
+        micros = int(micros) if micros > 0 else 0
+        # 即 bucket_index，展开以省一次函数调用
+        shift = micros.bit_length() - SUB_BITS
+        index = micros if shift <= 0 else min(shift * HALF + (micros >> shift), self.last)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += micros
+            if self.min is None or micros < self.min:
+                self.min = micros
+            if micros > self.max:
+                self.max = micros
+
+    def percentile(self, q):
+        """第q百分位（微秒），取所在格的中点，不超出实际的最小/最大值"""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = max(q / 100 * self.count, 1)
+            seen = 0
+            for index, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank:
+                    middle = bucket_value(index) + (bucket_width(index) - 1) / 2
+                    return min(max(middle, self.min), self.max)
+            return float(self.max)
+
+    def summary(self):
+        """毫秒为单位的摘要"""
+        if not self.count:
+            return {'count': 0}
+        result = {
+            'count': self.count,
+            'min_ms': round(self.min / 1000, 3),
+            'mean_ms': round(self.total / self.count / 1000, 3),
+            'max_ms': round(self.max / 1000, 3),
+        }
+        for q in PERCENTILES:
+            result[f'p{q:g}_ms'] = round(self.percentile(q) / 1000, 3)
+        return result
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * len(self.counts)
+            self.count = 0
+            self.total = 0
+            self.min = None
+            self.max = 0
+
+
+class Metrics:
+    """计数器、直方图和瞬时值。关闭时 clock() 返回None，record() 看到None立即返回，
+    热路径上只多一次属性判断和两次函数调用。
+
+        started = METRICS.clock()
+        ...
+        METRICS.record('ui.tick', started)
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.time()
+        self.counters = Counter()
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._dumper = None
+        self.profiler = None
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clock(self):
+        return time.perf_counter() if self.enabled else None
+
+    def record(self, name, started):
+        """记录从started（clock()的返回值）到现在的耗时"""
+        if started is None:
+            return
+        self.observe(name, time.perf_counter() - started)
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        histogram.record(seconds * 1e6)
+
+    def incr(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += n
+
+    def gauge(self, name, value):
+        if self.enabled:
+            self.gauges[name] = value
+
+    def snapshot(self):
+        with self._lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+        result = {
+            'enabled': self.enabled,
+            'uptime_s': round(time.time() - self.started, 1),
+            'counters': counters,
+            'gauges': dict(self.gauges),
+            'histograms': {name: histograms[name].summary() for name in sorted(histograms)},
+        }
+        if self.profiler is not None:
+            result['profile'] = self.profiler.top()
+        return result
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            for histogram in self.histograms.values():
+                histogram.reset()
+
+    def dump(self, path=METRICS_PATH):
+        """写成JSON文件；先写临时文件再替换，读的一方不会看到写了一半的内容"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, path)
+
+    def start_dumping(self, path=METRICS_PATH, interval=DUMP_INTERVAL):
+        """打开统计并每隔interval秒写一次文件，stop_dumping() 时再写最后一次"""
+        self.enable()
+        if self._dumper is None:
+            self._dumper = Dumper(self, path, interval)
+        return self._dumper
+
+    def stop_dumping(self):
+        if self._dumper is not None:
+            self._dumper.close()
+            self._dumper = None
+
+    def start_profiler(self, interval=None):
+        if self.profiler is None:
+            self.profiler = SamplingProfiler(interval) if interval else SamplingProfiler()
+            self.profiler.start()
+        return self.profiler
+
+    def stop_profiler(self):
+        """停止采样，返回采样最多的函数"""
+        profiler, self.profiler = self.profiler, None
+        if profiler is None:
+            return []
+        profiler.stop()
+        return profiler.top()
+
+
+class Dumper:
+    def __init__(self, metrics, path, interval):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-dump', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._dump()
+        self._dump()
+
+    def _dump(self):
+        try:
+            self.metrics.dump(self.path)
+        except OSError as e:
+            print(f"写出统计失败: {e}")
+
+    def close(self, timeout=1.0):
+        self._stop.set()
+        self._thread.join(timeout)
+
+
+class SamplingProfiler:
+    """采样分析器：后台线程定时用 sys._current_frames() 取所有线程的调用栈，
+    按 线程;外层函数;...;内层函数 计数（火焰图的折叠格式），被采样的线程不受影响。
+    两次采样之间几乎没用CPU的线程（阻塞在等待里）不计数"""
+
+    def __init__(self, interval=0.005, depth=32):
+        self.interval = interval
+        self.depth = depth
+        self.samples = 0
+        # 因为线程在等待而跳过的次数
+        self.idle = 0
+        self.stacks = Counter()
+        # 线程 -> 上次采样时的CPU时间
+        self._cpu = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _waiting(self, ident, elapsed):
+        cpu = thread_cpu_time(ident)
+        last = self._cpu.get(ident)
+        self._cpu[ident] = cpu
+        if cpu is None:
+            return False
+        # 第一次见到的线程先记下CPU时间，下一次再判断
+        return last is None or cpu - last < elapsed * IDLE_CPU
+
+    def _run(self):
+        me = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                # 只查threading里登记过的（还活着的）线程的CPU时间
+                if ident in names and self._waiting(ident, elapsed):
+                    self.idle += 1
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.depth:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+            for ident in self._cpu.keys() - names.keys():
+                del self._cpu[ident]
+
+    def top(self, n=20):
+        """按最内层函数汇总：[(线程;函数, 占采样的百分比)]，在等待的样本不计"""
+        leaves = Counter()
+        for stack, count in list(self.stacks.items()):
+            parts = stack.split(';')
+            if parts[-1] not in IDLE_FRAMES:
+                leaves[f'{parts[0]};{parts[-1]}'] += count
+        total = max(self.samples, 1)
+        return [(name, round(count * 100 / total, 1)) for name, count in leaves.most_common(n)]
+
+    def write_collapsed(self, path):
+        """写成折叠栈格式，可直接交给 flamegraph.pl / speedscope"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f'{stack} {count}\n')
+
+
+# 整个进程共用一份；默认关闭
+METRICS = Metrics()
@@ -0,0 +1,206 @@
+import random
+import threading
+from collections import deque
+
+SEQUENTIAL = 0
+CYCLE = 1
+RANDOM = 2
+
+MASK64 = (1 << 64) - 1
+FEISTEL_ROUNDS = 4
+
+
+def mix64(x):
+    # splitmix64 的最后混合步骤
+    x = (x ^ (x >> 30)) * 0xbf58476d1ce4e5b9 & MASK64
+    x = (x ^ (x >> 27)) * 0x94d049bb133111eb & MASK64
+    return x ^ (x >> 31)
+
+
+class ShuffleOrder:
+    """惰性随机排列：用Feistel网络把位置映射到曲目序号，不需要预先打乱整个列表。
+    每轮放完换一组密钥，历史记录和前进记录都有上限，内存与曲库大小无关。"""
+
+    def __init__(self, size=0, seed=None, history=256):
+        self.seed = random.getrandbits(64) if seed is None else seed
+        self.history = deque(maxlen=history)
+        # 回退后再前进时按原路返回
+        self.forward = deque(maxlen=history)
+        self.size = -1
+        self.epoch = 0
+        self.position = -1
+        self.current = None
+        self._keys = {}
+        self.resize(size)
+
+    def resize(self, size):
+        """曲库大小变化时重新开始一轮排列（历史记录保留）"""
+        if size == self.size:
+            return
+        self.size = size
+        self.epoch += 1
+        self.position = -1
+        self.forward.clear()
+        bits = max(2, (size - 1).bit_length())
+        self._half = (bits + 1) // 2
+        self._mask = (1 << self._half) - 1
+        self._keys.clear()
+
+    def _round_keys(self, epoch):
+        keys = self._keys.get(epoch)
+        if keys is None:
+            if len(self._keys) > 4:
+                self._keys.clear()
+            base = mix64(self.seed ^ (epoch * 0x9e3779b97f4a7c15 & MASK64))
+            keys = [mix64(base + r) for r in range(FEISTEL_ROUNDS)]
+            self._keys[epoch] = keys
+        return keys
+
+    def permute(self, position, epoch=None):
+        """把 [0, size) 上的位置一一映射成曲目序号（循环游走直到落回范围内）"""
+        keys = self._round_keys(self.epoch if epoch is None else epoch)
+        half = self._half
+        mask = self._mask
+        x = position
+        while True:
+            left = x >> half
+            right = x & mask
+            for key in keys:
+                left, right = right, left ^ (mix64(right ^ key) & mask)
+            x = (left << half) | right
+            if x < self.size:
+                return x
+
+    def _following(self):
+        position = self.position + 1
+        epoch = self.epoch
+        if position >= self.size:
+            position = 0
+            epoch += 1
+        return epoch, position
+
+    def peek_next(self):
+        if self.size <= 0:
+            return None
+        if self.forward:
+            return self.forward[-1]
+        epoch, position = self._following()
+        return self.permute(position, epoch)
+
+    def peek_previous(self):
+        return self.history[-1] if self.history else None
+
+    def advance(self, current):
+        if self.size <= 0:
+            return None
+        if current is not None:
+            self.history.append(current)
+        if self.forward:
+            self.current = self.forward.pop()
+        else:
+            self.epoch, self.position = self._following()
+            self.current = self.permute(self.position)
+        return self.current
+
+    def back(self, current):
+        if not self.history:
+            return None
+        if current is not None:
+            self.forward.append(current)
+        self.current = self.history.pop()
+        return self.current
+
+    def jump(self, current, index):
+        """用户直接点了某一首：记入历史，之后继续原来的随机顺序"""
+        if current is not None:
+            self.history.append(current)
+        self.forward.clear()
+        self.current = index
+
+    def held(self):
+        return [*self.history, *self.forward, self.current]
+
+    def remap(self, mapping):
+        """曲库增删后按 mapping(旧序号) -> 新序号 改写记录，返回None的（已删除的曲目）丢掉"""
+        self.history = deque((i for i in map(mapping, self.history) if i is not None), maxlen=self.history.maxlen)
+        self.forward = deque((i for i in map(mapping, self.forward) if i is not None), maxlen=self.forward.maxlen)
+        if self.current is not None:
+            self.current = mapping(self.current)
+
+
+class PlayOrder:
+    """播放顺序：0 顺序播放，1 单曲循环，2 随机播放"""
+
+    def __init__(self, files, mode=SEQUENTIAL, seed=None, history=256):
+        self.files = files
+        self.mode = mode
+        self.shuffle = ShuffleOrder(seed=seed, history=history)
+        # 播放线程推进，界面线程读取邻居
+        self._lock = threading.Lock()
+
+    def _shuffle(self):
+        self.shuffle.resize(len(self.files))
+        return self.shuffle
+
+    def peek_next(self, index):
+        """预取用：返回下一首的序号，不改变状态"""
+        count = len(self.files)
+        if self.mode == RANDOM:
+            with self._lock:
+                following = self._shuffle().peek_next()
+            if following is not None:
+                return following
+        elif self.mode == CYCLE:
+            return index
+        if index < count - 1:
+            return index + 1
+        return 0
+
+    def advance(self, index):
+        """真正切到下一首时调用"""
+        if self.mode == RANDOM:
+            with self._lock:
+                following = self._shuffle().advance(index)
+            if following is not None:
+                return following
+        return self.peek_next(index)
+
+    def back(self, index):
+        count = len(self.files)
+        if self.mode == RANDOM:
+            with self._lock:
+                previous = self._shuffle().back(index)
+            if previous is not None and previous < count:
+                return previous
+        if index > 0:
+            return index - 1
+        return count - 1
+
+    def jump(self, index, target):
+        if self.mode == RANDOM:
+            with self._lock:
+                self._shuffle().jump(index, target)
+
+    def held(self):
+        """随机播放记录里的所有序号（含None）"""
+        with self._lock:
+            return self.shuffle.held()
+
+    def remap(self, mapping):
+        with self._lock:
+            self.shuffle.remap(mapping)
+
+    def neighbours(self, index):
+        """列表里显示的上一首/下一首"""
+        count = len(self.files)
+        if self.mode == RANDOM:
+            with self._lock:
+                shuffle = self._shuffle()
+                previous = shuffle.peek_previous()
+                following = shuffle.peek_next()
+            if previous is None or previous >= count:
+                previous = (index - 1) % count
+            if following is None or following >= count:
+                following = (index + 1) % count
+            return previous, following
+        return (index - 1) % count, (index + 1) % count
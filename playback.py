@@ -0,0 +1,395 @@
+import queue
+import threading
+import time
+import pygame
+from metrics import METRICS
+from seek_index import SeekIndexCache
+
+# 曲目结束（或队列中的下一首开始）时pygame投递的事件
+END_EVENT = pygame.USEREVENT + 1
+# 快到曲目结尾时检查结束事件的间隔（秒）：混音器切到队列里的下一首时沿用上一首的音量，要尽快换掉
+TRANSITION_POLL = 0.005
+# 过了按时长估计的结尾这么久还没切歌（时长不准），恢复平时的间隔
+TRANSITION_GRACE = 1.0
+
+
+class PlaybackEngine:
+    """播放引擎：当前曲目播放时就把下一首放进pygame的队列，切歌由混音器完成，不依赖界面刷新"""
+
+    def __init__(self, files, order, on_track_change=None, seek_indexes=None, volume=None):
+        # 事件队列依赖video子系统，只初始化不建窗口
+        if not pygame.display.get_init():
+            pygame.display.init()
+        pygame.mixer.music.set_endevent(END_EVENT)
+        self.files = files
+        # 播放顺序（PlayOrder）：peek_next预取，advance/back/jump真正移动
+        self.order = order
+        self.on_track_change = on_track_change
+        # volume(路径) -> 0~1 的响度均衡音量，不能阻塞（见LoudnessAnalyzer）
+        self.volume = volume
+        self.current = None
+        self.queued = None
+        # get_pos()从play()开始计时，seek之后用offset修正
+        self.offset = 0.0
+        self.paused = False
+        self.seek_indexes = seek_indexes if seek_indexes is not None else SeekIndexCache()
+        # 从寻址表落点重新加载时，解码器还在读的文件对象
+        self._stream = None
+        # 由队列无缝衔接的次数 / 队列缺失只能重新加载的次数
+        self.gapless = 0
+        self.reloads = 0
+
+    def play(self, index, file_path=None):
+        if file_path is None:
+            file_path = self.files[index]
+        pygame.mixer.music.load(file_path)
+        # 开始播放之前设好，第一帧就是这首的音量
+        if self.volume is not None:
+            pygame.mixer.music.set_volume(self.volume(file_path))
+        pygame.mixer.music.play()
+        # load/stop本身也会投递结束事件，丢掉这些旧事件
+        pygame.event.clear(END_EVENT, pump=False)
+        self._close_stream()
+        self.current = index
+        self.queued = None
+        self.offset = 0.0
+        self.paused = False
+        self.requeue()
+
+    def _close_stream(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def requeue(self):
+        """按当前播放模式重新决定下一首并放进队列（会替换已排队的曲目）"""
+        if self.current is None or not self.files:
+            return
+        index = self.order.peek_next(self.current)
+        try:
+            pygame.mixer.music.queue(self.files[index])
+        except pygame.error as e:
+            print(f"预加载下一首失败: {e}")
+            self.queued = None
+            return
+        self.queued = index
+        if self.volume is not None:
+            # 提前取一次：还没有结果时现在就安排分析，切歌时多半已经有了
+            self.volume(self.files[index])
+
+    def stop(self):
+        pygame.mixer.music.stop()
+        pygame.event.clear(END_EVENT, pump=False)
+        self._close_stream()
+        self.current = None
+        self.queued = None
+
+    def pause(self):
+        pygame.mixer.music.pause()
+        self.paused = True
+
+    def resume(self):
+        pygame.mixer.music.unpause()
+        self.paused = False
+
+    def poll(self):
+        """处理结束事件；返回是否切到了新曲目"""
+        events = pygame.event.get(END_EVENT, pump=False)
+        if not events or self.current is None:
+            return False
+        started = METRICS.clock()
+        if self.queued is not None and pygame.mixer.music.get_busy():
+            # 队列里的曲目已经开始播放，先换成它的音量（按这一刻的结果取，排队时分析可能还没完成），
+            # 再更新状态并排下一首
+            if self.volume is not None:
+                pygame.mixer.music.set_volume(self.volume(self.files[self.queued]))
+            self.order.advance(self.current)
+            self.current = self.queued
+            self.queued = None
+            self.offset = 0.0
+            self._close_stream()
+            self.gapless += 1
+            METRICS.incr('playback.gapless')
+            self.requeue()
+        else:
+            # 队列里没有下一首（预加载失败或被清掉），曲间会有停顿
+            self.reloads += 1
+            METRICS.incr('playback.reload')
+            self._play_following(self.current)
+        METRICS.record('playback.transition', started)
+        if self.on_track_change is not None:
+            self.on_track_change(self.current)
+        return True
+
+    def _play_following(self, index):
+        """从index的下一首开始播放，跳过无法加载的曲目（损坏或已被删除），最多把整个列表试一遍"""
+        for _ in range(len(self.files)):
+            index = self.order.advance(index)
+            try:
+                self.play(index)
+                return
+            except pygame.error as e:
+                print(f"加载失败，跳过: {self.files[index]}: {e}")
+        self.stop()
+        raise pygame.error('没有可以播放的曲目')
+
+    def seek(self, seconds):
+        """跳到第seconds秒：有寻址表时直接从对应帧开始加载，否则交给解码器set_pos"""
+        if self.current is None:
+            return
+        seconds = max(seconds, 0.0)
+        target = self.seek_indexes.open_at(self.files[self.current], seconds)
+        if target is None:
+            pygame.mixer.music.set_pos(seconds)
+            self.offset = seconds - pygame.mixer.music.get_pos() / 1000
+            return
+        stream, namehint, actual = target
+        try:
+            pygame.mixer.music.load(stream, namehint)
+            pygame.mixer.music.play()
+        except pygame.error:
+            stream.close()
+            raise
+        pygame.event.clear(END_EVENT, pump=False)
+        self._close_stream()
+        self._stream = stream
+        self.offset = actual
+        if self.paused:
+            pygame.mixer.music.pause()
+        # 重新加载会清掉队列
+        self.queued = None
+        self.requeue()
+
+    def position(self):
+        """当前曲目已播放的秒数"""
+        return self.offset + pygame.mixer.music.get_pos() / 1000
+
+
+class PlaybackWorker:
+    """唯一的播放线程：界面只往命令队列里放命令，加载、切歌都在这里串行执行"""
+
+    def __init__(self, engine, describe=None, poll_interval=0.05):
+        self.engine = engine
+        # describe(路径) -> (元数据, 时长)，在播放线程里算好再交给界面
+        self.describe = describe
+        self.poll_interval = poll_interval
+        self.commands = queue.Queue()
+        # 发给界面的结果，界面线程自己取
+        self.events = queue.Queue()
+        self.index = 0
+        # 当前曲目的时长，和预计切到下一首的时刻（见_timeout）
+        self.duration = 0.0
+        self._ends_at = None
+        # 实际加载次数 / 被合并掉的切歌命令数
+        self.loads = 0
+        self.coalesced = 0
+        engine.on_track_change = self._track_changed
+        self._thread = threading.Thread(target=self._run, name='playback', daemon=True)
+        self._thread.start()
+
+    def submit(self, command, arg=None):
+        """命令：play(序号) next prev pause resume seek(秒) stop requeue quit
+        library(函数)：修改曲库并返回 旧路径->新路径 的函数，序号由播放线程跟着曲目改"""
+        # 打开统计时带上提交时间，用来算从点击到出声的延迟
+        self.commands.put((command, arg, METRICS.clock()))
+
+    def wait_idle(self):
+        """阻塞到已提交的命令全部执行完"""
+        self.commands.join()
+
+    def close(self, timeout=1.0):
+        self.submit('quit')
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self.commands.get(timeout=self._timeout())]
+            except queue.Empty:
+                self._poll()
+                continue
+            # 把已经排队的命令一次取完，合并后只执行最终结果
+            while True:
+                try:
+                    batch.append(self.commands.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                # 曲库变化先应用，同一批里的切歌按新的序号执行
+                for command, arg, _ in batch:
+                    if command == 'library':
+                        self._reindex(arg)
+                if not self._apply(batch):
+                    return
+            except Exception as e:
+                print(f"播放命令执行失败: {e}")
+                self.events.put(('error', str(e)))
+            finally:
+                for _ in batch:
+                    self.commands.task_done()
+            self._poll()
+
+    def _poll(self):
+        # 自动切歌时加载失败也不能让播放线程退出，否则之后的命令永远没人执行
+        try:
+            self.engine.poll()
+        except Exception as e:
+            print(f"切歌失败: {e}")
+            self.events.put(('error', str(e)))
+            if self.engine.current is None:
+                self.events.put(('stopped',))
+
+    def _timeout(self):
+        """平时每poll_interval检查一次结束事件；下一首已经排队、快到结尾时按预计的切歌时刻醒来并密集检查，
+        切歌后马上换成新曲目的音量"""
+        engine = self.engine
+        if engine.queued is None or engine.paused or not self.duration:
+            self._ends_at = None
+            return self.poll_interval
+        now = time.perf_counter()
+        if self._ends_at is None:
+            # 切歌后position()从0重新算，所以只在切歌前估计一次
+            remaining = self.duration - engine.position()
+            if remaining >= self.poll_interval:
+                return self.poll_interval
+            self._ends_at = now + remaining
+        left = self._ends_at - now
+        if left > TRANSITION_POLL:
+            return left
+        if left > -TRANSITION_GRACE:
+            return TRANSITION_POLL
+        return self.poll_interval
+
+    def _apply(self, batch):
+        # 切歌、跳转都会改变播放位置，重新估计结尾
+        self._ends_at = None
+        files = self.engine.files
+        order = self.engine.order
+        index = self.index
+        target = None
+        jumps = 0
+        stop = False
+        pause = None
+        seek = None
+        requeue = False
+        requested = None
+        for command, arg, submitted in batch:
+            if command == 'quit':
+                self.engine.stop()
+                return False
+            elif command in ('next', 'prev', 'play'):
+                if not files:
+                    continue
+                # 每一步都推进播放顺序（很便宜），但只加载最终停下的那首
+                if command == 'next':
+                    index = order.advance(index)
+                elif command == 'prev':
+                    index = order.back(index)
+                else:
+                    order.jump(index, arg)
+                    index = arg
+                target = index
+                if requested is None:
+                    requested = submitted
+                jumps += 1
+                stop = False
+                seek = None
+            elif command == 'stop':
+                target = None
+                stop = True
+            elif command == 'pause':
+                pause = True
+            elif command == 'resume':
+                pause = False
+            elif command == 'seek':
+                seek = arg
+            elif command == 'requeue':
+                requeue = True
+
+        if jumps > 1:
+            self.coalesced += jumps - 1
+        if stop:
+            self.engine.stop()
+            self.events.put(('stopped',))
+        elif target is not None:
+            self.index = target
+            started = METRICS.clock()
+            self.engine.play(target)
+            METRICS.record('playback.load', started)
+            # 从（被合并的几次里第一次）点击到混音器开始播放
+            METRICS.record('playback.command_to_audio', requested)
+            self.loads += 1
+            self._post_track(target)
+        elif requeue:
+            self.engine.requeue()
+
+        if pause is True:
+            self.engine.pause()
+        elif pause is False:
+            self.engine.resume()
+        if seek is not None:
+            if self.engine.current is not None:
+                started = METRICS.clock()
+                try:
+                    self.engine.seek(seek)
+                except pygame.error as e:
+                    print(f"跳转失败: {e}")
+                METRICS.record('playback.seek', started)
+            self.events.put(('seeked', self.engine.offset))
+        return True
+
+    def _reindex(self, apply):
+        engine = self.engine
+        files = engine.files
+        order = engine.order
+        count = len(files)
+        # 修改之前先把持有的序号换成路径
+        held = {self.index, engine.current, engine.queued, *order.held()}
+        paths = {i: files[i] for i in held if i is not None and 0 <= i < count}
+        translate = apply()
+        moved = {}
+        for i, path in paths.items():
+            try:
+                moved[i] = files.index(translate(path))
+            except ValueError:
+                moved[i] = None
+        order.remap(moved.get)
+        if not files:
+            engine.stop()
+            self.index = 0
+            self.events.put(('stopped',))
+            return
+
+        def follow(index):
+            if index not in paths:
+                return min(index, len(files) - 1)
+            if moved[index] is not None:
+                return moved[index]
+            # 曲目被删了：停在它原来位置的前一首，下一首就还是原来的下一首（正在播放的会放完）
+            return (files.bisect(translate(paths[index])) - 1) % len(files)
+
+        self.index = follow(self.index)
+        if engine.current is not None:
+            engine.current = follow(engine.current)
+            # 排队的下一首可能被删了或换了位置，重新排
+            engine.requeue()
+        self.events.put(('reindexed', self.index))
+
+    def _track_changed(self, index):
+        self.index = index
+        self._ends_at = None
+        self._post_track(index)
+
+    def _post_track(self, index):
+        path = self.engine.files[index]
+        metadata, duration = None, 0.0
+        if self.describe is not None:
+            started = METRICS.clock()
+            try:
+                metadata, duration = self.describe(path)
+            except Exception as e:
+                # 文件可能在排队后被删掉或改名（曲库变化稍后才到），不能让播放线程退出
+                print(f"读取曲目信息失败: {e}")
+            METRICS.record('playback.describe', started)
+        self.duration = duration
+        self.events.put(('track', index, metadata, duration))
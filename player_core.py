@@ -0,0 +1,265 @@
+import queue
+import threading
+import time
+import pygame
+from library_scanner import LibraryScanner
+from library_watcher import LibraryWatcher
+from loudness import LoudnessAnalyzer
+from metadata_cache import MetadataCache
+from metrics import METRICS
+from play_order import SEQUENTIAL, PlayOrder
+from playback import PlaybackEngine, PlaybackWorker
+from search_index import SearchIndex
+from track_library import TrackLibrary, TrackList
+from waveform import WaveformSummarizer
+
+
+class PlayerCore:
+    """播放核心：曲库、播放顺序、播放线程和播放状态，不依赖任何界面。
+    Tk窗口和无界面的 player_daemon 都只是它的客户端，可以同时存在。"""
+
+    def __init__(self, music_path='music', library=None):
+        # 曲库持久化在SQLite里，启动时只打开数据库，列表按页读取
+        self.library = library if library is not None else TrackLibrary()
+        self.metadata_cache = MetadataCache(self.library)
+        # 响度均衡：有ReplayGain标签直接用，否则后台进程池分析，播放从不等待
+        self.loudness = LoudnessAnalyzer(self.library)
+        # 进度条上的波形，和响度分析共用进程池
+        self.waveforms = WaveformSummarizer(self.library, self.loudness.pool)
+        # 搜索索引跟着曲库的每次修改更新；启动时从曲库里已有的标签建，不等扫描
+        self.search_index = SearchIndex()
+        self.library.listeners.append(self.search_index.on_library_change)
+        threading.Thread(target=self.search_index.build, args=(self.library, music_path), name='search-index', daemon=True).start()
+
+        # 后台增量扫描并写回曲库，第一批到了就能播放；数据库里别的文件夹的记录不算
+        self.files = TrackList(self.library, root=music_path)
+        self.folders = []
+        self.scanned = threading.Event()
+        # 播放顺序（含随机播放的历史记录），order_mode读写的就是它的mode
+        self.order = PlayOrder(self.files, mode=SEQUENTIAL)
+        self.scanner = LibraryScanner(music_path)
+        # 扫描完成后监视目录，增删改名增量应用（见apply_library_delta）
+        self.watcher = None
+        self._closed = False
+        # 界面线程和守护进程的线程都会取事件；扫描线程结束时也要用，先于扫描线程创建
+        self._lock = threading.Lock()
+
+        # 播放状态：命令发出时先改，播放线程的结果到了再由handle_events校正
+        self.paused = True
+        self.play_num = 0
+        self.total_time = 0.0
+        self.metadata = None
+        # 已提交但播放线程还没执行的跳转目标
+        self.seek_pending = None
+
+        # 所有加载/切歌都交给唯一的播放线程
+        self.engine = PlaybackEngine(self.files, self.order, volume=self.loudness.volume)
+        self.worker = PlaybackWorker(self.engine, describe=self.describe_track)
+
+        # 最后才开始扫描：扫描完建的监视器会把曲库变化交给播放线程（apply_library_delta），
+        # 曲库很小时扫描可能在这里之前就结束了
+        threading.Thread(target=self.scan_library, name='library-scan', daemon=True).start()
+
+    # 0 顺序播放，1 单曲循环，2 随机播放
+    @property
+    def order_mode(self):
+        return self.order.mode
+
+    @order_mode.setter
+    def order_mode(self, mode):
+        self.order.mode = mode
+
+    def set_mode(self, mode):
+        self.order_mode = mode
+        # 已排队的下一首按新模式重新决定
+        self.worker.submit('requeue')
+
+    def play_music(self, index):
+        self.worker.submit('play', index)
+        self.paused = False
+
+    def play_path(self, path):
+        """播放指定文件（搜索结果），曲目已经不在曲库里时返回False"""
+        try:
+            index = self.files.index(path)
+        except ValueError:
+            return False
+        self.play_music(index)
+        return True
+
+    def search(self, query, limit=None):
+        return self.search_index.search(query, limit)
+
+    def next_music(self):
+        if not self.files:
+            return False
+        # 连按多次只会加载最后一首
+        self.worker.submit('next')
+        self.paused = False
+        return True
+
+    def last_music(self):
+        if not self.files:
+            return False
+        self.worker.submit('prev')
+        self.paused = False
+        return True
+
+    def pause(self):
+        self.paused = True
+        self.worker.submit('pause')
+
+    def resume(self):
+        self.paused = False
+        self.worker.submit('resume')
+
+    def pause_unpause(self):
+        if self.paused:
+            self.resume()
+        else:
+            self.pause()
+        return self.paused
+
+    def seek(self, seconds):
+        if self.total_time <= 0:
+            return False
+        seconds = min(max(seconds, 0.0), self.total_time)
+        self.seek_pending = seconds
+        self.worker.submit('seek', seconds)
+        return True
+
+    def seek_by(self, delta):
+        return self.seek(self.position() + delta)
+
+    def position(self):
+        """当前曲目已播放的秒数；跳转还没生效时返回目标位置"""
+        if self.seek_pending is not None:
+            return self.seek_pending
+        if self.engine.current is None:
+            return 0.0
+        return max(self.engine.position(), 0.0)
+
+    def handle_events(self):
+        """取出播放线程的结果并更新状态，返回取到的事件"""
+        events = []
+        with self._lock:
+            while True:
+                try:
+                    event = self.worker.events.get_nowait()
+                except queue.Empty:
+                    break
+                events.append(event)
+                if event[0] == 'track':
+                    _, self.play_num, self.metadata, self.total_time = event
+                    self.seek_pending = None
+                elif event[0] == 'seeked':
+                    self.seek_pending = None
+                elif event[0] == 'reindexed':
+                    # 曲库增删后同一首曲目的新序号
+                    self.play_num = event[1]
+                elif event[0] == 'stopped':
+                    self.paused = True
+        return events
+
+    def status(self):
+        self.handle_events()
+        metadata = self.metadata or {}
+        return {
+            'index': self.play_num,
+            'title': metadata.get('title'),
+            'artist': metadata.get('artist'),
+            'album': metadata.get('album'),
+            'position': round(self.position(), 3),
+            'duration': self.total_time,
+            'paused': self.paused,
+            'mode': self.order_mode,
+            'tracks': len(self.files),
+            'scanned': self.scanned.is_set(),
+        }
+
+    # 获取媒体文件元数据（走缓存，只有文件变化时才重新解析标签）
+    def get_metadata(self, file_path):
+        return self.metadata_cache.get(file_path)
+
+    def list_rows(self):
+        """列表里的 上一首、当前、下一首 的“标题-歌手”，曲库为空时返回空列表。
+        上一首/下一首按播放顺序取，随机播放时也是真实的邻居；监视线程刚删掉曲目时
+        序号可能还没跟上（reindexed事件稍后才到），都按当前长度取模"""
+        count = len(self.files)
+        if not count:
+            return []
+        current = self.play_num % count
+        previous, following = self.order.neighbours(current)
+        rows = []
+        for num in (previous % count, current, following % count):
+            music_data = self.get_metadata(self.files[num])
+            rows.append(f"{music_data['title']}-{music_data['artist']}")
+        return rows
+
+    # 获取音频时长的函数（支持FLAC）
+    def get_audio_duration(self, file_path):
+        # 优先读容器头部，只有头部缺失时才整段解码
+        return self.metadata_cache.get_duration(file_path, decoder=lambda p: pygame.mixer.Sound(p).get_length())
+
+    # 在播放线程里调用：读取元数据和时长，顺便安排计算波形
+    def describe_track(self, file_path):
+        self.waveforms.request(file_path)
+        return self.get_metadata(file_path), self.get_audio_duration(file_path)
+
+    def scan_library(self):
+        seen = []
+        started = batch_started = METRICS.clock()
+        for batch in self.scanner.scan():
+            self.library.upsert_files(batch)
+            seen.extend(batch)
+            # 每批的耗时包括遍历目录和写曲库
+            METRICS.record('scan.batch', batch_started)
+            METRICS.incr('scan.files', len(batch))
+            batch_started = METRICS.clock()
+        # 扫描完成后清掉已经不存在的文件
+        self.library.prune(self.scanner.root, seen)
+        self.folders = self.scanner.folders()
+        self.scanned.set()
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            METRICS.gauge('scan.seconds', round(elapsed, 3))
+            METRICS.gauge('scan.files_per_s', round(len(seen) / max(elapsed, 1e-6)))
+        with self._lock:
+            if not self._closed:
+                self.watcher = LibraryWatcher(self.scanner, self.apply_library_delta)
+        # 再把还没有响度数据的曲目交给分析进程
+        self.loudness.analyze(seen)
+
+    def apply_library_delta(self, delta):
+        """监视线程调用：曲库的修改交给播放线程做，播放线程持有的序号才能跟着曲目走"""
+        METRICS.incr('watch.batches')
+        METRICS.incr('watch.changes', len(delta))
+
+        def apply():
+            started = METRICS.clock()
+            for path in delta.apply(self.library):
+                self.metadata_cache.invalidate(path)
+            self.folders = self.watcher.folders()
+            METRICS.record('watch.apply', started)
+            return delta.translate
+
+        self.worker.submit('library', apply)
+        if delta.added:
+            # 新曲目的响度分析：analyze会等进程池有空位，不能占着监视线程
+            threading.Thread(target=self.loudness.analyze, args=(sorted(delta.added),), daemon=True).start()
+
+    def list_files_and_folders(self, path):
+        # 递归列出音频文件（阻塞版本，扫描完成才返回）
+        scanner = LibraryScanner(path)
+        files = scanner.files()
+        return files, scanner.folders()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        if self.watcher is not None:
+            self.watcher.close()
+        self.worker.close()
+        self.waveforms.close()
+        self.loudness.close()
+        self.library.close()
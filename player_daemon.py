@@ -0,0 +1,307 @@
+import json
+import math
+import os
+import selectors
+import socket
+import sys
+import threading
+import pygame
+from metrics import METRICS
+from player_core import PlayerCore
+
+SOCKET_PATH = os.path.join('cache', 'player.sock')
+# 没有请求时多久同步一次播放线程的事件（秒）
+IDLE_INTERVAL = 0.1
+# 单行请求的上限，超过就断开这个客户端
+MAX_LINE = 1 << 16
+# search命令默认返回的结果数
+SEARCH_LIMIT = 50
+
+
+def reject_constant(name):
+    raise ValueError(f'不支持 {name}')
+
+
+def finite(value):
+    """转成float；JSON里的1e999、NaN也能解析成float，跳转等参数只接受有限值"""
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f'不是有限的数: {value}')
+    return number
+
+
+class PlayerDaemon:
+    """控制套接字：Unix域套接字上按行收发JSON。
+    命令只是放进播放线程的队列，不会阻塞，所以一个线程用selectors就能服务所有客户端。
+
+    请求: {"cmd": "play", "index": 3, "id": 1}
+    命令: status play(index或path) pause resume toggle next prev seek(seconds或delta) mode(0/1/2)
+          search(query, limit)
+          stats（统计快照） metrics(enabled/reset) profile(action=start/stop，stop时返回采样结果)
+    回复: {"ok": true, "id": 1, ...}，出错时 {"ok": false, "error": "..."}"""
+
+    def __init__(self, core, path=SOCKET_PATH):
+        self.core = core
+        self.path = path
+        self.requests = 0
+        self._closed = False
+        self._thread = None
+        self._selector = selectors.DefaultSelector()
+        self._clients = {}
+        self._server = self._listen(path)
+        self._selector.register(self._server, selectors.EVENT_READ)
+
+    @staticmethod
+    def _listen(path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(path):
+            # 上次异常退出留下的套接字文件：连不上才删除
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except OSError:
+                os.unlink(path)
+            else:
+                raise RuntimeError(f"已有播放器在监听 {path}")
+            finally:
+                probe.close()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(128)
+        server.setblocking(False)
+        return server
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='control-socket', daemon=True)
+        self._thread.start()
+
+    def serve_forever(self):
+        try:
+            while not self._closed:
+                for key, mask in self._selector.select(IDLE_INTERVAL):
+                    if key.fileobj is self._server:
+                        self._accept()
+                    elif mask & selectors.EVENT_READ:
+                        self._read(key.fileobj)
+                    if mask & selectors.EVENT_WRITE and key.fileobj in self._clients:
+                        self._flush(key.fileobj)
+                # 没有客户端查询时也要取走播放线程的事件，状态才是新的
+                self.core.handle_events()
+        finally:
+            self._shutdown()
+
+    def _accept(self):
+        try:
+            conn, _ = self._server.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        self._clients[conn] = [bytearray(), bytearray()]
+        self._selector.register(conn, selectors.EVENT_READ)
+
+    def _read(self, conn):
+        try:
+            data = conn.recv(MAX_LINE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(conn)
+            return
+        inbox, outbox = self._clients[conn]
+        inbox += data
+        while True:
+            end = inbox.find(b'\n')
+            if end < 0:
+                break
+            line = bytes(inbox[:end])
+            del inbox[:end + 1]
+            if line.strip():
+                outbox += json.dumps(self.handle_line(line), ensure_ascii=False).encode('utf-8') + b'\n'
+        if len(inbox) > MAX_LINE:
+            self._drop(conn)
+            return
+        self._flush(conn)
+
+    def _flush(self, conn):
+        outbox = self._clients[conn][1]
+        if outbox:
+            try:
+                sent = conn.send(outbox)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError:
+                self._drop(conn)
+                return
+            del outbox[:sent]
+        # 客户端读得慢时才关注可写事件
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if outbox else 0)
+        if self._selector.get_key(conn).events != events:
+            self._selector.modify(conn, events)
+
+    def _drop(self, conn):
+        self._clients.pop(conn, None)
+        self._selector.unregister(conn)
+        conn.close()
+
+    def handle_line(self, line):
+        started = METRICS.clock()
+        try:
+            # json.loads默认接受NaN/Infinity，原样回显（如id）时回复就不是合法的JSON了
+            request = json.loads(line, parse_constant=reject_constant)
+            if not isinstance(request, dict):
+                raise ValueError('请求必须是JSON对象')
+        except ValueError as e:
+            return {'ok': False, 'error': f'无法解析请求: {e}'}
+        response = self.handle(request)
+        if 'id' in request:
+            response['id'] = request['id']
+        METRICS.record('daemon.request', started)
+        return response
+
+    def handle(self, request):
+        self.requests += 1
+        core = self.core
+        command = request.get('cmd')
+        try:
+            if command == 'status':
+                return {'ok': True, 'status': core.status()}
+            elif command == 'play':
+                if 'path' in request:
+                    if not core.play_path(request['path']):
+                        return {'ok': False, 'error': f"曲目不在曲库里: {request['path']}"}
+                    return {'ok': True}
+                index = int(request.get('index', core.play_num))
+                if not 0 <= index < len(core.files):
+                    return {'ok': False, 'error': f'曲目序号超出范围: {index}'}
+                core.play_music(index)
+            elif command == 'pause':
+                core.pause()
+            elif command == 'resume':
+                core.resume()
+            elif command == 'toggle':
+                core.pause_unpause()
+            elif command == 'next':
+                if not core.next_music():
+                    return {'ok': False, 'error': '曲库为空'}
+            elif command == 'prev':
+                if not core.last_music():
+                    return {'ok': False, 'error': '曲库为空'}
+            elif command == 'seek':
+                if 'delta' in request:
+                    done = core.seek_by(finite(request['delta']))
+                else:
+                    done = core.seek(finite(request['seconds']))
+                if not done:
+                    return {'ok': False, 'error': '当前曲目不能跳转'}
+            elif command == 'mode':
+                mode = int(request['mode'])
+                if mode not in (0, 1, 2):
+                    return {'ok': False, 'error': f'未知的播放模式: {mode}'}
+                core.set_mode(mode)
+            elif command == 'search':
+                limit = int(request.get('limit', SEARCH_LIMIT))
+                return {'ok': True, 'paths': core.search(str(request['query']), limit)}
+            elif command == 'stats':
+                return {'ok': True, 'stats': METRICS.snapshot()}
+            elif command == 'metrics':
+                # 命令行 --send 传来的是字符串
+                if 'enabled' in request:
+                    if str(request['enabled']).lower() in ('1', 'true', 'on'):
+                        METRICS.enable()
+                    else:
+                        METRICS.disable()
+                if str(request.get('reset', '')).lower() in ('1', 'true', 'on'):
+                    METRICS.reset()
+                return {'ok': True, 'enabled': METRICS.enabled}
+            elif command == 'profile':
+                action = request.get('action', 'start')
+                if action == 'start':
+                    interval = request.get('interval')
+                    METRICS.start_profiler(finite(interval) if interval is not None else None)
+                elif action == 'stop':
+                    return {'ok': True, 'profile': METRICS.stop_profiler()}
+                else:
+                    return {'ok': False, 'error': f'未知的profile动作: {action}'}
+            else:
+                return {'ok': False, 'error': f'未知命令: {command}'}
+        except (KeyError, TypeError, ValueError, OverflowError) as e:
+            return {'ok': False, 'error': f'参数错误: {e}'}
+        except Exception as e:
+            # 曲库、混音器等的错误只影响这一个请求，不能让服务线程退出（其他客户端也用这个套接字）
+            print(f"控制命令执行失败: {command}: {e}")
+            return {'ok': False, 'error': f'执行失败: {e}'}
+        return {'ok': True}
+
+    def close(self, timeout=1.0):
+        self._closed = True
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _shutdown(self):
+        for conn in list(self._clients):
+            self._drop(conn)
+        self._selector.unregister(self._server)
+        self._server.close()
+        self._selector.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def send_command(command, path=SOCKET_PATH, **args):
+    """一次性客户端：发一条命令并返回回复"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.connect(path)
+        conn.sendall(json.dumps(dict(args, cmd=command)).encode('utf-8') + b'\n')
+        reply = b''
+        while not reply.endswith(b'\n'):
+            chunk = conn.recv(MAX_LINE)
+            if not chunk:
+                break
+            reply += chunk
+    return json.loads(reply)
+
+
+def main(argv):
+    path = SOCKET_PATH
+    metrics = '--metrics' in argv
+    if metrics:
+        argv = [a for a in argv if a != '--metrics']
+    if '--socket' in argv:
+        i = argv.index('--socket')
+        path = argv[i + 1]
+        argv = argv[:i] + argv[i + 2:]
+    if argv and argv[0] == '--send':
+        # 控制已经在运行的播放器，例如 --send seek seconds=30
+        args = dict(a.split('=', 1) for a in argv[2:])
+        print(json.dumps(send_command(argv[1], path, **args), ensure_ascii=False))
+        return
+    music_path = argv[0] if argv else 'music'
+
+    pygame.mixer.init()
+    core = PlayerCore(music_path)
+    daemon = PlayerDaemon(core, path)
+    print(f"无界面播放器已启动，控制套接字: {path}")
+    if metrics:
+        METRICS.start_dumping()
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+        METRICS.stop_dumping()
+        core.close()
+        pygame.mixer.quit()
+
+
+# 用法: python player_daemon.py [--socket 路径] [--metrics] [音乐文件夹]
+#       --metrics 打开统计，每10秒写一次 cache/metrics.json
+#       python player_daemon.py [--socket 路径] --send 命令 [参数=值 ...]
+if __name__ == '__main__':
+    main(sys.argv[1:])
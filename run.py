@@ -1,7 +1,11 @@
 import base64
+import hashlib
+import os
+import sys
 from PIL import Image
 from io import BytesIO
 import json
+from sprites import ATLAS_PATH, OFF_COLORS, SpritePipeline, read_atlas_manifest, write_atlas
 
 
 def to_base64(pil_image, format='PNG'):
@@ -19,37 +23,74 @@ def to_pil(base64_string):
     return img
 
 
-# 使用示例
-# 1. 图像转Base64
-all_img = Image.open('UI.png')
-win_img = all_img.crop((7, 5, 355, 106))
-sequential_on = all_img.crop((36, 126, 43, 134))
-cyclic_on = all_img.crop((44, 126, 51, 134))
-rand_on = all_img.crop((52, 126, 60, 134))
-continue_on = all_img.crop((4, 126, 11, 134))
-last_on = all_img.crop((12, 126, 19, 134))
-pause_on = all_img.crop((20, 126, 27, 134))
-next_on = all_img.crop((28, 126, 35, 134))
-hid_on = all_img.crop((4, 145, 13, 154))
-del_on = all_img.crop((14, 145, 23, 154))
-
-base_data = {
-    'win': to_base64(win_img),
-    'sequential': to_base64(sequential_on),
-    'cyclic': to_base64(cyclic_on),
-    'rand': to_base64(rand_on),
-    'continue': to_base64(continue_on),
-    'last': to_base64(last_on),
-    'pause': to_base64(pause_on),
-    'next': to_base64(next_on),
-    'hid': to_base64(hid_on),
-    'del': to_base64(del_on),
+# 各精灵在UI.png中的位置
+CROPS = {
+    'win': (7, 5, 355, 106),
+    'sequential': (36, 126, 43, 134),
+    'cyclic': (44, 126, 51, 134),
+    'rand': (52, 126, 60, 134),
+    'continue': (4, 126, 11, 134),
+    'last': (12, 126, 19, 134),
+    'pause': (20, 126, 27, 134),
+    'next': (28, 126, 35, 134),
+    'hid': (4, 145, 13, 154),
+    'del': (14, 145, 23, 154),
 }
-# 保存字典到JSON文件
-with open("resources.json", "w", encoding="utf-8") as f:
-    json.dump(base_data, f, ensure_ascii=False, indent=4)
-
-# # 2. Base64转图像
-# restored_image = to_pil(base64_str)
-# restored_image.save("restored.jpg")
-# print("\n已还原图像并保存为 restored.jpg")
\ No newline at end of file
+# 预先放大的倍数，播放器的power不在其中时回退到运行时处理
+ATLAS_SCALES = (1, 2, 3, 4)
+# 窗口透明色，和播放器的a_col一致
+ATLAS_BG = '#00ff00'
+# 图集格式或生成规则变化时加一，强制重建
+ATLAS_VERSION = 1
+
+
+def source_hash(path, scales):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        h.update(f.read())
+    h.update(json.dumps([ATLAS_VERSION, list(scales), ATLAS_BG, CROPS], sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+def build_atlas(sprites, scales, digest, path=ATLAS_PATH):
+    """把每个精灵在各倍数下的亮/灭两种状态写进同一个图集文件"""
+    pipeline = SpritePipeline(sprites)
+    blobs = []
+    for scale in scales:
+        for name in sprites:
+            if name == 'win':
+                blobs.append((f'{name}:on@{scale}', pipeline.get(name, scale, bg=ATLAS_BG)))
+            else:
+                blobs.append((f'{name}:on@{scale}', pipeline.get(name, scale)))
+                blobs.append((f'{name}:off@{scale}', pipeline.get(name, scale, OFF_COLORS)))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atlas(path, {'source_hash': digest, 'scales': list(scales), 'bg': ATLAS_BG}, blobs)
+
+
+def main(argv):
+    force = '--force' in argv
+    scales = tuple(int(a) for a in argv if a.isdigit()) or ATLAS_SCALES
+    digest = source_hash('UI.png', scales)
+
+    manifest = read_atlas_manifest()
+    if not force and manifest is not None and manifest.get('source_hash') == digest and os.path.exists("resources.json"):
+        print("UI.png 未变化，跳过重建")
+        return
+
+    all_img = Image.open('UI.png')
+    sprites = {name: all_img.crop(box) for name, box in CROPS.items()}
+
+    # 1. 图像转Base64（图集缺失时播放器仍然读这份）
+    base_data = {name: to_base64(image) for name, image in sprites.items()}
+    # 保存字典到JSON文件
+    with open("resources.json", "w", encoding="utf-8") as f:
+        json.dump(base_data, f, ensure_ascii=False, indent=4)
+
+    # 2. 生成预放大、预换色的图集
+    build_atlas(sprites, scales, digest)
+    print(f"已生成 {ATLAS_PATH}，倍数: {list(scales)}")
+
+
+# 用法: python run.py [--force] [倍数 ...]
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,250 @@
+import os
+import threading
+import unicodedata
+from array import array
+from collections import defaultdict
+from itertools import islice
+from operator import add
+from metrics import METRICS
+
+# 索引连续1到3个字符的子串
+GRAM = 3
+# 废弃的编号超过这么多、且超过一半时整体重建倒排表
+COMPACT_MIN = 4096
+
+
+def normalize(text):
+    """全角转半角、大小写折叠，查询和曲目按同样的规则比较"""
+    return unicodedata.normalize('NFKC', text).casefold()
+
+
+def grams(text):
+    """每个字段里长度1到GRAM的所有子串：短于GRAM的查询正好对应一个倒排表，不用逐条确认。
+    逐字拼接（map+add）比按下标切片快几倍，建索引的大部分时间在这里"""
+    result = set()
+    for field in text.split('\n'):
+        result.update(field)
+        longer = field
+        for n in range(1, GRAM):
+            longer = list(map(add, longer, field[n:]))
+            result.update(longer)
+    return result
+
+
+def document(path, title, artist, album):
+    """参与搜索的文本：标题、歌手、专辑各占一行（查询里没有换行，不会跨字段匹配）；
+    还没读过标签的曲目用文件名"""
+    if title is None:
+        return normalize(os.path.splitext(os.path.basename(path))[0])
+    return normalize('\n'.join(field or '' for field in (title, artist, album)))
+
+
+class SearchIndex:
+    """曲库搜索：标题/歌手/专辑的n-gram倒排索引（n=1~3），只在内存里。
+    每个子串对应递增的曲目编号（只出现一次的子串直接存int，多次的才用array）。
+    不足3个字的查询直接取对应的倒排表；更长的取其中最短的三元组倒排表，再逐条确认确实包含整个查询。
+    新查询包含上一次的查询时（继续输入），上一次的结果更少就只在上一次的结果里过滤。
+    删除只做标记，废弃的编号过多时整体重建。结果按建索引时的顺序（路径顺序），之后新增的排在后面。"""
+
+    def __init__(self):
+        self.texts = []
+        self.paths = []
+        self.ids = {}
+        self.postings = {}
+        self.dead = 0
+        # 每次内容变化加一，上一次的结果只在版本相同时复用
+        self.version = 0
+        self._last = None
+        # build() 期间的修改先记下，建好后在新索引上重放
+        self._journal = None
+        # 界面线程查询，扫描、播放、监视线程修改
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def build(self, library, root=None):
+        """从曲库重建（root指定时只取root下的曲目），不阻塞查询；先开始记录修改再读曲库，读完之后的修改也不会丢"""
+        started = METRICS.clock()
+        with self._lock:
+            self._journal = []
+        fresh = SearchIndex()
+        fresh._fill((path, document(path, title, artist, album)) for path, title, artist, album in library.search_rows(root))
+        with self._lock:
+            for name, args in self._journal:
+                getattr(fresh, name)(*args)
+            self._journal = None
+            self._adopt(fresh)
+        METRICS.record('search.build', started)
+
+    def _adopt(self, other):
+        self.texts, self.paths, self.ids = other.texts, other.paths, other.ids
+        self.postings, self.dead = other.postings, other.dead
+        self.version += 1
+
+    def _fill(self, entries):
+        """在空索引上批量加入 (路径, 文本)：先攒成list，最后一次转成array"""
+        lists = defaultdict(list)
+        for number, (path, text) in enumerate(entries):
+            self.texts.append(text)
+            self.paths.append(path)
+            self.ids[path] = number
+            for gram in grams(text):
+                lists[gram].append(number)
+        self.postings = {gram: numbers[0] if len(numbers) == 1 else array('I', numbers)
+                         for gram, numbers in lists.items()}
+
+    def _add(self, path, text):
+        number = len(self.texts)
+        self.texts.append(text)
+        self.paths.append(path)
+        self.ids[path] = number
+        postings = self.postings
+        for gram in grams(text):
+            posting = postings.get(gram)
+            if posting is None:
+                postings[gram] = number
+            elif type(posting) is int:
+                postings[gram] = array('I', (posting, number))
+            else:
+                posting.append(number)
+
+    def _add_new(self, path):
+        if path not in self.ids:
+            self._add(path, document(path, None, None, None))
+
+    def _remove(self, path):
+        number = self.ids.pop(path, None)
+        if number is None:
+            return
+        self.texts[number] = None
+        self.paths[number] = None
+        self.dead += 1
+
+    def _update(self, path, text):
+        number = self.ids.get(path)
+        if number is not None and self.texts[number] == text:
+            return False
+        self._remove(path)
+        self._add(path, text)
+        return True
+
+    def _rename(self, old, new):
+        number = self.ids.pop(old, None)
+        if number is None:
+            return
+        self._remove(new)
+        text = self.texts[number]
+        if text == document(old, None, None, None):
+            # 按文件名索引的曲目，名字跟着变
+            self.texts[number] = None
+            self.paths[number] = None
+            self.dead += 1
+            self._add(new, document(new, None, None, None))
+        else:
+            self.ids[new] = number
+            self.paths[number] = new
+
+    def _rename_prefix(self, old, new):
+        for path in [path for path in self.ids if path.startswith(old)]:
+            number = self.ids.pop(path)
+            self.ids[new + path[len(old):]] = number
+            self.paths[number] = new + path[len(old):]
+
+    def _compact(self):
+        """废弃编号过多时按路径顺序重建，结果的顺序也恢复成路径顺序"""
+        if self.dead < COMPACT_MIN or self.dead * 2 < len(self.texts):
+            return
+        fresh = SearchIndex()
+        fresh._fill((path, self.texts[self.ids[path]]) for path in sorted(self.ids))
+        self._adopt(fresh)
+
+    def _apply(self, name, *args):
+        """修改的统一入口（调用方持锁）：build() 进行中时同时记下来"""
+        if self._journal is not None:
+            self._journal.append((name, args))
+        result = getattr(self, name)(*args)
+        self._compact()
+        return result
+
+    def update(self, path, title, artist, album):
+        """标签读到或变化时调用"""
+        with self._lock:
+            if self._apply('_update', path, document(path, title, artist, album)):
+                self.version += 1
+
+    def add(self, paths):
+        """新文件先按文件名索引，读到标签后由update替换"""
+        with self._lock:
+            for path in paths:
+                # 判断是否已有放在_add_new里：build() 重放时要按新索引判断
+                self._apply('_add_new', path)
+            self.version += 1
+
+    def remove(self, paths):
+        with self._lock:
+            for path in paths:
+                self._apply('_remove', path)
+            self.version += 1
+
+    def rename(self, pairs):
+        with self._lock:
+            for old, new in pairs:
+                self._apply('_rename', old, new)
+            self.version += 1
+
+    def rename_prefix(self, old, new):
+        """目录改名：old、new 都以路径分隔符结尾"""
+        with self._lock:
+            self._apply('_rename_prefix', old, new)
+            self.version += 1
+
+    def on_library_change(self, event, *args):
+        """TrackLibrary的监听函数，曲库的每次修改都同步过来"""
+        if event == 'tags':
+            self.update(*args)
+        elif event == 'added':
+            self.add(*args)
+        elif event == 'removed':
+            self.remove(*args)
+        elif event == 'renamed':
+            self.rename(*args)
+        elif event == 'renamed_prefix':
+            self.rename_prefix(*args)
+
+    def search(self, query, limit=None):
+        """返回标题、歌手或专辑包含query（忽略大小写和全半角）的曲目路径"""
+        query = normalize(query).strip()
+        if not query:
+            return []
+        started = METRICS.clock()
+        with self._lock:
+            if len(query) < GRAM:
+                # 倒排表就是结果（可能含废弃的编号，取结果时跳过）
+                matched = self.postings.get(query, ())
+            else:
+                candidates = ()
+                for gram in {query[i:i + GRAM] for i in range(len(query) - GRAM + 1)}:
+                    posting = self.postings.get(gram)
+                    if posting is None:
+                        candidates = ()
+                        break
+                    if type(posting) is int:
+                        posting = (posting,)
+                    if not candidates or len(posting) < len(candidates):
+                        candidates = posting
+                last = self._last
+                if (last is not None and last[0] == self.version and last[1] in query
+                        and len(last[2]) < len(candidates)):
+                    # 继续输入：新结果一定是上一次结果的子集
+                    candidates = last[2]
+                # 三元组都出现不代表连在一起，逐条确认；废弃的编号文本是None
+                texts = self.texts
+                matched = [number for number in candidates if query in (texts[number] or '')]
+            if type(matched) is int:
+                matched = (matched,)
+            self._last = (self.version, query, matched)
+            paths = self.paths
+            paths = list(islice((paths[number] for number in matched if paths[number] is not None), limit))
+        METRICS.record('search.query', started)
+        return paths
@@ -0,0 +1,405 @@
+import bisect
+import io
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from audio_duration import find_first_frame, parse_mp3_header, skip_id3v2
+from metadata_cache import file_signature
+
+# MP3每隔多少帧记一次偏移（44.1kHz下约0.1秒）
+MP3_FRAME_STEP = 4
+# FLAC采样帧表的时间粒度（秒）
+FLAC_BUCKET = 0.25
+SCAN_CHUNK = 1 << 20
+# 逐段解码时每段的长度（秒），内存占用与曲目长度无关
+SEGMENT_SECONDS = 10.0
+
+
+class Mp3SeekIndex:
+    """MP3帧偏移表：帧时长固定，按时间直接算出表下标"""
+
+    namehint = 'mp3'
+    # 解码器可以直接从任意一帧开始播放
+    playable_slices = True
+
+    def __init__(self, offsets, frame_seconds, first_audio_frame, step=MP3_FRAME_STEP):
+        self.offsets = offsets
+        self.frame_seconds = frame_seconds
+        self.first_audio_frame = first_audio_frame
+        self.step = step
+        self.header = b''
+        self.lead = b''
+        self.lead_samples = 0
+
+    def locate(self, seconds):
+        """返回 (字节偏移, 实际落点秒数)"""
+        frame = int(max(seconds, 0) / self.frame_seconds) + self.first_audio_frame
+        slot = min(frame // self.step, len(self.offsets) - 1)
+        return self.offsets[slot], max(slot * self.step - self.first_audio_frame, 0) * self.frame_seconds
+
+
+def build_mp3_index(f, step=MP3_FRAME_STEP):
+    start = skip_id3v2(f)
+    offset, header = find_first_frame(f, start)
+    if header is None:
+        return None
+    length, samples, sample_rate, bitrate, (version, layer, mono) = header
+    f.seek(offset)
+    first = f.read(length)
+    side_info = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+    # Xing/Info/VBRI 帧本身不含音频
+    tag = first[4 + side_info:8 + side_info]
+    first_audio_frame = 1 if tag in (b'Xing', b'Info') or first[36:40] == b'VBRI' else 0
+
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    offsets = array('Q')
+    pos = offset
+    frame = 0
+    f.seek(pos)
+    buf = f.read(SCAN_CHUNK)
+    buf_start = pos
+    while pos + 4 <= end:
+        rel = pos - buf_start
+        if rel + 4 > len(buf):
+            f.seek(pos)
+            buf = f.read(SCAN_CHUNK)
+            buf_start = pos
+            rel = 0
+        header = parse_mp3_header(buf[rel:rel + 4])
+        if header is None:
+            break
+        if frame % step == 0:
+            offsets.append(pos)
+        frame += 1
+        pos += header[0]
+    if not offsets:
+        return None
+    return Mp3SeekIndex(offsets, samples / sample_rate, first_audio_frame, step)
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def parse_flac_frame_header(buf, i, min_blocksize):
+    """校验并解析buf[i:]处的FLAC帧头，返回该帧第一个采样的序号，不是帧头时返回None"""
+    if i + 6 > len(buf) or buf[i] != 0xFF or buf[i + 1] not in (0xF8, 0xF9):
+        return None
+    blocksize_code = buf[i + 2] >> 4
+    rate_code = buf[i + 2] & 0x0F
+    channels = buf[i + 3] >> 4
+    sample_size = (buf[i + 3] >> 1) & 7
+    if blocksize_code == 0 or rate_code == 15 or channels > 10 or sample_size == 3 or buf[i + 3] & 1:
+        return None
+
+    # UTF-8 形式编码的帧号/采样号
+    first = buf[i + 4]
+    if first < 0x80:
+        extra, number = 0, first
+    elif first >= 0xFE:
+        extra, number = 6, 0
+    else:
+        extra = 1
+        while first & (0x40 >> extra):
+            extra += 1
+        if extra > 5:
+            return None
+        number = first & (0x3F >> extra)
+    pos = i + 5
+    if pos + extra > len(buf):
+        return None
+    for b in buf[pos:pos + extra]:
+        if b & 0xC0 != 0x80:
+            return None
+        number = (number << 6) | (b & 0x3F)
+    pos += extra
+
+    pos += {6: 1, 7: 2}.get(blocksize_code, 0)
+    pos += {12: 1, 13: 2, 14: 2}.get(rate_code, 0)
+    if pos >= len(buf) or crc8(buf[i:pos]) != buf[pos]:
+        return None
+    if buf[i + 1] == 0xF8:
+        # 固定块大小：编码的是帧号
+        return number * min_blocksize
+    return number
+
+
+def read_flac_header(f):
+    """返回 (音频帧起始偏移, 采样率, 最小块大小, 寻址表[(采样号, 相对偏移)])"""
+    start = skip_id3v2(f)
+    f.seek(start)
+    if f.read(4) != b'fLaC':
+        return None
+    sample_rate = None
+    min_blocksize = 4096
+    seektable = []
+    while True:
+        block = f.read(4)
+        if len(block) < 4:
+            return None
+        block_type = block[0] & 0x7F
+        size = (block[1] << 16) | (block[2] << 8) | block[3]
+        body = f.read(size)
+        if block_type == 0:
+            min_blocksize = (body[0] << 8) | body[1]
+            sample_rate = (body[10] << 12) | (body[11] << 4) | (body[12] >> 4)
+        elif block_type == 3:
+            for p in range(0, size - size % 18, 18):
+                sample = int.from_bytes(body[p:p + 8], 'big')
+                if sample != 0xFFFFFFFFFFFFFFFF:
+                    seektable.append((sample, int.from_bytes(body[p + 8:p + 16], 'big')))
+        if block[0] & 0x80:
+            break
+    if not sample_rate:
+        return None
+    return f.tell(), sample_rate, min_blocksize, seektable
+
+
+class FlacSeekIndex:
+    """FLAC采样帧表：每FLAC_BUCKET秒一个桶，记桶起点处（或之前）最后一帧的 (采样号, 偏移)"""
+
+    namehint = 'flac'
+    # libFLAC要求流从第0帧开始（SDL_mixer播放前会先定位到0），切片不能直接播放；
+    # 播放时交给set_pos，libFLAC自己会用SEEKTABLE/二分定位
+    playable_slices = False
+
+    def __init__(self, path, header, audio_start, sample_rate, min_blocksize, seektable=None,
+                 bucket=FLAC_BUCKET):
+        self.path = path
+        # 播放时把元数据块拼在帧数据前面，解码器才能识别
+        self.header = header
+        self.audio_start = audio_start
+        self.sample_rate = sample_rate
+        self.min_blocksize = min_blocksize
+        self.bucket_samples = max(int(sample_rate * bucket), 1)
+        self.samples = array('Q')
+        self.offsets = array('Q')
+        self.seektable = seektable or []
+        # 第0帧：切片前面补上它才能解码（见playable_slices），解码后丢掉它的采样
+        self.lead = b''
+        self.lead_samples = 0
+        self._last = None
+
+    def add(self, sample, offset):
+        # 起点在这一帧之前的桶都归上一帧
+        while self._last is not None and len(self.offsets) * self.bucket_samples < sample:
+            self.samples.append(self._last[0])
+            self.offsets.append(self._last[1])
+        self._last = (sample, offset)
+
+    def finish(self):
+        if self._last is not None:
+            self.add(self._last[0] + 1, None)
+            self._last = None
+
+    def locate(self, seconds):
+        target = int(max(seconds, 0) * self.sample_rate)
+        if self.offsets:
+            slot = min(target // self.bucket_samples, len(self.offsets) - 1)
+            return self.offsets[slot], self.samples[slot] / self.sample_rate
+        return self._locate_with_seektable(target)
+
+    def _locate_with_seektable(self, target):
+        # 先用SEEKTABLE跳到最近的寻址点，再只扫描到下一个寻址点为止
+        points = self.seektable
+        k = bisect.bisect_right(points, (target, float('inf'))) - 1
+        sample, offset = points[k] if k >= 0 else (0, 0)
+        limit = points[k + 1][1] if k + 1 < len(points) else None
+        best = (self.audio_start + offset, sample)
+        with open(self.path, 'rb') as f:
+            for frame_sample, frame_offset in scan_flac_frames(f, self.audio_start + offset, self.min_blocksize,
+                                                               None if limit is None else self.audio_start + limit):
+                if frame_sample > target:
+                    break
+                best = (frame_offset, frame_sample)
+        return best[0], best[1] / self.sample_rate
+
+
+def scan_flac_frames(f, start, min_blocksize, end=None):
+    """从start开始按块读取，产出每个帧的 (采样号, 偏移)"""
+    carry = b''
+    carry_start = start
+    f.seek(start)
+    while end is None or carry_start < end:
+        chunk = f.read(SCAN_CHUNK)
+        if not chunk:
+            break
+        buf = carry + chunk
+        # 保留末尾几个字节，帧头可能跨块
+        limit = len(buf) - 16 if len(chunk) == SCAN_CHUNK else len(buf)
+        i = buf.find(b'\xff', 0)
+        while 0 <= i < limit:
+            sample = parse_flac_frame_header(buf, i, min_blocksize)
+            if sample is not None:
+                if end is not None and carry_start + i >= end:
+                    return
+                yield sample, carry_start + i
+            i = buf.find(b'\xff', i + 1)
+        carry = buf[limit:]
+        carry_start += limit
+
+
+def build_flac_index(f, path):
+    info = read_flac_header(f)
+    if info is None:
+        return None
+    audio_start, sample_rate, min_blocksize, seektable = info
+    f.seek(0)
+    header = f.read(audio_start)
+    index = FlacSeekIndex(path, header, audio_start, sample_rate, min_blocksize, seektable)
+    frames = scan_flac_frames(f, audio_start, min_blocksize)
+    next(frames, None)
+    second = next(frames, None)
+    if second is not None:
+        f.seek(audio_start)
+        index.lead = f.read(second[1] - audio_start)
+        index.lead_samples = second[0]
+    if seektable:
+        # 有SEEKTABLE时不扫描整个文件
+        return index
+    for sample, offset in scan_flac_frames(f, audio_start, min_blocksize):
+        index.add(sample, offset)
+    index.finish()
+    return index
+
+
+# 各扩展名对应的寻址表
+INDEX_TYPES = {'.mp3': Mp3SeekIndex, '.flac': FlacSeekIndex}
+
+
+def build_seek_index(path):
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        with open(path, 'rb') as f:
+            if ext == '.mp3':
+                return build_mp3_index(f)
+            if ext == '.flac':
+                return build_flac_index(f, path)
+    except (OSError, IndexError, ValueError) as e:
+        print(f"建立寻址表失败: {e}")
+    return None
+
+
+class SlicedFile(io.RawIOBase):
+    """头部字节 + 原文件 [offset, end) 的部分，当作一个完整文件交给解码器"""
+
+    def __init__(self, path, offset, header=b'', end=None):
+        self._file = open(path, 'rb')
+        self._header = header
+        self._offset = offset
+        if end is None:
+            self._file.seek(0, os.SEEK_END)
+            end = self._file.tell()
+        self._size = len(header) + end - offset
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self._size
+        self._pos = max(0, min(pos, self._size))
+        return self._pos
+
+    def readinto(self, b):
+        n = len(b)
+        out = 0
+        if self._pos < len(self._header):
+            part = self._header[self._pos:self._pos + n]
+            b[:len(part)] = part
+            out = len(part)
+            self._pos += out
+        if out < n:
+            self._file.seek(self._offset + self._pos - len(self._header))
+            data = self._file.read(min(n - out, self._size - self._pos))
+            b[out:out + len(data)] = data
+            out += len(data)
+            self._pos += len(data)
+        return out
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def decode_segments(path, index, duration, seconds=SEGMENT_SECONDS):
+    """按寻址表把文件切成约seconds秒的若干段逐段解码（需要已初始化的混音器），
+    依次产生 (起点秒数, 采样数组)：混音器格式的 (采样数, 声道数) 数组，各段首尾相接，同一时刻只有一段在内存里"""
+    import pygame
+    rate = pygame.mixer.get_init()[0]
+    size = os.path.getsize(path)
+    offset, start = index.locate(0)
+    first = offset
+    while start < duration:
+        end, following = index.locate(start + seconds)
+        if end <= offset or duration - following < seconds / 2:
+            # 剩下的不多（只有一两帧时解码器会拒绝），并进这一段一次解完
+            end, following = size, duration
+        # FLAC切片要先补上第0帧才能解码，解出来后去掉这部分
+        lead = index.lead if offset != first else b''
+        sound = pygame.mixer.Sound(file=SlicedFile(path, offset, index.header + lead, end))
+        pcm = pygame.sndarray.samples(sound)
+        if pcm.ndim == 1:
+            pcm = pcm[:, None]
+        if lead:
+            pcm = pcm[int(round(index.lead_samples / index.sample_rate * rate)):]
+        yield start, pcm
+        del sound, pcm
+        if end >= size:
+            break
+        offset, start = end, following
+
+
+class SeekIndexCache:
+    """按 路径+mtime+大小 缓存最近几首的寻址表"""
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        path = os.path.abspath(path)
+        sig = file_signature(path)
+        if sig is None:
+            return None
+        key = (path, sig)
+        with self._lock:
+            index = self._cache.get(key, False)
+            if index is not False:
+                self._cache.move_to_end(key)
+                return index
+        index = build_seek_index(path)
+        with self._lock:
+            self._cache[key] = index
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return index
+
+    def open_at(self, path, seconds):
+        """返回 (文件对象, 类型提示, 实际落点秒数)，不能从切片播放的格式返回None；
+        先按扩展名判断，不为用不上的寻址表在播放线程里扫一遍文件（没有SEEKTABLE的FLAC要逐帧扫）"""
+        kind = INDEX_TYPES.get(os.path.splitext(path)[1].lower())
+        if kind is None or not kind.playable_slices:
+            return None
+        index = self.get(path)
+        if index is None or not index.playable_slices:
+            return None
+        offset, actual = index.locate(seconds)
+        return SlicedFile(path, offset, index.header), index.namehint, actual
@@ -0,0 +1,151 @@
+import json
+import mmap
+import os
+import struct
+from PIL import Image
+
+# 按钮“熄灭”状态的换色表
+OFF_COLORS = (((128, 100, 255, 255), (27, 27, 42, 255)),)
+
+ATLAS_PATH = os.path.join('cache', 'skin.atlas')
+ATLAS_MAGIC = b'PXA1'
+# 文件头：魔数 + 清单长度；清单之后的像素数据按此对齐
+ATLAS_HEADER = struct.Struct('<4sI')
+ATLAS_ALIGN = 16
+
+
+def hex_to_rgba(color):
+    return tuple(int(color[i:i + 2], 16) for i in (1, 3, 5)) + (255,)
+
+
+def enlarge(image, scale_factor, bg=None):
+    """最近邻放大，bg不为空时把全透明像素填成bg"""
+    image = image.convert('RGBA')
+    if bg is not None:
+        # numpy只在回退到逐张处理时才需要，从图集启动时不导入
+        import numpy as np
+        arr = np.array(image)
+        arr[arr[..., 3] == 0] = hex_to_rgba(bg)
+        image = Image.fromarray(arr, 'RGBA')
+    width, height = image.size
+    return image.resize((width * scale_factor, height * scale_factor), Image.NEAREST)
+
+
+def replace_colors(image, color_pairs):
+    """批量换色，每个像素只按第一个匹配的颜色对替换"""
+    import numpy as np
+    arr = np.array(image.convert('RGBA'))
+    # 先在原图上算好所有掩码，避免新颜色被后面的颜色对再次替换
+    remaining = np.ones(arr.shape[:2], dtype=bool)
+    masks = []
+    for old_color, new_color in color_pairs:
+        mask = remaining & np.all(arr == np.array(old_color, dtype=np.uint8), axis=-1)
+        remaining &= ~mask
+        masks.append((mask, new_color))
+    for mask, new_color in masks:
+        arr[mask] = new_color
+    return Image.fromarray(arr, 'RGBA')
+
+
+class SpritePipeline:
+    """按 (精灵名, 倍数, 调色板, 背景色) 缓存处理后的图像"""
+
+    def __init__(self, sources):
+        self.sources = dict(sources)
+        self._cache = {}
+
+    def get(self, name, scale, palette=(), bg=None):
+        palette = tuple((tuple(old), tuple(new)) for old, new in palette)
+        key = (name, scale, palette, bg)
+        image = self._cache.get(key)
+        if image is None:
+            image = self.sources[name]
+            if palette:
+                # 在原尺寸上换色，比放大后再换色少处理scale²倍像素
+                image = replace_colors(image, palette)
+            image = enlarge(image, scale, bg=bg)
+            self._cache[key] = image
+        return image
+
+    def clear(self):
+        self._cache.clear()
+
+
+def read_atlas_manifest(path=ATLAS_PATH):
+    """只读图集清单，文件不存在或格式不对时返回None"""
+    try:
+        with open(path, 'rb') as f:
+            magic, length = ATLAS_HEADER.unpack(f.read(ATLAS_HEADER.size))
+            if magic != ATLAS_MAGIC:
+                return None
+            return json.loads(f.read(length).decode('utf-8'))
+    except (OSError, struct.error, ValueError):
+        return None
+
+
+def write_atlas(path, manifest, blobs):
+    """blobs: [(key, RGBA图像)]，像素按原始RGBA顺序连续存放"""
+    sprites = {}
+    offset = 0
+    for key, image in blobs:
+        sprites[key] = [offset, image.width, image.height]
+        offset += image.width * image.height * 4
+    manifest = dict(manifest, sprites=sprites)
+    header = json.dumps(manifest, ensure_ascii=False).encode('utf-8')
+    pad = -(ATLAS_HEADER.size + len(header)) % ATLAS_ALIGN
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(ATLAS_HEADER.pack(ATLAS_MAGIC, len(header) + pad))
+        f.write(header + b' ' * pad)
+        for key, image in blobs:
+            f.write(image.convert('RGBA').tobytes())
+    os.replace(tmp_path, path)
+
+
+class SkinAtlas:
+    """预编译图集：mmap映射后按清单切片，启动时不再解码/放大/换色"""
+
+    def __init__(self, path=ATLAS_PATH):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, length = ATLAS_HEADER.unpack(self._mmap[:ATLAS_HEADER.size])
+        if magic != ATLAS_MAGIC:
+            self._mmap.close()
+            raise ValueError(f"不是图集文件: {path}")
+        self._data_start = ATLAS_HEADER.size + length
+        self.manifest = json.loads(self._mmap[ATLAS_HEADER.size:self._data_start].decode('utf-8'))
+        self.scales = self.manifest['scales']
+        self.bg = self.manifest['bg']
+
+    @staticmethod
+    def key(name, scale, variant):
+        return f'{name}:{variant}@{scale}'
+
+    def get(self, name, scale, palette=(), bg=None):
+        if palette:
+            if tuple(palette) != OFF_COLORS:
+                raise KeyError(f'图集里没有这个调色板: {palette}')
+            variant = 'off'
+        else:
+            variant = 'on'
+        if bg is not None and bg != self.bg:
+            raise KeyError(f'图集背景色是 {self.bg}，不是 {bg}')
+        offset, width, height = self.manifest['sprites'][self.key(name, scale, variant)]
+        start = self._data_start + offset
+        view = memoryview(self._mmap)[start:start + width * height * 4]
+        return Image.frombuffer('RGBA', (width, height), view, 'raw', 'RGBA', 0, 1)
+
+    def close(self):
+        self._mmap.close()
+
+
+def load_atlas(path=ATLAS_PATH):
+    """图集存在且可读时返回SkinAtlas，否则返回None由调用方回退"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return SkinAtlas(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"读取图集失败: {e}")
+        return None
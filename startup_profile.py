@@ -0,0 +1,116 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PROFILE_PATH = os.path.join('cache', 'startup_profile.json')
+# 报告里列出的模块数
+TOP_MODULES = 15
+
+
+class StartupProfile:
+    """记录启动各阶段耗时：mark() 记下从上一个阶段结束到现在的时间，
+    milestone() 记下从启动到现在的时间（首帧、首次出声），sample() 记下重复操作的单次耗时（界面刷新）"""
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.phases = []
+        self.milestones = {}
+        self.samples = {}
+        self._last = self.started
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def milestone(self, name):
+        self.milestones[name] = time.perf_counter() - self.started
+
+    def sample(self, name, seconds):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def to_dict(self):
+        samples = {}
+        for name, values in self.samples.items():
+            values = sorted(values)
+            samples[name] = {
+                'count': len(values),
+                'median': round(values[len(values) // 2] * 1000, 3),
+                'max': round(values[-1] * 1000, 3),
+            }
+        return {
+            'phases_ms': {name: round(seconds * 1000, 2) for name, seconds in self.phases},
+            'milestones_ms': {name: round(seconds * 1000, 2) for name, seconds in self.milestones.items()},
+            'samples_ms': samples,
+        }
+
+
+def parse_importtime(lines):
+    """解析 -X importtime 的输出，返回 {顶层包: 自身耗时微秒} 和总耗时（微秒）"""
+    costs = {}
+    total = 0
+    for line in lines:
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # 表头
+            continue
+        own = int(fields[0])
+        package = fields[2].strip().split('.')[0]
+        costs[package] = costs.get(package, 0) + own
+        total += own
+    return costs, total
+
+
+def profile_startup(script, args=(), cwd=None):
+    """在子进程里用 -X importtime 启动界面，子进程把各阶段耗时写进临时文件后退出；
+    cwd 指定时在那个目录里启动（用那里的 music 和 cache）"""
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        started = time.perf_counter()
+        child = subprocess.run([sys.executable, '-X', 'importtime', script, '--profile-child', path, *args],
+                               stderr=subprocess.PIPE, text=True, encoding='utf-8', errors='replace', cwd=cwd)
+        elapsed = time.perf_counter() - started
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+    finally:
+        os.unlink(path)
+    lines = child.stderr.splitlines()
+    if not text:
+        # 子进程没走到写结果就退出了，把它的报错原样转出来
+        print('\n'.join(line for line in lines if not line.startswith('import time:')), file=sys.stderr)
+        raise RuntimeError(f'启动失败，退出码 {child.returncode}')
+    report = json.loads(text)
+    costs, total = parse_importtime(lines)
+    report['process_ms'] = round(elapsed * 1000, 2)
+    report['imports_ms'] = round(total / 1000, 2)
+    report['modules_ms'] = {name: round(us / 1000, 2)
+                            for name, us in sorted(costs.items(), key=lambda item: -item[1])[:TOP_MODULES]}
+    return report
+
+
+def print_report(report):
+    print('启动阶段（毫秒）:')
+    for name, ms in report['phases_ms'].items():
+        print(f'  {name:<16}{ms:>10.1f}')
+    for name, ms in report['milestones_ms'].items():
+        print(f'  -> {name:<13}{ms:>10.1f}')
+    for name, sample in report.get('samples_ms', {}).items():
+        print(f"  {name:<16}{sample['median']:>10.2f}（{sample['count']} 次的中位数，最长 {sample['max']:.2f}）")
+    print(f"导入模块共 {report['imports_ms']:.1f} 毫秒，自身耗时最多的包:")
+    for name, ms in report['modules_ms'].items():
+        print(f'  {name:<16}{ms:>10.1f}')
+    print(f"子进程总耗时 {report['process_ms']:.1f} 毫秒（含解释器启动和退出）")
+
+
+def save_report(report, path=PROFILE_PATH):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
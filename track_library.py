@@ -0,0 +1,318 @@
+import os
+import sqlite3
+import threading
+
+LIBRARY_PATH = os.path.join('cache', 'library.db')
+# 分页查询允许的排序字段
+ORDER_COLUMNS = ('path', 'title', 'artist', 'album', 'duration')
+
+
+def root_range(root):
+    """root下的路径都落在 [lo, hi) 里：按范围查询能用上path的唯一索引，不用逐行substr"""
+    lo = os.path.join(os.path.abspath(root), '')
+    return lo, lo[:-1] + chr(ord(lo[-1]) + 1)
+
+
+def root_filter(root):
+    """返回 (WHERE条件列表, 参数列表)：root为None时不限制"""
+    if root is None:
+        return [], []
+    return ['path >= ? AND path < ?'], list(root_range(root))
+
+
+class TrackLibrary:
+    """持久化曲库（SQLite，WAL模式），保存路径、大小、mtime、标签和时长"""
+
+    def __init__(self, db_path=LIBRARY_PATH):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.RLock()
+        # 曲目增删时加一，TrackList据此判断分页缓存是否过期
+        self.version = 0
+        # 监听函数 listener(事件, *参数)，在修改提交后、仍持锁时调用，顺序与修改一致（见SearchIndex）
+        self.listeners = []
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS tracks ('
+            'id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, size INTEGER, mtime INTEGER, '
+            'title TEXT, artist TEXT, album TEXT, duration REAL);'
+            'CREATE INDEX IF NOT EXISTS tracks_artist ON tracks (artist);'
+            'CREATE INDEX IF NOT EXISTS tracks_album ON tracks (album);'
+            'CREATE INDEX IF NOT EXISTS tracks_title ON tracks (title);'
+            # 响度按文件摘要保存，文件改名/移动后仍然有效；source 为 tag 或 analysis
+            'CREATE TABLE IF NOT EXISTS loudness ('
+            'hash TEXT PRIMARY KEY, loudness REAL, peak REAL, gain REAL NOT NULL, source TEXT);'
+            # 波形摘要：每个桶的 最小/最大/RMS，共 3*buckets 字节
+            'CREATE TABLE IF NOT EXISTS waveforms ('
+            'hash TEXT NOT NULL, buckets INTEGER NOT NULL, data BLOB NOT NULL, PRIMARY KEY (hash, buckets));'
+        )
+        self._db.commit()
+
+    def _changed(self):
+        # 曲目集合变化（增删）时调用；只改标签/时长时直接commit
+        self._db.commit()
+        self.version += 1
+
+    def _notify(self, event, *args):
+        for listener in self.listeners:
+            listener(event, *args)
+
+    def lookup(self, path):
+        """返回 (mtime, size, title, artist, album, duration)，title为None表示还没读过标签"""
+        with self._lock:
+            return self._db.execute(
+                'SELECT mtime, size, title, artist, album, duration FROM tracks WHERE path = ?', (path,)
+            ).fetchone()
+
+    def save_tags(self, path, sig, data):
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO tracks (path, mtime, size, title, artist, album) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(path) DO UPDATE SET '
+                'duration = CASE WHEN mtime = excluded.mtime AND size = excluded.size THEN duration END, '
+                'mtime = excluded.mtime, size = excluded.size, '
+                'title = excluded.title, artist = excluded.artist, album = excluded.album',
+                (path, sig[0], sig[1], data['title'], data['artist'], data['album'])
+            )
+            self._db.commit()
+            self._notify('tags', path, data['title'], data['artist'], data['album'])
+
+    def save_duration(self, path, sig, duration):
+        with self._lock:
+            self._db.execute(
+                'UPDATE tracks SET duration = ? WHERE path = ? AND mtime = ? AND size = ?',
+                (duration, path, sig[0], sig[1])
+            )
+            self._db.commit()
+
+    def lookup_loudness(self, digest):
+        """返回 (loudness, peak, gain, source)"""
+        with self._lock:
+            return self._db.execute(
+                'SELECT loudness, peak, gain, source FROM loudness WHERE hash = ?', (digest,)
+            ).fetchone()
+
+    def save_loudness(self, digest, loudness, peak, gain, source):
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO loudness (hash, loudness, peak, gain, source) VALUES (?, ?, ?, ?, ?)',
+                (digest, loudness, peak, gain, source)
+            )
+            self._db.commit()
+
+    def lookup_waveform(self, digest, buckets):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT data FROM waveforms WHERE hash = ? AND buckets = ?', (digest, buckets)
+            ).fetchone()
+        return bytes(row[0]) if row is not None else None
+
+    def save_waveform(self, digest, buckets, data):
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO waveforms (hash, buckets, data) VALUES (?, ?, ?)',
+                (digest, buckets, data)
+            )
+            self._db.commit()
+
+    def upsert_files(self, paths):
+        """扫描器批量写入：新文件只记路径和签名，签名变化的文件清空标签等待重读"""
+        rows = []
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            rows.append((path, st.st_size, st.st_mtime_ns))
+        with self._lock:
+            self._db.executemany(
+                'INSERT INTO tracks (path, size, mtime) VALUES (?, ?, ?) '
+                'ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, '
+                'title = NULL, artist = NULL, album = NULL, duration = NULL '
+                'WHERE size != excluded.size OR mtime != excluded.mtime',
+                rows
+            )
+            self._changed()
+            self._notify('added', [row[0] for row in rows])
+        return len(rows)
+
+    def remove_files(self, paths):
+        paths = [os.path.abspath(p) for p in paths]
+        with self._lock:
+            self._db.executemany('DELETE FROM tracks WHERE path = ?', [(p,) for p in paths])
+            self._changed()
+            self._notify('removed', paths)
+
+    def rename_files(self, pairs):
+        """改名/移动：保留已读的标签和时长；目标路径已有记录时被覆盖"""
+        pairs = [(os.path.abspath(old), os.path.abspath(new)) for old, new in pairs]
+        with self._lock:
+            self._db.executemany('UPDATE OR REPLACE tracks SET path = ? WHERE path = ?',
+                                 [(new, old) for old, new in pairs])
+            self._changed()
+            self._notify('renamed', pairs)
+
+    def rename_prefix(self, old, new):
+        """整个目录改名/移动"""
+        old = os.path.join(os.path.abspath(old), '')
+        new = os.path.join(os.path.abspath(new), '')
+        with self._lock:
+            self._db.execute('UPDATE OR REPLACE tracks SET path = ? || substr(path, ?) WHERE substr(path, 1, ?) = ?',
+                             (new, len(old) + 1, len(old), old))
+            self._changed()
+            self._notify('renamed_prefix', old, new)
+
+    def paths_under(self, directory):
+        directory = os.path.join(os.path.abspath(directory), '')
+        with self._lock:
+            return [path for (path,) in self._db.execute(
+                'SELECT path FROM tracks WHERE substr(path, 1, ?) = ?', (len(directory), directory)
+            )]
+
+    def position(self, path, root=None):
+        """按路径排序时path所在（或应插入）的位置；root指定时只数root下的曲目"""
+        where, args = root_filter(root)
+        sql = 'SELECT COUNT(*) FROM tracks WHERE ' + ' AND '.join(where + ['path < ?'])
+        with self._lock:
+            return self._db.execute(sql, args + [path]).fetchone()[0]
+
+    def prune(self, root, keep):
+        """删除root下不在keep中的记录（完整扫描结束后调用）"""
+        root = os.path.join(os.path.abspath(root), '')
+        keep = {os.path.abspath(p) for p in keep}
+        with self._lock:
+            stale = [
+                path for (path,) in self._db.execute(
+                    'SELECT path FROM tracks WHERE substr(path, 1, ?) = ?', (len(root), root)
+                )
+                if path not in keep
+            ]
+        if stale:
+            self.remove_files(stale)
+        return stale
+
+    # 同一个数据库里可能有别的音乐文件夹（换过文件夹、守护进程、基准测试）留下的记录，
+    # 下面的查询都可以用root限定在当前文件夹下
+
+    def search_rows(self, root=None):
+        """建搜索索引用：按路径顺序的 (路径, 标题, 歌手, 专辑)"""
+        where, args = root_filter(root)
+        sql = 'SELECT path, title, artist, album FROM tracks'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        with self._lock:
+            return self._db.execute(sql + ' ORDER BY path', args).fetchall()
+
+    def count(self, root=None):
+        where, args = root_filter(root)
+        sql = 'SELECT COUNT(*) FROM tracks'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        with self._lock:
+            return self._db.execute(sql, args).fetchone()[0]
+
+    def paths(self, offset, limit, root=None):
+        where, args = root_filter(root)
+        sql = 'SELECT path FROM tracks'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        with self._lock:
+            return [row[0] for row in self._db.execute(sql + ' ORDER BY path LIMIT ? OFFSET ?', args + [limit, offset])]
+
+    def page(self, offset=0, limit=50, order_by='path', artist=None, album=None, root=None):
+        """播放列表分页查询，可按歌手/专辑过滤"""
+        if order_by not in ORDER_COLUMNS:
+            raise ValueError(f"不支持的排序字段: {order_by}")
+        where, args = root_filter(root)
+        if artist is not None:
+            where.append('artist = ?')
+            args.append(artist)
+        if album is not None:
+            where.append('album = ?')
+            args.append(album)
+        sql = 'SELECT path, size, mtime, title, artist, album, duration FROM tracks'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY {order_by}, path LIMIT ? OFFSET ?'
+        with self._lock:
+            rows = self._db.execute(sql, args + [limit, offset]).fetchall()
+        keys = ('path', 'size', 'mtime', 'title', 'artist', 'album', 'duration')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class TrackList:
+    """按路径排序的曲目序列，按页从曲库读取，不在内存里保存整个列表；
+    root指定时只包含root下的曲目"""
+
+    def __init__(self, library, root=None, page_size=512, max_pages=64):
+        self.library = library
+        self.root = root
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._version = None
+        self._len = 0
+        self._pages = {}
+        # 界面线程和播放线程都会读
+        self._lock = threading.Lock()
+
+    def _sync(self):
+        if self._version != self.library.version:
+            self._version = self.library.version
+            self._len = self.library.count(self.root)
+            self._pages.clear()
+
+    def __len__(self):
+        with self._lock:
+            self._sync()
+            return self._len
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, index):
+        with self._lock:
+            self._sync()
+            if index < 0:
+                index += self._len
+            if not 0 <= index < self._len:
+                raise IndexError('曲目序号超出范围')
+            number, offset = divmod(index, self.page_size)
+            page = self._pages.get(number)
+            if page is None:
+                page = self.library.paths(number * self.page_size, self.page_size, self.root)
+                if len(self._pages) >= self.max_pages:
+                    self._pages.clear()
+                self._pages[number] = page
+            return page[offset]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def index(self, path):
+        """同list.index：返回曲目的序号，不在曲库里时抛出ValueError"""
+        path = os.path.abspath(path)
+        if self.library.lookup(path) is None or not self._contains(path):
+            raise ValueError(f'曲目不在曲库里: {path}')
+        return self.library.position(path, self.root)
+
+    def bisect(self, path):
+        """path按顺序应插入的位置（曲目不存在时就是它后面那首的序号）"""
+        return self.library.position(os.path.abspath(path), self.root)
+
+    def _contains(self, path):
+        if self.root is None:
+            return True
+        lo, hi = root_range(self.root)
+        return lo <= path < hi
+
+    def __repr__(self):
+        return f'<TrackList {len(self)} 首>'
@@ -0,0 +1,28 @@
+_MISSING = object()
+
+
+class ViewModel:
+    """记录每个控件上次渲染的选项，只有真正变化时才调用configure"""
+
+    def __init__(self):
+        self._rendered = {}
+        self.updates = 0
+        self.skipped = 0
+
+    def set(self, widget, **options):
+        rendered = self._rendered.setdefault(str(widget), {})
+        changed = {key: value for key, value in options.items() if rendered.get(key, _MISSING) != value}
+        if not changed:
+            self.skipped += 1
+            return False
+        widget.configure(**changed)
+        rendered.update(changed)
+        self.updates += 1
+        return True
+
+    def forget(self, widget):
+        """控件被外部直接修改过时调用，下次set会完整推送"""
+        self._rendered.pop(str(widget), None)
+
+    def stats(self):
+        return {'updates': self.updates, 'skipped': self.skipped}
@@ -0,0 +1,144 @@
+import os
+import threading
+from collections import OrderedDict
+from audio_duration import probe_duration
+from loudness import content_hash
+from metadata_cache import file_signature
+from seek_index import build_seek_index, decode_segments
+
+# 每首的桶数：和进度条在原始像素图里的宽度一致，一个桶一列像素
+WAVEFORM_BUCKETS = 183
+
+
+def summarize_file(path, buckets=WAVEFORM_BUCKETS):
+    """在分析进程里运行：按寻址表把文件切成若干段逐段解码，一遍算出每个桶的 最小/最大/RMS。
+    返回 最小值(int8)+最大值(int8)+RMS(uint8) 共 3*buckets 字节；没有寻址表的格式返回None"""
+    import numpy as np
+    import pygame
+    index = build_seek_index(path)
+    duration = probe_duration(path)
+    if index is None or not duration:
+        return None
+    rate = pygame.mixer.get_init()[0]
+    total = max(int(duration * rate), 1)
+    lows = np.full(buckets, np.inf, dtype=np.float32)
+    highs = np.full(buckets, -np.inf, dtype=np.float32)
+    squares = np.zeros(buckets)
+    counts = np.zeros(buckets, dtype=np.int64)
+
+    for start, pcm in decode_segments(path, index, duration):
+        if len(pcm):
+            x = pcm.astype(np.float32) / 32768
+            position = int(round(start * rate)) + np.arange(len(x), dtype=np.int64)
+            slot = np.minimum(position * buckets // total, buckets - 1)
+            # 采样按时间递增，桶号不减：每个桶在这一段里是连续的一截
+            starts = np.flatnonzero(np.diff(slot, prepend=-1))
+            touched = slot[starts]
+            lows[touched] = np.minimum(lows[touched], np.minimum.reduceat(x.min(axis=1), starts))
+            highs[touched] = np.maximum(highs[touched], np.maximum.reduceat(x.max(axis=1), starts))
+            squares[touched] += np.add.reduceat((x * x).mean(axis=1), starts)
+            counts[touched] += np.diff(np.append(starts, len(x)))
+
+    filled = counts > 0
+    lows[~filled] = 0
+    highs[~filled] = 0
+    rms = np.sqrt(squares / np.maximum(counts, 1))
+    return (np.round(np.clip(lows, -1, 1) * 127).astype(np.int8).tobytes()
+            + np.round(np.clip(highs, -1, 1) * 127).astype(np.int8).tobytes()
+            + np.round(np.clip(rms, 0, 1) * 255).astype(np.uint8).tobytes())
+
+
+def unpack_summary(data):
+    """返回 (最小值, 最大值, RMS) 三个 -1~1 / 0~1 的数组"""
+    import numpy as np
+    buckets = len(data) // 3
+    lows = np.frombuffer(data, dtype=np.int8, count=buckets) / 127
+    highs = np.frombuffer(data, dtype=np.int8, count=buckets, offset=buckets) / 127
+    rms = np.frombuffer(data, dtype=np.uint8, count=buckets, offset=buckets * 2) / 255
+    return lows, highs, rms
+
+
+def render_waveform(data, height, fill, peak, body):
+    """把摘要画成 桶数 x height 的像素图（原始像素大小，由调用方放大）：
+    底色fill，峰值范围用peak色，RMS范围用body色，以中线上下对称"""
+    import numpy as np
+    from PIL import Image
+    from sprites import hex_to_rgba
+    lows, highs, rms = unpack_summary(data)
+    half = height / 2
+    rows = (np.arange(height) + 0.5 - half)[:, None] / half
+    # 各列的峰值/RMS高度按整像素取，保持像素风格
+    step = 1 / half
+    top = np.ceil(np.maximum(highs, -lows) / step) * step
+    level = np.ceil(np.minimum(rms * np.sqrt(2), 1) / step) * step
+    image = np.empty((height, len(lows), 4), dtype=np.uint8)
+    image[:] = hex_to_rgba(fill)
+    image[np.abs(rows) <= top[None, :]] = hex_to_rgba(peak)
+    image[np.abs(rows) <= level[None, :]] = hex_to_rgba(body)
+    return Image.fromarray(image, 'RGBA')
+
+
+class WaveformSummarizer:
+    """波形摘要：每首几百字节，按文件摘要存进曲库；没有时交给后台进程计算。
+    request() 在播放线程里调用，不等待计算；界面线程只用 peek() 读内存里的结果。"""
+
+    def __init__(self, library, pool, buckets=WAVEFORM_BUCKETS, maxsize=64):
+        self.library = library
+        # pool() 返回进程池（与响度分析共用）
+        self.pool = pool
+        self.buckets = buckets
+        self.maxsize = maxsize
+        self.computed = 0
+        self._summaries = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def peek(self, file_path):
+        with self._lock:
+            return self._summaries.get(os.path.abspath(file_path))
+
+    def _remember(self, path, data):
+        with self._lock:
+            self._summaries[path] = data
+            self._summaries.move_to_end(path)
+            while len(self._summaries) > self.maxsize:
+                self._summaries.popitem(last=False)
+
+    def request(self, file_path):
+        path = os.path.abspath(file_path)
+        with self._lock:
+            if path in self._summaries or path in self._pending or self._closed:
+                return
+        if file_signature(path) is None:
+            return
+        digest = content_hash(path)
+        data = self.library.lookup_waveform(digest, self.buckets)
+        if data is not None:
+            self._remember(path, data)
+            return
+        with self._lock:
+            self._pending.add(path)
+        future = self.pool().submit(summarize_file, path, self.buckets)
+        future.add_done_callback(lambda f: self._finished(path, digest, f))
+
+    def _finished(self, path, digest, future):
+        try:
+            data = future.result()
+        except Exception as e:
+            if not future.cancelled() and not self._closed:
+                print(f"波形摘要失败: {e}")
+            data = None
+        with self._lock:
+            self._pending.discard(path)
+            closed = self._closed
+        if data is None:
+            return
+        if not closed:
+            self.library.save_waveform(digest, self.buckets, data)
+        self._remember(path, data)
+        self.computed += 1
+
+    def close(self):
+        with self._lock:
+            self._closed = True